@@ -0,0 +1,60 @@
+"""
+Measure peak Python memory while fetching the whole /api/v1/articles
+listing, following the `next` cursor from page to page at the largest
+page size the API allows. Each page's rows are read into a list before
+it is sent, so peak use should grow with the page size, which is capped
+at ARTICLES_MAX_LIMIT, but not with the number of articles.
+
+    PYTHONPATH=src/tools python benchmarks/bench_articles.py
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import docs
+import serve
+
+SIZES = (50, 5_000, 500_000)
+
+
+def populate(n):
+    with docs.connection() as conn:
+        conn.executemany(
+            """INSERT INTO documents (documentId, title, slug) VALUES (?, ?, ?)""",
+            ((f"doc-{i}", f"Title {i}", f"title-{i}") for i in range(n)),
+        )
+        conn.commit()
+
+
+def main(sizes=SIZES):
+    client = serve.app.test_client()
+    print(f"{'articles':>10} {'bytes sent':>12} {'peak (KiB)':>11}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            docs.init_db(os.path.join(tmp, "docs.db"))
+            populate(n)
+            tracemalloc.start()
+            response = client.get(
+                f"/api/v1/articles?limit={serve.ARTICLES_MAX_LIMIT}", buffered=False
+            )
+            sent = 0
+            # Follow the cursor through the whole listing.
+            while True:
+                body = b"".join(response.response)
+                sent += len(body)
+                after = serve.json.loads(body)["next"]
+                if after is None:
+                    break
+                response = client.get(
+                    f"/api/v1/articles?limit={serve.ARTICLES_MAX_LIMIT}&after={after}",
+                    buffered=False,
+                )
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            docs.shutdown_db()
+        print(f"{n:>10} {sent:>12} {peak / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
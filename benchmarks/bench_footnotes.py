@@ -0,0 +1,77 @@
+"""
+Compare rendering the footnotes of a footnote-heavy document one at a
+time, as the renderer used to, with rendering them in one pass, both
+with an empty footnote cache and with the footnotes of the revision
+already cached.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_footnotes.py
+"""
+import sys
+import timeit
+
+import model
+import synthetic
+import walk_blog
+from doc_utils import classify_document
+from doc_utils import paragraphs_from
+from doc_utils import tag_sections
+from walk_blog import Renderer
+
+
+class PerFootnoteRenderer(Renderer):
+    """
+    The footnotes rendered as they were, as separate fragments per footnote.
+    """
+
+    def render_footnotes(self, document, footnote_tags):
+        chunks = ["<h3>Footnotes</h3>\n        <ol id=\"footnotes\">\n"]
+        for number, id in self.footnote_map.items():
+            chunks.append(f"""        <li id="footnote-{number}">""")
+            chunks.extend(
+                self.render_paragraphs(
+                    paragraphs_from(document.footnotes[id], footnote_tags[id])
+                )
+            )
+        chunks.append("\n            </ol>\n")
+        return "".join(chunks)
+
+
+def footnotes_only(cls, document, tags):
+    """
+    Render the body, untimed, then time rendering the footnotes.
+    """
+    renderer = cls()
+    body_tags, footnote_tags = tag_sections(document, tags)
+    "".join(renderer.render_paragraphs(paragraphs_from(document.body, body_tags)))
+    start = timeit.default_timer()
+    html = renderer.render_footnotes(document, footnote_tags)
+    return timeit.default_timer() - start, html
+
+
+def main(footnotes=2000):
+    document = model.from_dict(
+        synthetic.build(paragraphs=footnotes, runs=10, footnotes=footnotes, raw=True)
+    )
+    tags = classify_document(document)
+    print(f"{footnotes} footnotes")
+    cases = (
+        ("per footnote", PerFootnoteRenderer, False),
+        ("one pass, cold", Renderer, False),
+        ("one pass, cached", Renderer, True),
+    )
+    results = []
+    for name, cls, warm in cases:
+        times = []
+        for _ in range(20):
+            walk_blog.footnote_cache.clear()
+            if warm:
+                footnotes_only(cls, document, tags)
+            seconds, html = footnotes_only(cls, document, tags)
+            times.append(seconds)
+        results.append(html)
+        print(f"{name:>20}: {min(times) * 1000:8.2f} ms")
+    assert len(set(results)) == 1, "renderers disagree"
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,90 @@
+"""
+Compare rendering with the HTML fragments built by f-strings, as the
+renderer used to (without escaping), with rendering from the macros in
+jinja_templates/fragments.html: flattened without and with the escaping of
+text the renderer now does, and called as ordinary macros.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_fragments.py
+"""
+import sys
+import timeit
+
+import model
+import synthetic
+from doc_utils import paragraphs_from
+from markupsafe import Markup
+from templates import macro
+from walk_blog import FRAGMENTS
+from walk_blog import Renderer
+
+
+class FStringRenderer(Renderer):
+    """
+    The renderer as it was, with f-strings, no escaping and spans
+    looked up by style key.
+    """
+
+    def render_structuralElements(self, p):
+        c_list = []
+        for element in p.elements:
+            e_type = element.kind
+            if e_type == "textRun":
+                style = element.style
+                content = element.content
+                if style.link_url:
+                    content = f"""<a href="{style.link_url}">{content}</a>"""
+                start, end = self.styles.tags(style.key)
+                c_list.append(f"{start}{content}{end}")
+            elif e_type == "footnoteReference":
+                number = element.number
+                c_list.append(f"""<a href="#footnote-{number}">[{number}]</a>""")
+                self.footnote_map[number] = element.footnote_id
+        return "".join(c_list)
+
+    def render_normal_text(self, p):
+        return f"""\
+<p class="normal_text">
+{self.render_structuralElements(p)}
+</p>
+"""
+
+
+class UnescapedRenderer(FStringRenderer):
+    """
+    Paragraphs from the flattened fragment, but runs as they were,
+    to separate the cost of the templates from that of escaping.
+    """
+
+    def render_normal_text(self, p):
+        return self.normal_text_html(Markup(self.render_structuralElements(p)))
+
+
+class MacroRenderer(Renderer):
+    """
+    Calling the fragment macros rather than their flattened forms.
+    """
+
+    def render_normal_text(self, p):
+        content = Markup(self.render_structuralElements(p))
+        return str(macro(FRAGMENTS, "normal_text")(content))
+
+
+def main(paragraphs=2000, rounds=20):
+    document = model.from_dict(synthetic.build(paragraphs, runs=20, raw=True))
+    print(f"{paragraphs} paragraphs, {paragraphs * 20} text runs")
+    renderers = (FStringRenderer, UnescapedRenderer, Renderer, MacroRenderer)
+    # The renderers take turns, so a change in the machine's speed part
+    # way through affects them all alike.
+    times = {cls: [] for cls in renderers}
+    for _ in range(rounds):
+        for cls in renderers:
+            renderer = cls()
+            start = timeit.default_timer()
+            "".join(renderer.render_paragraphs(paragraphs_from(document.body)))
+            times[cls].append(timeit.default_timer() - start)
+    for cls, seconds in times.items():
+        print(f"{cls.__name__:>20}: {paragraphs / min(seconds):9.0f} paragraphs/s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""
+Time SQLDoc.load and SQLDoc.by_slug against document stores of
+increasing size. With the documentId and slug indexes in place the
+per-lookup cost should stay roughly flat as the store grows.
+
+    PYTHONPATH=src/tools python benchmarks/bench_lookup.py
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+import docs
+from docs import SQLDoc
+
+SIZES = (100, 1_000, 10_000, 100_000)
+LOOKUPS = 2_000
+
+
+def populate(n):
+    with docs.connection() as conn:
+        conn.executemany(
+            """INSERT INTO documents (documentId, title, slug, html) VALUES (?, ?, ?, ?)""",
+            (
+                (f"doc-{i}", f"Title {i}", f"title-{i}", "<p>x</p>" * 100)
+                for i in range(n)
+            ),
+        )
+        conn.commit()
+
+
+def main(sizes=SIZES):
+    print(f"{'documents':>10} {'load (us)':>10} {'by_slug (us)':>13}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            docs.init_db(os.path.join(tmp, "docs.db"))
+            populate(n)
+            ids = [random.randrange(n) for _ in range(LOOKUPS)]
+            by_id = timeit.timeit(
+                lambda: [SQLDoc(f"doc-{i}").load() for i in ids], number=1
+            )
+            by_slug = timeit.timeit(
+                lambda: [SQLDoc.by_slug(f"title-{i}") for i in ids], number=1
+            )
+            docs.shutdown_db()
+        print(f"{n:>10} {by_id / LOOKUPS * 1e6:>10.1f} {by_slug / LOOKUPS * 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
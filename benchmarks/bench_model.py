@@ -0,0 +1,67 @@
+"""
+Compare decoding a document into ObjectDicts, as Record.document does,
+with building the slotted document model, and the time to walk every
+text run of each. Run on a document the size of a typical post and
+on one of about 10 MB.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_model.py
+"""
+import json
+import sys
+import timeit
+
+import model
+import synthetic
+from hu import ObjectDict as OD
+
+
+def walk_od(document):
+    count = 0
+    for element in document.body.content:
+        if "paragraph" in element:
+            for pe in element.paragraph.elements:
+                if "textRun" in pe:
+                    count += len(pe.textRun.content)
+                    pe.textRun.textStyle.get("bold")
+    return count
+
+
+def walk_model(document):
+    count = 0
+    for element in document.body:
+        if element.kind == "paragraph":
+            for pe in element.elements:
+                if pe.kind == "textRun":
+                    count += len(pe.content)
+                    pe.style.bold
+    return count
+
+
+def best(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def compare(label, paragraphs, repeat):
+    text = json.dumps(synthetic.build(paragraphs, runs=20, raw=True))
+    od = OD(json.loads(text))
+    doc = model.from_json(text)
+    assert walk_od(od) == walk_model(doc)
+    print(f"{label}: {len(text) / 1e6:.2f} MB of JSON ({model.loads.__module__})")
+    rows = (
+        ("json.loads + OD", lambda: OD(json.loads(text)), lambda: walk_od(od)),
+        ("model.from_json", lambda: model.from_json(text), lambda: walk_model(doc)),
+    )
+    for name, decode, walk in rows:
+        print(
+            f"{name:>20}: decode {best(decode, repeat) * 1000:9.2f} ms,"
+            f" walk {best(walk, repeat) * 1000:8.2f} ms"
+        )
+
+
+def main(small=40, large=6000):
+    compare("post-sized", small, repeat=50)
+    compare("large", large, repeat=3)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
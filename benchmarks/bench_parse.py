@@ -0,0 +1,130 @@
+"""
+Compare the cost of parsing a document with parse_blog.MyDoc, whose
+handlers are bound once per class and tuple of item names and whose list
+hooks parse their items without a call per item, recursively and
+iteratively, with the dispatch it replaced, and with hand-written
+walks over the same elements, which have no dispatch at all. The first
+walk only collects the text runs; the second also does the work MyDoc's
+hooks do (looking for each item name, and pushing and popping styles),
+so the difference between it and MyDoc is the cost of the dispatch.
+Debug output is turned off, as the overhead of unused debug messages is
+part of what is compared.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_parse.py
+"""
+
+import sys
+import timeit
+
+import parse_blog
+import synthetic
+from parse_blog import debug
+from parse_blog import ELEMENT_ITEMS
+from parse_blog import MyDoc
+from styles import StyleStack
+
+
+class GetattrDoc(MyDoc):
+    """
+    The dispatch as it was: a getattr for every item, a new list of
+    ancestors for every level and debug messages formatted whether
+    or not they are printed.
+    """
+
+    def parse(self, element, element_name, item_names, exit=None):
+        ancestors = self.ancestors
+        path = ancestors + [element_name]
+        debug("parse", f"Parsing {'.'.join(path)}")
+        for item_name in item_names:
+            if item_name in element:
+                method = getattr(
+                    self, f"parse_{item_name}", self.parse_unrecognised_part_name
+                )
+                debug("parse", "Handling", ".".join(path + [item_name]))
+                self.ancestors = path
+                method(element=element[item_name], element_name=item_name)
+                self.ancestors = ancestors
+        if exit is not None:
+            exit()
+        debug("parse", f"Parse of {'.'.join(path)} complete")
+
+
+def walk(document):
+    """
+    Collect the text runs that MyDoc collects, without dispatching.
+    """
+    content = []
+    for element in document["body"]["content"]:
+        paragraph = element.get("paragraph")
+        if paragraph is not None:
+            for pe in paragraph["elements"]:
+                run = pe.get("textRun")
+                if run is not None:
+                    content.append((run.get("textStyle", ""), run["content"]))
+    return content
+
+
+def work(document):
+    """
+    Collect the text runs as walk does, doing the work of MyDoc's hooks
+    but without dispatching.
+    """
+    content = []
+    p_styles = StyleStack("paragraph")
+    t_styles = StyleStack("text")
+    for element in document["body"]["content"]:
+        paragraph = element.get("paragraph")
+        if paragraph is not None:
+            p_styles.push(paragraph.get("paragraphStyle"))
+            for pe in paragraph["elements"]:
+                for item_name in ELEMENT_ITEMS:
+                    if item_name not in pe:
+                        continue
+                    if item_name == "textRun":
+                        run = pe[item_name]
+                        style = run.get("textStyle", "")
+                        t_styles.push(style or None)
+                        content.append((style, run["content"]))
+                        t_styles.pop()
+            p_styles.pop()
+    return content
+
+
+def parse(cls, document, iterative=False):
+    parser = cls(iterative)
+    parser.parse_document(element=document)
+    return parser.content
+
+
+def main(paragraphs=2000, rounds=15):
+    parse_blog.DEBUG_FEATURE_FLAGS.clear()
+    document = synthetic.build(paragraphs, runs=20, raw=True)
+    print(f"{paragraphs} paragraphs, {paragraphs * 20} text runs")
+    cases = (
+        ("walk, no dispatch", walk),
+        ("hooks' work, no dispatch", work),
+        ("MyDoc", lambda document: parse(MyDoc, document)),
+        ("MyDoc, iterative", lambda document: parse(MyDoc, document, True)),
+        ("getattr dispatch", lambda document: parse(GetattrDoc, document)),
+    )
+    results = [function(document) for _, function in cases]
+    assert all(result == results[0] for result in results), "parsers disagree"
+    # The cases take turns, so a change in the machine's speed part way
+    # through affects them all alike.
+    times = {name: [] for name, _ in cases}
+    for _ in range(rounds):
+        for name, function in cases:
+            start = timeit.default_timer()
+            function(document)
+            times[name].append(timeit.default_timer() - start)
+    walked, worked = (min(times[name]) for name, _ in cases[:2])
+    for name, seconds in times.items():
+        seconds = min(seconds)
+        print(
+            f"{name:>24}: {seconds * 1000:8.2f} ms"
+            f" {seconds / walked:6.2f}x {seconds / worked:6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
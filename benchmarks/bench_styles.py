@@ -0,0 +1,63 @@
+"""
+Compare rendering text runs with one compiled CSS class per distinct
+style against the previous approach of an inline style on every span.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_styles.py
+"""
+import sys
+import timeit
+
+import model
+import synthetic
+from doc_utils import paragraphs_from
+from walk_blog import Renderer
+
+STYLE_PROPERTIES = (
+    lambda s: "font-weight:bold" if s.bold else None,
+    lambda s: "font-style:italic" if s.italic else None,
+    lambda s: None if s.font_size is None else f"font-size:{s.font_size}pt",
+    lambda s: f"font-family:{s.font_family}" if s.font_family else None,
+)
+
+
+class InlineStyleRenderer(Renderer):
+    """
+    The renderer as it was, with an inline style attribute per span.
+    """
+
+    def render_structuralElements(self, p):
+        c_list = []
+        for element in p.elements:
+            style = element.style
+            content = element.content
+            style_set = [css(style) for css in STYLE_PROPERTIES]
+            style_set = [css for css in style_set if css]
+            if style_set:
+                content = f"""<span style="{'; '.join(style_set)}">{content}</span>"""
+            c_list.append(content)
+        return "".join(c_list)
+
+
+def main(paragraphs=2000):
+    document = model.from_dict(synthetic.build(paragraphs, runs=40, raw=True))
+    runs = paragraphs * 40
+    print(f"{paragraphs} paragraphs, {runs} text runs")
+    for cls in (InlineStyleRenderer, Renderer):
+        html = cls().render(document)
+        seconds = min(
+            timeit.repeat(
+                lambda: "".join(
+                    cls().render_paragraphs(paragraphs_from(document.body))
+                ),
+                number=1,
+                repeat=5,
+            )
+        )
+        print(
+            f"{cls.__name__:>20}: {seconds / runs * 1e6:6.2f} us/run,"
+            f" {len(html):>9} bytes of HTML"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
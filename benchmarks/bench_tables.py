@@ -0,0 +1,61 @@
+"""
+Render a table-heavy document, comparing the renderer's dispatch
+tables, resolved once per class, with looking each element's handler
+up by name as it is rendered.
+
+    PYTHONPATH=src/tools:benchmarks python benchmarks/bench_tables.py
+"""
+import sys
+import timeit
+
+import model
+import synthetic
+from doc_utils import classify_document
+from doc_utils import elements_from
+from walk_blog import ELEMENT_RENDERERS
+from walk_blog import Renderer
+from walk_blog import STYLE_RENDERERS
+
+
+class ByNameRenderer(Renderer):
+    """
+    Handlers found with getattr for every element.
+    """
+
+    def render_paragraphs(self, paragraph_stream):
+        for tag, element in paragraph_stream:
+            name = ELEMENT_RENDERERS.get(tag)
+            if name is None:
+                yield from super().render_paragraphs([(tag, element)])
+            else:
+                yield getattr(self, name)(element)
+
+    def render_styled(self, p):
+        return getattr(self, STYLE_RENDERERS[p.style_type])(p)
+
+
+def main(tables=200):
+    document = model.from_dict(synthetic.build_tables(tables, raw=True))
+    tags = classify_document(document)
+    cells = sum(len(row) for t in document.body[2::3] for row in t.rows)
+    print(f"{tables} tables, {cells} cells")
+    results = []
+    for cls in (ByNameRenderer, Renderer):
+        seconds = min(
+            timeit.repeat(
+                lambda: "".join(
+                    cls().render_paragraphs(elements_from(document.body, tags))
+                ),
+                number=1,
+                repeat=15,
+            )
+        )
+        results.append(
+            "".join(cls().render_paragraphs(elements_from(document.body, tags)))
+        )
+        print(f"{cls.__name__:>20}: {cells / seconds:9.0f} cells/s")
+    assert len(set(results)) == 1, "renderers disagree"
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""
+Build synthetic Google Docs documents for benchmarking.
+"""
+import itertools
+
+from hu import ObjectDict as OD
+
+STYLES = [
+    {},
+    {"bold": True},
+    {"italic": True},
+    {"bold": True, "italic": True},
+    {"fontSize": {"magnitude": 11, "unit": "PT"}},
+    {"weightedFontFamily": {"fontFamily": "Georgia", "weight": 400}},
+    {"fontSize": {"magnitude": 14, "unit": "PT"}, "bold": True},
+]
+WORDS = "the quick brown fox jumps over a lazy dog".split()
+
+
+def text_run(content, style=None):
+    return {"textRun": {"content": content, "textStyle": dict(style or {})}}
+
+
+def paragraph(elements, style="NORMAL_TEXT"):
+    return {
+        "startIndex": 1,
+        "endIndex": 2,
+        "paragraph": {
+            "elements": elements,
+            "paragraphStyle": {"namedStyleType": style},
+        },
+    }
+
+
+def styled_paragraph(runs, styles=STYLES):
+    cycle = itertools.cycle(styles)
+    words = itertools.cycle(WORDS)
+    elements = [text_run(f"{next(words)} ", next(cycle)) for _ in range(runs - 1)]
+    elements.append(text_run("end.\n"))
+    return paragraph(elements)
+
+
+def build(paragraphs=100, runs=20, footnotes=0, raw=False):
+    """
+    A document of `paragraphs` paragraphs of `runs` differently-styled
+    text runs each, the first `footnotes` of which carry a footnote.
+    Returns plain dicts if raw is true, ObjectDicts otherwise.
+    """
+    content = []
+    notes = {}
+    for n in range(paragraphs):
+        para = styled_paragraph(runs)
+        if n < footnotes:
+            footnote_id = f"kix.fn{n}"
+            para["paragraph"]["elements"].insert(
+                0,
+                {
+                    "footnoteReference": {
+                        "footnoteId": footnote_id,
+                        "footnoteNumber": str(n + 1),
+                    }
+                },
+            )
+            notes[footnote_id] = {
+                "footnoteId": footnote_id,
+                "content": [styled_paragraph(8)],
+            }
+        content.append(para)
+    document = {
+        "documentId": "synthetic",
+        "revisionId": "rev-1",
+        "title": "Synthetic",
+        "body": {"content": content},
+        "footnotes": notes,
+    }
+    return document if raw else OD(document)
+
+
+def table(rows, columns, runs=4):
+    """
+    A table of one styled paragraph of `runs` text runs per cell.
+    """
+    return {
+        "table": {
+            "rows": rows,
+            "columns": columns,
+            "tableRows": [
+                {
+                    "tableCells": [
+                        {"content": [styled_paragraph(runs)]} for _ in range(columns)
+                    ]
+                }
+                for _ in range(rows)
+            ],
+        }
+    }
+
+
+def build_tables(tables=100, rows=10, columns=5, raw=False):
+    """
+    A document of `tables` tables, each introduced by a heading and a
+    bulleted paragraph. Returns plain dicts if raw is true, ObjectDicts
+    otherwise.
+    """
+    content = []
+    for n in range(tables):
+        content.append(paragraph([text_run(f"Table {n}\n")], style="HEADING_4"))
+        item = paragraph([text_run("about the table\n")])
+        item["paragraph"]["bullet"] = {"listId": "list-1"}
+        content.append(item)
+        content.append(table(rows, columns))
+    document = {
+        "documentId": "synthetic-tables",
+        "revisionId": "rev-1",
+        "title": "Synthetic tables",
+        "body": {"content": content},
+        "footnotes": {},
+        "lists": {
+            "list-1": {"listProperties": {"nestingLevels": [{"glyphSymbol": "-"}]}}
+        },
+    }
+    return document if raw else OD(document)
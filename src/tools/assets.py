@@ -0,0 +1,229 @@
+"""
+assets.py: Local copies of the images in documents.
+
+Each image is downloaded once, by a fetcher that can be replaced, and
+kept in a content-addressed directory: the file is named by the SHA-256
+of its data, so an image used by several documents is stored once. When
+Pillow is installed narrower variants are made for srcset. Images are
+identified by keys, such as the (documentId, inlineObjectId) of an image
+in a document, rather than by the URIs they are downloaded from, which
+the Docs API changes on every request and expires soon after. Where the
+image with each key is stored is recorded by a cache (such as a
+docs.ImageCache), so no image is downloaded twice.
+"""
+import hashlib
+import os
+import threading
+import urllib.request
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+from templates import WEB_DIRECTORY
+
+ASSET_DIRECTORY = os.environ.get(
+    "ASSET_DIRECTORY", os.path.join(WEB_DIRECTORY, "assets", "images", "docs")
+)
+ASSET_URL = "/assets/images/docs"
+# The widths of the variants made of each image wider than them.
+VARIANT_WIDTHS = (320, 640, 1280)
+FETCH_TIMEOUT = 30
+# File extensions by the leading bytes of the image data.
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+# Formats that are resized; others (such as animated GIFs) are kept as they are.
+RESIZABLE = {"png", "jpg", "webp"}
+
+
+def fetch_url(uri: str) -> bytes:
+    with urllib.request.urlopen(uri, timeout=FETCH_TIMEOUT) as response:
+        return response.read()
+
+
+def extension_of(data: bytes) -> str:
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+
+def image_width(data: bytes) -> Optional[int]:
+    """
+    The width of an image in pixels, if Pillow can tell.
+    """
+    if PILImage is None:
+        return None
+    try:
+        with PILImage.open(BytesIO(data)) as image:
+            return image.width
+    except OSError:
+        return None
+
+
+def resize(data: bytes, width: int) -> bytes:
+    """
+    The image scaled to the given width, in its own format.
+    """
+    with PILImage.open(BytesIO(data)) as image:
+        height = max(1, round(image.height * width / image.width))
+        out = BytesIO()
+        image.resize((width, height), PILImage.LANCZOS).save(out, format=image.format)
+    return out.getvalue()
+
+
+@dataclass(frozen=True)
+class Asset:
+    """
+    A stored image and the widths of its variants, narrowest first.
+    """
+
+    hash: str
+    extension: str
+    width: Optional[int] = None
+    variants: Tuple[int, ...] = ()
+
+    def filename(self, width: Optional[int] = None) -> str:
+        if width is None:
+            return f"{self.hash}.{self.extension}"
+        return f"{self.hash}-{width}w.{self.extension}"
+
+    def url(self, width: Optional[int] = None) -> str:
+        return f"{ASSET_URL}/{self.filename(width)}"
+
+    def srcset(self) -> str:
+        sources = [f"{self.url(width)} {width}w" for width in self.variants]
+        sources.append(f"{self.url()} {self.width}w")
+        return ", ".join(sources)
+
+    def sizes(self) -> str:
+        return f"(max-width: {self.width}px) 100vw, {self.width}px"
+
+
+class AssetStore:
+    """
+    Downloads images into a directory on up to `workers` threads,
+    remembering through the cache (and for the life of the store) where
+    the image with each key is kept. A key requested again while it is
+    still being downloaded waits for that download rather than starting
+    another.
+    """
+
+    def __init__(
+        self,
+        cache=None,
+        directory: str = ASSET_DIRECTORY,
+        fetch: Callable[[str], bytes] = fetch_url,
+        workers: int = 4,
+        widths: Tuple[int, ...] = VARIANT_WIDTHS,
+    ):
+        self.cache = cache
+        self.directory = directory
+        self.fetch_data = fetch
+        self.workers = workers
+        self.widths = widths
+        self.known: Dict[Hashable, Asset] = {}
+        self.pending: Dict[Hashable, Future] = {}
+        # Reentrant, as a future's callback runs at once if it is already done.
+        self.lock = threading.RLock()
+
+    def get(self, key: Hashable) -> Optional[Asset]:
+        """
+        The asset already stored for a key, if there is one.
+        """
+        asset = self.known.get(key)
+        if asset is None and self.cache is not None:
+            row = self.cache.get(key)
+            if row is not None:
+                hash, extension, width, variants = row
+                widths = tuple(int(w) for w in variants.split(",") if w)
+                asset = self.known[key] = Asset(hash, extension, width, widths)
+        return asset
+
+    def fetch(self, sources: Dict[Hashable, str]) -> Dict[Hashable, Exception]:
+        """
+        Store the images, given the URI of each by key, whose keys aren't
+        already stored. Returns the exceptions raised for any that
+        couldn't be, by key.
+        """
+        missing = {key: uri for key, uri in sources.items() if self.get(key) is None}
+        if not missing:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                key: self.submit(executor, key, uri) for key, uri in missing.items()
+            }
+            wait(futures.values())
+        return {
+            key: future.exception()
+            for key, future in futures.items()
+            if future.exception() is not None
+        }
+
+    def submit(self, executor: ThreadPoolExecutor, key: Hashable, uri: str) -> Future:
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = executor.submit(self.store, key, uri)
+                future.add_done_callback(lambda _: self.done(key))
+        return future
+
+    def done(self, key: Hashable) -> None:
+        with self.lock:
+            del self.pending[key]
+
+    def store(self, key: Hashable, uri: str) -> Asset:
+        """
+        Download an image and write it, and its variants, to the directory.
+        """
+        # It may have been stored since it was found to be missing.
+        asset = self.get(key)
+        if asset is not None:
+            return asset
+        data = self.fetch_data(uri)
+        hash = hashlib.sha256(data).hexdigest()
+        extension = extension_of(data)
+        width = image_width(data)
+        variants = ()
+        if width is not None and extension in RESIZABLE:
+            variants = tuple(w for w in sorted(self.widths) if w < width)
+        asset = Asset(hash, extension, width, variants)
+        self.write(asset.filename(), lambda: data)
+        for w in variants:
+            self.write(asset.filename(w), lambda: resize(data, w))
+        if self.cache is not None:
+            self.cache.put(
+                key, hash, extension, width, ",".join(str(w) for w in variants)
+            )
+        self.known[key] = asset
+        return asset
+
+    def write(self, filename: str, content: Callable[[], bytes]) -> None:
+        """
+        Write a file unless it already exists: its name implies its content.
+        """
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as out:
+            out.write(content())
+        os.replace(temporary, path)
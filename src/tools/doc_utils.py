@@ -1,40 +1,146 @@
 """
 doc_utils.py: Useful utilities for working with Google Docs.
 """
+from array import array
+from typing import Dict
 from typing import Generator
 from typing import List
+from typing import Optional
 from typing import Tuple
 
-from hu import ObjectDict as OD
+from model import Document
+from model import Element
+from model import kind_of
+from model import Paragraph
+from model import StructuralElement
 
+# Classification tags, one byte per structural element.
+OTHER = 0  # neither a paragraph nor a table
+CODE = 1  # a single run in the code font
+BLANK = 2  # a single newline: code inside a code chunk, else ignored
+NORMAL = 3
+HEADING = 4
+STYLED = 5  # any other named style
+TABLE = 6
+LIST_ITEM = 7  # a paragraph with a bullet
 
-def para_type(para: OD, in_chunk: bool) -> Tuple[str, List[OD]]:
-    if is_code(para, in_chunk):
+# Change this whenever classification changes, to invalidate cached tags.
+TAGS_VERSION = 2
+
+
+def classify_paragraph(para: Paragraph) -> int:
+    elements = para.elements
+    if len(elements) == 1 and elements[0].kind == "textRun":
+        text_run = elements[0]
+        if text_run.style.font_family == "Consolas":
+            return CODE
+        if text_run.content == "\n":
+            return BLANK
+    if para.bullet is not None:
+        return LIST_ITEM
+    style_type = para.style_type
+    if style_type == "NORMAL_TEXT":
+        return NORMAL
+    if style_type.startswith("HEADING_"):
+        return HEADING
+    return STYLED
+
+
+def classify_element(element: StructuralElement) -> int:
+    kind = element.kind
+    if kind == "paragraph":
+        return classify_paragraph(element)
+    if kind == "table":
+        return TABLE
+    return OTHER
+
+
+def classify(content: List[StructuralElement]) -> array:
+    """
+    Tag each structural element in a list with its class.
+    """
+    return array("B", [classify_element(element) for element in content])
+
+
+def classify_document(document: Document) -> array:
+    """
+    The tags of the body followed by those of each footnote in turn.
+    """
+    tags = classify(document.body)
+    for content in document.footnotes.values():
+        tags.extend(classify(content))
+    return tags
+
+
+def tag_sections(document: Document, tags: array) -> Tuple[array, Dict[str, array]]:
+    """
+    Split the tags of a document into those of its body and of each footnote.
+    """
+    pos = len(document.body)
+    body, footnotes = tags[:pos], {}
+    for id, content in document.footnotes.items():
+        footnotes[id] = tags[pos : pos + len(content)]
+        pos += len(content)
+    if pos != len(tags):
+        raise ValueError("Tags do not match the document")
+    return body, footnotes
+
+
+def encode_tags(tags: array) -> bytes:
+    return bytes([TAGS_VERSION]) + tags.tobytes()
+
+
+def decode_tags(data: Optional[bytes], document: Document) -> Optional[array]:
+    """
+    Tags cached by encode_tags, or None if there are none (or they were
+    produced by another version of the classifier or from other content).
+    """
+    if not data or data[0] != TAGS_VERSION:
+        return None
+    tags = array("B", data[1:])
+    size = len(document.body) + sum(len(c) for c in document.footnotes.values())
+    return tags if len(tags) == size else None
+
+
+def para_type(
+    para: Paragraph, in_chunk: bool, tag: Optional[int] = None
+) -> Tuple[str, List[Element]]:
+    if tag is None:
+        tag = classify_paragraph(para)
+    if tag == CODE or (in_chunk and tag == BLANK):
         return "code", para.elements
-    return para.paragraphStyle.namedStyleType, para.elements
+    return para.style_type, para.elements
+
+
+def is_code(para: Paragraph, in_chunk: bool) -> bool:
+    return para_type(para, in_chunk)[0] == "code"
 
 
-def is_code(para: OD, in_chunk: bool) -> bool:
-    if len(para.elements) == 1:
-        text_run = para.elements[0].textRun
-        style = text_run.textStyle
-        if (
-            "weightedFontFamily" in style
-            and style.weightedFontFamily.fontFamily == "Consolas"
-        ) or (in_chunk and text_run.content == "\n"):
-            return True
-    return False
+def paragraphs_from(
+    content: List[StructuralElement], tags: Optional[array] = None
+) -> Generator[Tuple[int, Paragraph], None, None]:
+    """
+    Yield the tag and paragraph of each paragraph in the content.
+    """
+    if tags is None:
+        tags = classify(content)
+    for tag, element in zip(tags, content):
+        if tag != OTHER and tag != TABLE:
+            yield tag, element
 
 
-def paragraphs_from(content: List[OD]) -> Generator[OD, None, None]:
-    for element in content:
-        if element_type(element) == "paragraph":
-            yield element.paragraph
+def elements_from(
+    content: List[StructuralElement], tags: Optional[array] = None
+) -> Generator[Tuple[int, StructuralElement], None, None]:
+    """
+    Yield the tag and element of each paragraph and table in the content.
+    """
+    if tags is None:
+        tags = classify(content)
+    for tag, element in zip(tags, content):
+        if tag != OTHER:
+            yield tag, element
 
 
-def element_type(se: OD) -> str:
-    residuals = se.keys() - {"startIndex", "endIndex"}
-    assert len(residuals) == 1, "Unexpected key in structuralElement :{!r}".format(
-        sorted(se.keys())
-    )
-    return residuals.pop()
+def element_type(se: dict) -> str:
+    return kind_of(se)
@@ -1,15 +1,40 @@
+import argparse
+import base64
+import functools
+import hashlib
+import itertools
 import json
 import os
 import pickle
+import queue
+import random
+import socket
 import sqlite3 as db
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from typing import Tuple
 
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from hu import ObjectDict as OD
 from slugify import slugify
 
+from assets import AssetStore
+from model import image_uris
+
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ["https://www.googleapis.com/auth/documents.readonly"]
 
@@ -30,16 +55,21 @@ class Doc:
     def cached(self):
         return os.path.exists(self.cached_path)
 
-    def pull(self):
+    def pull(self, service=None):
         """
         Retrieve the subject document in its current form from Docs.
         """
-        creds = authenticate()
-        service = build("docs", "v1", credentials=creds)
+        timings = PullTimings(self.document_id)
+        if service is None:
+            service = docs_service(timings)
 
         # Retrieve the documents contents from the Docs service.
+        start = time.perf_counter()
         document = service.documents().get(documentId=self.document_id).execute()
+        timings.fetch = time.perf_counter() - start
         self.save(OD(document))
+        if timing_hook is not None:
+            timing_hook(timings)
 
     def save(self, document):
         with open(self.cached_path, "w") as file_pointer:
@@ -47,124 +77,933 @@ class Doc:
             json.dump(document, file_pointer)
 
 
-def open_db():
-    open_db.conn = db.connect("docs.db")
-    open_db.curs = open_db.conn.cursor()
-    open_db.curs.execute(
-        """
-        CREATE TABLE IF NOT EXISTS documents (
-            id integer primary key autoincrement,
-            documentId varchar,
-            json varchar,
-            html varchar,
-            title varchar,
-            slug varchar,
-            status varchar,
-            when_published datetime
+DB_PATH = "docs.db"
+POOL_SIZE = 4
+# Seconds to wait for a connection when all of them are in use.
+POOL_TIMEOUT = 10.0
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS documents (
+        id integer primary key autoincrement,
+        documentId varchar,
+        json varchar,
+        html varchar,
+        title varchar,
+        slug varchar,
+        status varchar,
+        when_published datetime
+    );
+    CREATE TABLE IF NOT EXISTS document_json (
+        documentId varchar NOT NULL,
+        revisionId varchar NOT NULL,
+        codec varchar NOT NULL,
+        data blob NOT NULL,
+        tags blob,
+        when_stored datetime DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (documentId, revisionId)
+    );
+    CREATE TABLE IF NOT EXISTS highlights (
+        hash varchar PRIMARY KEY,
+        lexer varchar NOT NULL,
+        html varchar NOT NULL,
+        when_stored datetime DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS document_images (
+        documentId varchar NOT NULL,
+        objectId varchar NOT NULL,
+        hash varchar NOT NULL,
+        extension varchar NOT NULL,
+        width integer,
+        variants varchar NOT NULL,
+        when_stored datetime DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (documentId, objectId)
+    )"""
+
+# Database paths whose schema has already been checked by this process.
+schema_checked = set()
+
+
+INDEXES = """
+    CREATE UNIQUE INDEX IF NOT EXISTS documents_documentId ON documents (documentId);
+    CREATE UNIQUE INDEX IF NOT EXISTS documents_slug ON documents (slug);
+    CREATE INDEX IF NOT EXISTS documents_published
+        ON documents (ifnull(when_published, ''), id);
+"""
+
+
+# Columns added since the original schema, with their definitions.
+ADDED_COLUMNS = {
+    "version": "integer NOT NULL DEFAULT 0",
+    "when_updated": "datetime",
+    "revisionId": "varchar",
+    "fetched_at": "datetime",
+    "content_hash": "varchar",
+    "rendered_hash": "varchar",
+    "renderer_version": "varchar",
+}
+
+
+def create_schema(conn):
+    conn.executescript(SCHEMA)
+    migrate_columns(conn)
+    migrate_indexes(conn)
+    migrate_hashes(conn)
+    conn.commit()
+
+
+def migrate_columns(conn):
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+    for name, definition in ADDED_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE documents ADD COLUMN {name} {definition}")
+
+
+def migrate_indexes(conn):
+    """
+    Databases created before the indexes existed may hold duplicate
+    documentIds (only the latest row is kept) or slugs (later rows are
+    given a disambiguating suffix), either of which would prevent the
+    unique indexes from being built.
+    """
+    conn.execute(
+        """DELETE FROM documents WHERE id NOT IN (
+            SELECT max(id) FROM documents GROUP BY documentId
         )"""
     )
-    return open_db.conn, open_db.curs
+    duplicates = conn.execute(
+        """SELECT d.id, d.slug FROM documents AS d
+           WHERE EXISTS (
+               SELECT 1 FROM documents AS e WHERE e.slug = d.slug AND e.id < d.id
+           )"""
+    ).fetchall()
+    for id, slug in duplicates:
+        conn.execute(
+            """UPDATE documents SET slug=? WHERE id=?""", (f"{slug}-{id}", id)
+        )
+    conn.executescript(INDEXES)
+
+
+try:
+    from compression import zstd
+except ImportError:  # Python < 3.14
+    zstd = None
+
+CODEC = "zstd" if zstd else "zlib"
+
+
+def compress(text):
+    """
+    Return the codec used and the compressed UTF-8 encoding of the text.
+    """
+    data = text.encode("utf-8")
+    if zstd:
+        return "zstd", zstd.compress(data)
+    return "zlib", zlib.compress(data)
+
+
+def decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    if codec == "zstd" and zstd:
+        return zstd.decompress(data).decode("utf-8")
+    raise ValueError(f"Cannot decompress {codec!r} data")
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def revision_of(document, text):
+    """
+    Documents fetched from the Docs API carry a revisionId; anything
+    else is identified by a hash of its JSON.
+    """
+    return document.get("revisionId") or content_hash(text)
+
+
+def store_json(conn, document_id, revision_id, text):
+    codec, data = compress(text)
+    conn.execute(
+        """INSERT OR REPLACE INTO document_json (documentId, revisionId, codec, data)
+           VALUES (?, ?, ?, ?)""",
+        (document_id, revision_id, codec, data),
+    )
+
+
+def migrate_storage(conn):
+    """
+    Move raw document JSON still held in the documents table
+    into compressed document_json rows.
+    """
+    rows = conn.execute(
+        """SELECT documentId, json FROM documents WHERE json IS NOT NULL"""
+    ).fetchall()
+    for document_id, text in rows:
+        revision_id = revision_of(json.loads(text), text)
+        store_json(conn, document_id, revision_id, text)
+        conn.execute(
+            """UPDATE documents SET json=NULL, revisionId=?, content_hash=?
+               WHERE documentId=?""",
+            (revision_id, content_hash(text), document_id),
+        )
+    conn.commit()
+    return len(rows)
+
+
+def migrate_hashes(conn):
+    """
+    Rows stored before content hashes were recorded would otherwise
+    look stale to every render. Their hashes are computed from their
+    current JSON, wherever it is kept.
+    """
+    rows = conn.execute(
+        """SELECT d.documentId, d.json, j.codec, j.data FROM documents AS d
+           LEFT JOIN document_json AS j
+             ON d.documentId = j.documentId AND d.revisionId = j.revisionId
+           WHERE d.content_hash IS NULL
+             AND (d.json IS NOT NULL OR j.data IS NOT NULL)"""
+    ).fetchall()
+    for document_id, text, codec, data in rows:
+        if text is None:
+            text = decompress(codec, data)
+        conn.execute(
+            """UPDATE documents SET content_hash=? WHERE documentId=?""",
+            (content_hash(text), document_id),
+        )
+
+
+def unique_slug(conn, title, document_id):
+    """
+    Slugify the title, adding a numeric suffix if some other
+    document already uses the slug.
+    """
+    base = slug = slugify(title)
+    n = 1
+    while conn.execute(
+        """SELECT 1 FROM documents WHERE slug=? AND documentId!=?""",
+        (slug, document_id),
+    ).fetchone():
+        n += 1
+        slug = f"{base}-{n}"
+    return slug
+
+
+class PoolTimeout(TimeoutError):
+    """
+    No connection became free within the pool's timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections shared by all threads in the
+    process. Connections are opened lazily, in WAL mode so readers are
+    never blocked by a writer, and handed back to the pool after use
+    rather than closed.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        if size < 1:
+            raise ValueError(f"Pool size must be positive, not {size!r}")
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connect(self):
+        conn = db.connect(
+            self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self.lock:
+            if self.path not in schema_checked:
+                create_schema(conn)
+                schema_checked.add(self.path)
+            self.connections.append(conn)
+        return conn
+
+    def acquire(self):
+        """
+        Return an idle connection, opening a new one if fewer than
+        `size` exist. Blocks while all connections are in use, raising
+        PoolTimeout if none is released within `timeout` seconds.
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(
+                f"No database connection free after {self.timeout} seconds"
+            )
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self.connect()
+            except Exception:
+                self.slots.release()
+                raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.idle = queue.LifoQueue()
 
 
-open_db.conn = open_db.curs = None
+pool = None
+
+# Callables to be notified, with its documentId, whenever a document changes.
+listeners = []
+
+
+def on_change(callback):
+    """
+    Register a callback to be called with the documentId of any document
+    this process saves, re-renders or deletes. Usable as a decorator.
+    """
+    listeners.append(callback)
+    return callback
+
+
+def notify(document_id):
+    for callback in listeners:
+        callback(document_id)
+
+
+def init_db(path=None, pool_size=None, timeout=None):
+    """
+    Establish the process-wide connection pool. Long-running users
+    (the Flask app) and one-shot commands (walk_blog.load) both call
+    this at startup and shutdown_db() when they have finished. The
+    DOCS_DB_PATH, DOCS_POOL_SIZE and DOCS_POOL_TIMEOUT environment
+    variables override the defaults.
+    """
+    global pool
+    if path is None:
+        path = os.environ.get("DOCS_DB_PATH", DB_PATH)
+    if pool_size is None:
+        pool_size = int(os.environ.get("DOCS_POOL_SIZE", POOL_SIZE))
+    if timeout is None:
+        timeout = float(os.environ.get("DOCS_POOL_TIMEOUT", POOL_TIMEOUT))
+    if pool is not None:
+        pool.close()
+    pool = ConnectionPool(path, pool_size, timeout)
+    return pool
+
+
+def shutdown_db():
+    global pool
+    if pool is not None:
+        pool.close()
+        pool = None
+
+
+def connection():
+    """
+    Borrow a connection from the pool for the duration of a with block,
+    creating the pool with default settings if necessary.
+    """
+    if pool is None:
+        init_db()
+    return pool.connection()
+
+
+class Record(OD):
+    """
+    A row from the documents table. The raw Docs JSON is only
+    decoded, into the `document` attribute, when first used.
+    """
+
+    def __missing__(self, key):
+        if key == "document" and "json" in self:
+            document = self["document"] = OD(json.loads(self["json"]))
+            return document
+        raise KeyError(key)
+
+
+class HighlightCache:
+    """
+    Highlighted code, by a hash of the code and its lexer (see
+    highlight.cache_key), shared by every document and process.
+    """
+
+    def get(self, key):
+        with connection() as conn:
+            row = conn.execute(
+                """SELECT html FROM highlights WHERE hash=?""", (key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, lexer, html):
+        with connection() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO highlights (hash, lexer, html)
+                   VALUES (?, ?, ?)""",
+                (key, lexer, html),
+            )
+            conn.commit()
+
+
+class ImageCache:
+    """
+    Where the image with each (documentId, inlineObjectId) key is stored
+    (see assets.AssetStore), as (hash, extension, width, variants) with
+    the variants' widths separated by commas, shared by every process.
+    """
+
+    def get(self, key):
+        with connection() as conn:
+            return conn.execute(
+                """SELECT hash, extension, width, variants FROM document_images
+                   WHERE documentId=? AND objectId=?""",
+                key,
+            ).fetchone()
+
+    def put(self, key, hash, extension, width, variants):
+        document_id, object_id = key
+        with connection() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO document_images
+                   (documentId, objectId, hash, extension, width, variants)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (document_id, object_id, hash, extension, width, variants),
+            )
+            conn.commit()
+
+
+# Local copies of the documents' images.
+stored_assets = AssetStore(ImageCache())
+
+
+def store_images(documents):
+    """
+    Download the images in (document_id, document) pairs that aren't
+    already stored. The URIs the Docs API gives for images change with
+    every request and expire after about half an hour, so this has to be
+    done as documents are fetched. Failures are reported and skipped.
+    """
+    sources = {
+        (document_id, object_id): uri
+        for document_id, document in documents
+        for object_id, uri in image_uris(document).items()
+    }
+    for (document_id, object_id), exc in stored_assets.fetch(sources).items():
+        print(f"Image {object_id} of {document_id} not stored: {exc}", file=sys.stderr)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    if not isinstance(values, list) or not all(
+        value is None or isinstance(value, (str, int)) for value in values
+    ):
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return values
+
+
+# Columns that document listings may select, filter or sort on. Listings
+# never need the raw JSON, so it is deliberately absent.
+LISTABLE_COLUMNS = (
+    "id",
+    "documentId",
+    "title",
+    "slug",
+    "status",
+    "when_published",
+    "html",
+    "version",
+    "when_updated",
+    "revisionId",
+)
+SORT_KEYS = ("id", "title", "slug", "status", "when_published", "when_updated")
+column_names = {name.lower(): name for name in LISTABLE_COLUMNS}
+
+
+def column(name, allowed=LISTABLE_COLUMNS):
+    """
+    Return the canonical spelling of a column name (SQLite column
+    names are case-insensitive), provided it is allowed.
+    """
+    canonical = column_names.get(name.strip().lower())
+    if canonical not in allowed:
+        raise ValueError(f"Unknown or disallowed document column {name!r}")
+    return canonical
+
+
+def parse_fields(fields) -> Tuple[str, ...]:
+    """
+    Accept either a comma-separated string or a sequence of names.
+    """
+    if isinstance(fields, str):
+        if fields.strip() == "*":
+            return LISTABLE_COLUMNS
+        fields = fields.split(",")
+    return tuple(column(name) for name in fields)
+
+
+def parse_order(order_by) -> Tuple[Tuple[str, bool], ...]:
+    """
+    Turn "when_published DESC, id" (or a sequence of such terms, where
+    a leading "-" also means descending) into (column, descending) pairs.
+    """
+    if not order_by:
+        return ()
+    if isinstance(order_by, str):
+        order_by = order_by.split(",")
+    result = []
+    for term in order_by:
+        words = term.split()
+        descending = False
+        if len(words) == 2 and words[1].upper() in ("ASC", "DESC"):
+            descending = words[1].upper() == "DESC"
+        elif len(words) != 1:
+            raise ValueError(f"Invalid sort term {term!r}")
+        name = words[0]
+        if name.startswith("-"):
+            name, descending = name[1:], True
+        result.append((column(name, SORT_KEYS), descending))
+    return tuple(result)
+
+
+@functools.lru_cache(maxsize=None)
+def select_sql(fields, order_by, status, published_after, published_before, limit):
+    """
+    Build the SQL for a listing. Only column names from the whitelists
+    ever reach the text, and every value is a parameter, so the number of
+    distinct statements is small and SQLite's statement cache reuses them.
+    """
+    sql = f"""SELECT {', '.join(fields)} FROM documents"""
+    conditions = []
+    if status:
+        conditions.append("status = ?")
+    if published_after:
+        conditions.append("when_published >= ?")
+    if published_before:
+        conditions.append("when_published < ?")
+    if conditions:
+        sql = f"{sql} WHERE {' AND '.join(conditions)}"
+    if order_by:
+        terms = (f"{name} DESC" if desc else name for (name, desc) in order_by)
+        sql = f"{sql} ORDER BY {', '.join(terms)}"
+    if limit:
+        sql = f"{sql} LIMIT ?"
+    return sql
+
+
+@dataclass(frozen=True)
+class DocumentQuery:
+    """
+    A validated listing of the documents table. Dates bound
+    the publication time as [published_after, published_before).
+    """
+
+    fields: Tuple[str, ...] = LISTABLE_COLUMNS
+    order_by: Tuple[Tuple[str, bool], ...] = ()
+    status: Optional[str] = None
+    published_after: Optional[str] = None
+    published_before: Optional[str] = None
+    limit: Optional[int] = None
+
+    @classmethod
+    def build(cls, fields="*", order_by=None, **filters) -> "DocumentQuery":
+        for name in ("published_after", "published_before"):
+            if filters.get(name) is not None:
+                filters[name] = str(filters[name])
+        return cls(parse_fields(fields), parse_order(order_by), **filters)
+
+    def statement(self):
+        sql = select_sql(
+            self.fields,
+            self.order_by,
+            self.status is not None,
+            self.published_after is not None,
+            self.published_before is not None,
+            self.limit is not None,
+        )
+        values = (
+            self.status,
+            self.published_after,
+            self.published_before,
+            self.limit,
+        )
+        return sql, [value for value in values if value is not None]
 
 
 class Documents:
-    def __init__(self):
-        self.conn, self.curs = open_db()
+    # Keyset pagination orders: each maps to the SQL expressions that
+    # make up its (unique) sort key.
+    page_keys = {
+        "id": ("id",),
+        "when_published": ("ifnull(when_published, '')", "id"),
+    }
+    fetch_size = 100
+
+    def list(self, order_by=None, fields="*", **filters):
+        """
+        Generate the selected fields of the documents, optionally in a
+        given order. Filter by status, published_after, published_before
+        and limit the number of rows by passing them as keywords.
+        """
+        sql, params = DocumentQuery.build(fields, order_by, **filters).statement()
+        with connection() as conn:
+            curs = conn.execute(sql, params)
+            while True:
+                rows = curs.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                yield from rows
 
-    def list(self, order_by=None, fields="*"):
-        sql = f"""SELECT {fields} FROM documents"""
-        if order_by:
-            sql = f"{sql} ORDER BY {order_by}"
-        self.curs.execute(sql)
-        yield from self.curs.fetchall()
+    def stale(self, renderer_version):
+        """
+        Generate the ids of documents whose HTML was not rendered
+        from their current JSON by the given renderer version.
+        """
+        with connection() as conn:
+            rows = conn.execute(
+                """SELECT documentId FROM documents
+                   WHERE content_hash IS NULL
+                      OR rendered_hash IS NOT content_hash
+                      OR renderer_version IS NOT ?
+                   ORDER BY id""",
+                (renderer_version,),
+            ).fetchall()
+        for (document_id,) in rows:
+            yield document_id
+
+    def page(self, fields="*", order_by="id", after=None, limit=None):
+        """
+        Generate (cursor, row) pairs for the rows following the one
+        with the given cursor in the given order. Passing a row's
+        cursor as `after` resumes the listing where that row left off.
+        """
+        if order_by not in self.page_keys:
+            raise ValueError(f"Cannot page documents by {order_by!r}")
+        keys = self.page_keys[order_by]
+        key_list = ", ".join(keys)
+        sql = f"""SELECT {', '.join(parse_fields(fields))}, {key_list} FROM documents"""
+        params = []
+        if after is not None:
+            params = decode_cursor(after)
+            if len(params) != len(keys):
+                raise ValueError(f"Invalid cursor {after!r}")
+            sql = f"""{sql} WHERE ({key_list}) > ({', '.join('?' for _ in keys)})"""
+            if len(keys) > 1:
+                # Implied by the comparison, but without it SQLite scans
+                # an expression index from the start instead of seeking.
+                sql = f"{sql} AND {keys[0]} >= ?"
+                params.append(params[0])
+        sql = f"{sql} ORDER BY {key_list}"
+        if limit is not None:
+            sql = f"{sql} LIMIT ?"
+            params.append(limit)
+        with connection() as conn:
+            curs = conn.execute(sql, params)
+            while True:
+                rows = curs.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield encode_cursor(row[-len(keys) :]), row[: -len(keys)]
 
 
 class SQLDoc(Doc):
-    field_list = "id, documentId, json, html, title, slug, status"
+    field_list = (
+        "id, documentId, json, html, title, slug, status,"
+        " version, when_updated, revisionId, fetched_at, content_hash,"
+        " rendered_hash, renderer_version"
+    )
     fields = field_list.split(", ")
+    # Loadable alongside the fields, but held with the current JSON.
+    json_fields = ("tags",)
 
     def __init__(self, document_id):
         super().__init__(document_id)
 
-    def open_db(self):
-        self.conn, self.curs = open_db()
-
-    def close_db(self):
-        self.conn.close()
-        self.conn = self.curs = None
+    @classmethod
+    def by_slug(cls, slug):
+        """
+        Return the document with the given slug, or None if there is none.
+        """
+        with connection() as conn:
+            row = conn.execute(
+                """SELECT documentId FROM documents WHERE slug=?""", (slug,)
+            ).fetchone()
+        return None if row is None else cls(row[0])
 
     def cached(self):
-        self.open_db()
-        self.curs.execute(
-            """SELECT count(*) FROM documents as d WHERE d.documentId=?""",
-            (self.document_id,),
-        )
-        result = self.curs.fetchall()
-        self.close_db()
+        with connection() as conn:
+            result = conn.execute(
+                """SELECT count(*) FROM documents as d WHERE d.documentId=?""",
+                (self.document_id,),
+            ).fetchall()
         return result == [(1,)]
 
     def delete(self):
-        self.open_db()
-        self.curs.execute(
-            """DELETE FROM documents as d WHERE d.documentId=?""", (self.document_id,)
-        )
-        self.conn.commit()
-        self.close_db()
+        with connection() as conn:
+            conn.execute(
+                """DELETE FROM documents as d WHERE d.documentId=?""",
+                (self.document_id,),
+            )
+            conn.execute(
+                """DELETE FROM document_json WHERE documentId=?""", (self.document_id,)
+            )
+            conn.commit()
+        notify(self.document_id)
+
+    def load(self, fields=None) -> Record:
+        """
+        Load the document's row, or only the given fields of it. Page
+        views should avoid selecting the (potentially huge) json field.
+        """
+        if fields is None:
+            fields = self.fields
+        unknown = set(fields) - set(self.fields) - set(self.json_fields)
+        if unknown:
+            raise ValueError(f"Unknown document fields: {', '.join(sorted(unknown))}")
+        columns = [field for field in fields if field not in self.json_fields]
+        with connection() as conn:
+            row = conn.execute(
+                f"""SELECT {', '.join(columns) or 'documentId'} FROM documents
+                    WHERE documentId=?""",
+                (self.document_id,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"No document {self.document_id!r}")
+            record = Record(dict(zip(columns, row)))
+            if "json" in record and record.json is None:
+                record.json = self.current_json(conn)
+            if "tags" in fields:
+                # Not record.tags, which would try to make the bytes an OD.
+                record["tags"] = self.current_tags(conn)
+        return record
 
-    def load(self) -> OD:
-        self.open_db()
-        self.curs.execute(
-            f"""SELECT {self.field_list} FROM documents WHERE documentId=?""",
+    def current_json(self, conn):
+        row = conn.execute(
+            """SELECT j.codec, j.data FROM document_json AS j
+               JOIN documents AS d
+                 ON d.documentId = j.documentId AND d.revisionId = j.revisionId
+               WHERE d.documentId=?""",
             (self.document_id,),
-        )
-        result = OD(dict(zip(self.fields, self.curs.fetchone())))
-        self.close_db()
-        return result
+        ).fetchone()
+        return None if row is None else decompress(*row)
+
+    def current_tags(self, conn):
+        row = conn.execute(
+            """SELECT j.tags FROM document_json AS j
+               JOIN documents AS d
+                 ON d.documentId = j.documentId AND d.revisionId = j.revisionId
+               WHERE d.documentId=?""",
+            (self.document_id,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_tags(self, revision_id, tags):
+        """
+        Cache the paragraph classification of a revision with its JSON.
+        A revision stored without JSON in document_json has nowhere to
+        keep them, so is silently left alone.
+        """
+        with connection() as conn:
+            conn.execute(
+                """UPDATE document_json SET tags=?
+                   WHERE documentId=? AND revisionId=?""",
+                (tags, self.document_id, revision_id),
+            )
+            conn.commit()
+
+    def revisions(self):
+        """
+        Return (revisionId, when_stored) for each stored revision, oldest first.
+        """
+        with connection() as conn:
+            return conn.execute(
+                """SELECT revisionId, when_stored FROM document_json
+                   WHERE documentId=? ORDER BY when_stored, rowid""",
+                (self.document_id,),
+            ).fetchall()
+
+    def load_revision(self, revision_id) -> OD:
+        with connection() as conn:
+            row = conn.execute(
+                """SELECT codec, data FROM document_json
+                   WHERE documentId=? AND revisionId=?""",
+                (self.document_id, revision_id),
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"No revision {revision_id!r} of {self.document_id!r}")
+        return OD(json.loads(decompress(*row)))
 
     def save(self, document):
-        self.open_db()
-        self.curs.execute(
-            f"""SELECT {self.field_list} FROM documents WHERE documentId=?""",
-            (document.documentId,),
-        )
-        rows = self.curs.fetchall()
+        with connection() as conn:
+            changed = self.store(conn, document)
+            conn.commit()
+        store_images([(self.document_id, document)])
+        if changed:
+            notify(self.document_id)
+
+    def store(self, conn, document):
+        """
+        Write the document within the caller's transaction. Its JSON is
+        kept compressed in document_json, one row per revision. A document
+        whose content is unchanged only has its fetch time recorded.
+        Returns True if the document was written.
+        """
         title = (
             document.title
             if "title" in document and document.title
             else "+++ NO TITLE! +++"
         )
-        slug = slugify(title)
-        if not rows:
-            self.curs.execute(
-                """INSERT INTO documents (documentId, title, json, slug) VALUES (?, ?, ?, ?)""",
-                (self.document_id, title, json.dumps(document), slug),
+        text = json.dumps(document)
+        digest = content_hash(text)
+        row = conn.execute(
+            """SELECT content_hash FROM documents WHERE documentId=?""",
+            (self.document_id,),
+        ).fetchone()
+        if row is not None and row[0] == digest:
+            self.fetched(conn)
+            return False
+        revision_id = revision_of(document, text)
+        store_json(conn, self.document_id, revision_id, text)
+        slug = unique_slug(conn, title, self.document_id)
+        if row is None:
+            conn.execute(
+                """INSERT INTO documents (documentId, title, slug, revisionId,
+                       content_hash, fetched_at, when_updated)
+                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)""",
+                (self.document_id, title, slug, revision_id, digest),
             )
         else:
-            self.curs.execute(
-                """UPDATE documents SET title=?, json=?, slug=? WHERE documentId=?""",
-                (document.title, json.dumps(document), slug, document.documentId),
+            conn.execute(
+                """UPDATE documents SET title=?, json=NULL, slug=?, revisionId=?,
+                       content_hash=?, fetched_at=CURRENT_TIMESTAMP,
+                       version=version+1, when_updated=CURRENT_TIMESTAMP
+                   WHERE documentId=?""",
+                (title, slug, revision_id, digest, self.document_id),
             )
-        self.conn.commit()
-        self.close_db()
-
-    def set_html(self, html, title="** NO TITLE **"):
-        self.open_db()
-        self.curs.execute(
-            """UPDATE documents SET html=?, title=? WHERE documentId=?""",
-            (html, title, self.document_id),
+        return True
+
+    def fetched(self, conn):
+        conn.execute(
+            """UPDATE documents SET fetched_at=CURRENT_TIMESTAMP WHERE documentId=?""",
+            (self.document_id,),
         )
-        self.conn.commit()
-        self.close_db()
+
+    def stored_revision(self):
+        with connection() as conn:
+            row = conn.execute(
+                """SELECT revisionId FROM documents WHERE documentId=?""",
+                (self.document_id,),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def sync(self, service=None, retries=3, backoff=1.0):
+        """
+        Pull the document only if the Docs service reports a revision
+        other than the one stored, which costs a single metadata request.
+        Both requests retry transient failures, as fetch does. Returns
+        True if the document was pulled.
+        """
+        if service is None:
+            service = docs_service()
+        stored = self.stored_revision()
+        if stored is not None:
+            request = service.documents().get(
+                documentId=self.document_id, fields="revisionId"
+            )
+            remote = execute(request, retries, backoff)
+            if remote.get("revisionId") == stored:
+                with connection() as conn:
+                    self.fetched(conn)
+                    conn.commit()
+                return False
+        self.save(fetch(service, self.document_id, retries, backoff))
+        return True
+
+    def publish(self):
+        with connection() as conn:
+            conn.execute(
+                """UPDATE documents SET status='published',
+                       when_published=ifnull(when_published, CURRENT_TIMESTAMP),
+                       version=version+1, when_updated=CURRENT_TIMESTAMP
+                   WHERE documentId=?""",
+                (self.document_id,),
+            )
+            conn.commit()
+        notify(self.document_id)
+
+    def set_html(
+        self, html, title="** NO TITLE **", source_hash=None, renderer_version=None
+    ):
+        with connection() as conn:
+            self.store_html(conn, html, title, source_hash, renderer_version)
+            conn.commit()
+        notify(self.document_id)
+
+    def store_html(
+        self,
+        conn,
+        html,
+        title="** NO TITLE **",
+        source_hash=None,
+        renderer_version=None,
+    ):
+        """
+        Record rendered HTML within the caller's transaction, along with
+        the content_hash of the JSON and the version of the renderer that
+        produced it, so unchanged documents needn't be rendered again. A
+        row without a content_hash takes that of the JSON rendered.
+        """
+        conn.execute(
+            """UPDATE documents SET html=?, title=?,
+                   content_hash=ifnull(content_hash, ?),
+                   rendered_hash=?, renderer_version=?,
+                   version=version+1, when_updated=CURRENT_TIMESTAMP
+               WHERE documentId=?""",
+            (html, title, source_hash, source_hash, renderer_version, self.document_id),
+        )
+
+    def version(self):
+        """
+        Return the document's current version number, which increases
+        every time its row changes, or None if there is no such document.
+        """
+        with connection() as conn:
+            row = conn.execute(
+                """SELECT version FROM documents WHERE documentId=?""",
+                (self.document_id,),
+            ).fetchone()
+        return None if row is None else row[0]
 
 
-def authenticate():
-    creds = None
+def authenticate(creds=None):
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists("token.pickle"):
+    if creds is None and os.path.exists("token.pickle"):
         with open("token.pickle", "rb") as token:
             creds = pickle.load(token)
     # If there are no (valid) credentials available, let the user log in.
@@ -174,16 +1013,292 @@ def authenticate():
         else:
             flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
             creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.pickle", "wb") as token:
-            pickle.dump(creds, token)
+        save_credentials(creds)
     return creds
 
 
+def save_credentials(creds):
+    # Save the credentials for the next run
+    with open("token.pickle", "wb") as token:
+        pickle.dump(creds, token)
+
+
+# Credentials and the Docs service object are expensive to establish, so
+# each process keeps one of each. Credentials are refreshed in place on a
+# background timer REFRESH_MARGIN seconds before they expire, so the
+# service object (which holds a reference to them) remains usable.
+REFRESH_MARGIN = 300
+auth_lock = threading.Lock()
+cached_credentials = None
+cached_service = None
+refresh_timer = None
+
+
+def credentials():
+    global cached_credentials
+    with auth_lock:
+        if cached_credentials is None or not cached_credentials.valid:
+            cached_credentials = authenticate(cached_credentials)
+            schedule_refresh(cached_credentials)
+        return cached_credentials
+
+
+def schedule_refresh(creds):
+    """
+    Arrange for the credentials to be refreshed shortly before they
+    expire. Credentials without an expiry time never need refreshing.
+    """
+    global refresh_timer
+    if refresh_timer is not None:
+        refresh_timer.cancel()
+        refresh_timer = None
+    if getattr(creds, "expiry", None) is None:
+        return None
+    delay = (creds.expiry - datetime.utcnow()).total_seconds() - REFRESH_MARGIN
+    refresh_timer = threading.Timer(max(delay, 0), refresh_credentials, (creds,))
+    refresh_timer.daemon = True
+    refresh_timer.start()
+    return refresh_timer
+
+
+def refresh_credentials(creds):
+    with auth_lock:
+        if creds is not cached_credentials:
+            return
+        try:
+            creds.refresh(Request())
+        except Exception as exc:
+            # The next call to credentials() will try again.
+            print("Could not refresh credentials:", exc, file=sys.stderr)
+            return
+        save_credentials(creds)
+        schedule_refresh(creds)
+
+
+def forget_credentials():
+    """
+    Discard the cached credentials and service object.
+    """
+    global cached_credentials, cached_service
+    with auth_lock:
+        schedule_refresh(None)
+        cached_credentials = cached_service = None
+
+
+@dataclass
+class PullTimings:
+    """
+    Seconds spent on each phase of a pull. The discovery
+    time is zero when a cached service object was used.
+    """
+
+    document_id: str
+    auth: float = 0.0
+    discovery: float = 0.0
+    fetch: float = 0.0
+
+
+# Set to a callable to receive the PullTimings of every pull.
+timing_hook = None
+
+
+def docs_service(timings=None):
+    """
+    Return the process's Docs API service object, which may be shared
+    between threads: httplib2 is not thread-safe, so each request gets its
+    own connection. Each request is made with the credentials current at
+    the time, so a service outlives credentials that had to be replaced.
+    Time spent is added to the timings, if given.
+    """
+    global cached_service
+    start = time.perf_counter()
+    creds = credentials()
+    authenticated = time.perf_counter()
+    with auth_lock:
+        if cached_service is None:
+
+            def build_request(http, *args, **kwargs):
+                http = AuthorizedHttp(credentials(), http=httplib2.Http())
+                return HttpRequest(http, *args, **kwargs)
+
+            cached_service = build(
+                "docs", "v1", credentials=creds, requestBuilder=build_request
+            )
+        service = cached_service
+    if timings is not None:
+        timings.auth += authenticated - start
+        timings.discovery += time.perf_counter() - authenticated
+    return service
+
+
+# HTTP statuses worth retrying: rate limiting and transient server trouble.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retryable(exc):
+    if isinstance(exc, HttpError):
+        return exc.resp.status in RETRY_STATUSES
+    return isinstance(exc, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def execute(request, retries=3, backoff=1.0):
+    """
+    Execute an API request, retrying transient failures with exponential
+    backoff.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return request.execute()
+        except Exception as exc:
+            if attempt == retries or not retryable(exc):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def fetch(service, document_id, retries=3, backoff=1.0):
+    """
+    Fetch a document, retrying transient failures.
+    """
+    request = service.documents().get(documentId=document_id)
+    return OD(execute(request, retries, backoff))
+
+
+def fetch_many(service, document_ids, concurrency=8, retries=3, backoff=1.0):
+    """
+    Fetch documents on up to `concurrency` threads, generating
+    (document_id, document, exception) triples as each completes.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(fetch, service, document_id, retries, backoff): document_id
+            for document_id in document_ids
+        }
+        for future in as_completed(futures):
+            exc = future.exception()
+            yield futures[future], (None if exc else future.result()), exc
+
+
+def store_many(documents, batch_size=20):
+    """
+    Store (document_id, document) pairs, committing every `batch_size`
+    documents. Returns the ids of the documents that changed.
+    """
+    changed = []
+    for batch in batched(documents, batch_size):
+        with connection() as conn:
+            for document_id, document in batch:
+                if SQLDoc(document_id).store(conn, document):
+                    changed.append(document_id)
+            conn.commit()
+        store_images(batch)
+    for document_id in changed:
+        notify(document_id)
+    return changed
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 def main(args=sys.argv):
-    print("Pulling", sys.argv[1])
-    doc_file = SQLDoc(document_id=args[1])
-    doc_file.pull()
+    print("Pulling", args[1])
+    init_db()
+    try:
+        doc_file = SQLDoc(document_id=args[1])
+        doc_file.pull()
+    finally:
+        shutdown_db()
+
+
+def pull_many(args=sys.argv):
+    """
+    Pull many documents concurrently, sharing one service object.
+    """
+    parser = argparse.ArgumentParser(prog="pull-many", description=pull_many.__doc__)
+    parser.add_argument("document_ids", nargs="*", help="documents to pull")
+    parser.add_argument(
+        "-f", "--file", help="file of document ids, one per line ('-' for stdin)"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-b", "--batch-size", type=int, default=20)
+    parser.add_argument("-r", "--retries", type=int, default=3)
+    options = parser.parse_args(args[1:])
+    document_ids = list(options.document_ids)
+    if options.file:
+        with (sys.stdin if options.file == "-" else open(options.file)) as id_file:
+            document_ids.extend(line.strip() for line in id_file if line.strip())
+    if not document_ids:
+        parser.error("no documents to pull")
+
+    failures = []
+
+    def successes(results):
+        for document_id, document, exc in results:
+            if exc is None:
+                print("Pulled", document_id)
+                yield document_id, document
+            else:
+                print("Failed", document_id, exc, file=sys.stderr)
+                failures.append(document_id)
+
+    init_db()
+    try:
+        results = fetch_many(
+            docs_service(), document_ids, options.concurrency, options.retries
+        )
+        store_many(successes(results), options.batch_size)
+    finally:
+        shutdown_db()
+    if failures:
+        sys.exit(f"{len(failures)} of {len(document_ids)} document(s) not pulled")
+
+
+def sync_all(args=sys.argv):
+    """
+    Bring the given documents, or every stored document, up to date
+    with Docs, downloading only those with new revisions. A document
+    that can't be synced is reported and the rest are still synced.
+    """
+    failures = []
+    init_db()
+    try:
+        document_ids = args[1:] or [
+            row[0] for row in Documents().list(fields="documentId", order_by="id")
+        ]
+        service = docs_service()
+        for document_id in document_ids:
+            try:
+                pulled = SQLDoc(document_id).sync(service)
+            except Exception as exc:
+                print("Failed", document_id, exc, file=sys.stderr)
+                failures.append(document_id)
+                continue
+            print("Pulled" if pulled else "Unchanged", document_id)
+    finally:
+        shutdown_db()
+    if failures:
+        sys.exit(f"{len(failures)} of {len(document_ids)} document(s) not synced")
+
+
+def migrate(args=sys.argv):
+    """
+    Convert a document store that keeps raw JSON in the documents
+    table to one that keeps it compressed in document_json.
+    """
+    path = args[1] if len(args) > 1 else None
+    init_db(path)
+    try:
+        with connection() as conn:
+            count = migrate_storage(conn)
+            conn.execute("VACUUM")
+    finally:
+        shutdown_db()
+    print(f"Migrated {count} document(s) to {CODEC}-compressed storage")
 
 
 if __name__ == "__main__":
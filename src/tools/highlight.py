@@ -0,0 +1,97 @@
+"""
+highlight.py: Server-side syntax highlighting of code chunks.
+
+Pygments is used when it is installed; otherwise code is only escaped.
+"""
+import functools
+import hashlib
+import sys
+from html import escape
+from typing import Optional
+
+try:
+    import pygments
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+except ImportError:
+    pygments = None
+
+DEFAULT_LEXER = "python"
+STYLE = "monokai"
+# The class of the element enclosing highlighted code, used by the stylesheet.
+CSS_CLASS = "highlight"
+
+
+@functools.lru_cache(maxsize=None)
+def lexer_for(name: str):
+    return get_lexer_by_name(name, stripnl=False, ensurenl=False)
+
+
+@functools.lru_cache(maxsize=None)
+def formatter():
+    return HtmlFormatter(nowrap=True)
+
+
+def highlight(code: str, lexer: str = DEFAULT_LEXER) -> str:
+    """
+    The HTML for some code, marked up for the stylesheet.
+    """
+    if pygments is None:
+        return escape(code, quote=False)
+    html = pygments.highlight(code, lexer_for(lexer), formatter())
+    # The formatter ends the last line whether or not the code did.
+    if html.endswith("\n") and not code.endswith("\n"):
+        html = html[:-1]
+    return html
+
+
+def cache_key(code: str, lexer: str) -> str:
+    """
+    Identifies the highlighting of the code, which also depends
+    on the version of Pygments that did it.
+    """
+    version = pygments.__version__ if pygments else ""
+    data = "\0".join((lexer, version, code))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def version() -> str:
+    """
+    The version of Pygments doing the highlighting, or "none".
+    """
+    return pygments.__version__ if pygments else "none"
+
+
+class Highlighter:
+    """
+    Highlights code, keeping the results in a cache (such as a
+    docs.HighlightCache) if one is given, so unchanged code is
+    not highlighted again by this or any other process.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def __call__(self, code: str, lexer: str = DEFAULT_LEXER) -> str:
+        # Without Pygments there is nothing worth caching.
+        if self.cache is None or pygments is None:
+            return highlight(code, lexer)
+        key = cache_key(code, lexer)
+        html: Optional[str] = self.cache.get(key)
+        if html is None:
+            html = highlight(code, lexer)
+            self.cache.put(key, lexer, html)
+        return html
+
+
+def stylesheet() -> str:
+    return HtmlFormatter(style=STYLE).get_style_defs(f".{CSS_CLASS}")
+
+
+def main(args=sys.argv) -> None:
+    """
+    Write the CSS for highlighted code (web/assets/css/pygments.css).
+    """
+    if pygments is None:
+        sys.exit("Pygments is not installed")
+    print(stylesheet())
@@ -0,0 +1,54 @@
+"""
+lru.py: A small thread-safe least-recently-used cache.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Map keys to values, discarding the least-recently-used
+    entry once more than `size` entries are held.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def discard_if(self, predicate):
+        """
+        Discard every entry for whose value the predicate is true.
+        """
+        with self.lock:
+            for key in [k for (k, v) in self.data.items() if predicate(v)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
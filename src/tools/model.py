@@ -0,0 +1,372 @@
+"""
+model.py: A compact, typed model of the parts of a Google Docs document
+that the renderer uses.
+
+The model is built in a single pass over the decoded JSON. Wrapping a
+whole document in ObjectDicts converts every nested dict, most of which
+the renderer never looks at; here only the fields that affect the HTML
+are kept, in slotted objects, and identical text styles are shared.
+"""
+import json
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        loads = ujson.loads
+    except ImportError:
+        loads = json.loads
+
+
+class TextStyle:
+    """
+    The properties of a textStyle that affect rendering. The key
+    identifies the visual style, and so the CSS class, of a span.
+    """
+
+    __slots__ = ("bold", "italic", "font_size", "font_family", "link_url", "key")
+
+    def __init__(
+        self,
+        bold: bool = False,
+        italic: bool = False,
+        font_size: Optional[float] = None,
+        font_family: Optional[str] = None,
+        link_url: Optional[str] = None,
+    ):
+        self.bold = bold
+        self.italic = italic
+        self.font_size = font_size
+        self.font_family = font_family
+        self.link_url = link_url
+        self.key = (bold, italic, font_size, font_family)
+
+    def __repr__(self):
+        return f"TextStyle{self.key + (self.link_url,)!r}"
+
+
+PLAIN = TextStyle()
+
+
+class TextRun:
+    __slots__ = ("content", "style")
+    kind = "textRun"
+
+    def __init__(self, content: str, style: TextStyle = PLAIN):
+        self.content = content
+        self.style = style
+
+    def __repr__(self):
+        return f"TextRun({self.content!r}, {self.style!r})"
+
+
+class FootnoteReference:
+    __slots__ = ("number", "footnote_id")
+    kind = "footnoteReference"
+
+    def __init__(self, number: str, footnote_id: str):
+        self.number = number
+        self.footnote_id = footnote_id
+
+    def __repr__(self):
+        return f"FootnoteReference({self.number!r}, {self.footnote_id!r})"
+
+
+class Unsupported:
+    """
+    An element the renderer has no use for, of which only the type is kept.
+    """
+
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    def __repr__(self):
+        return f"Unsupported({self.kind!r})"
+
+
+class InlineObject:
+    """
+    A reference to one of the document's inline objects (images).
+    """
+
+    __slots__ = ("object_id",)
+    kind = "inlineObjectElement"
+
+    def __init__(self, object_id: str):
+        self.object_id = object_id
+
+    def __repr__(self):
+        return f"InlineObject({self.object_id!r})"
+
+
+Element = Union[TextRun, FootnoteReference, InlineObject, Unsupported]
+
+
+class Bullet:
+    __slots__ = ("list_id", "level")
+
+    def __init__(self, list_id: str, level: int = 0):
+        self.list_id = list_id
+        self.level = level
+
+    def __repr__(self):
+        return f"Bullet({self.list_id!r}, {self.level!r})"
+
+
+class Paragraph:
+    __slots__ = ("style_type", "elements", "bullet")
+    kind = "paragraph"
+
+    def __init__(
+        self, style_type: str, elements: List[Element], bullet: Optional[Bullet] = None
+    ):
+        self.style_type = style_type
+        self.elements = elements
+        self.bullet = bullet
+
+    def __repr__(self):
+        return f"Paragraph({self.style_type!r}, {self.elements!r}, {self.bullet!r})"
+
+
+class Table:
+    """
+    A table's rows, each a list of cells, each a list of structural elements.
+    """
+
+    __slots__ = ("rows",)
+    kind = "table"
+
+    def __init__(self, rows: List[List[List["StructuralElement"]]]):
+        self.rows = rows
+
+    def __repr__(self):
+        return f"Table({self.rows!r})"
+
+
+StructuralElement = Union[Paragraph, Table, Unsupported]
+
+
+class Image:
+    __slots__ = ("uri", "description", "width", "height")
+
+    def __init__(
+        self,
+        uri: Optional[str],
+        description: Optional[str] = None,
+        width: Optional[float] = None,
+        height: Optional[float] = None,
+    ):
+        self.uri = uri
+        self.description = description
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f"Image({self.uri!r}, {self.description!r})"
+
+
+class Document:
+    __slots__ = (
+        "document_id",
+        "revision_id",
+        "title",
+        "body",
+        "footnotes",
+        "lists",
+        "images",
+    )
+
+    def __init__(
+        self,
+        document_id: Optional[str],
+        revision_id: Optional[str],
+        title: Optional[str],
+        body: List[StructuralElement],
+        footnotes: Dict[str, List[StructuralElement]],
+        lists: Optional[Dict[str, List[bool]]] = None,
+        images: Optional[Dict[str, Image]] = None,
+    ):
+        self.document_id = document_id
+        self.revision_id = revision_id
+        self.title = title
+        self.body = body
+        self.footnotes = footnotes
+        # For each list, whether each of its nesting levels is numbered.
+        self.lists = lists or {}
+        self.images = images or {}
+
+
+def kind_of(element: dict) -> str:
+    """
+    The type of a structural or paragraph element: its only key
+    other than the indexes.
+    """
+    kinds = [key for key in element if key != "startIndex" and key != "endIndex"]
+    if len(kinds) != 1:
+        raise ValueError(f"Unexpected keys in element: {sorted(element)!r}")
+    return kinds[0]
+
+
+# Glyph types of list levels whose items aren't numbered.
+UNNUMBERED = {"GLYPH_TYPE_UNSPECIFIED", "NONE"}
+
+
+class Builder:
+    """
+    Converts decoded document JSON to the model. Text styles are
+    interned, so every run in the same style shares one TextStyle.
+    """
+
+    def __init__(self):
+        self.styles: Dict[Tuple, TextStyle] = {}
+
+    def document(self, data: dict) -> Document:
+        footnotes = data.get("footnotes") or {}
+        return Document(
+            data.get("documentId"),
+            data.get("revisionId"),
+            data.get("title"),
+            self.content(data.get("body", {}).get("content", [])),
+            {
+                id: self.content(note.get("content", []))
+                for id, note in footnotes.items()
+            },
+            {id: self.levels(item) for id, item in (data.get("lists") or {}).items()},
+            {
+                id: self.image(item)
+                for id, item in (data.get("inlineObjects") or {}).items()
+            },
+        )
+
+    def levels(self, item: dict) -> List[bool]:
+        levels = item.get("listProperties", {}).get("nestingLevels", [])
+        return [
+            level.get("glyphType", "GLYPH_TYPE_UNSPECIFIED") not in UNNUMBERED
+            for level in levels
+        ]
+
+    def image(self, item: dict) -> Image:
+        embedded = item.get("inlineObjectProperties", {}).get("embeddedObject", {})
+        size = embedded.get("size", {})
+        return Image(
+            embedded.get("imageProperties", {}).get("contentUri"),
+            embedded.get("description") or embedded.get("title"),
+            size.get("width", {}).get("magnitude"),
+            size.get("height", {}).get("magnitude"),
+        )
+
+    def content(self, content: List[dict]) -> List[StructuralElement]:
+        result = []
+        for element in content:
+            kind = kind_of(element)
+            if kind == "paragraph":
+                result.append(self.paragraph(element["paragraph"]))
+            elif kind == "table":
+                result.append(self.table(element["table"]))
+            else:
+                result.append(Unsupported(kind))
+        return result
+
+    def paragraph(self, paragraph: dict) -> Paragraph:
+        elements = []
+        for element in paragraph.get("elements", []):
+            kind = kind_of(element)
+            if kind == "textRun":
+                run = element["textRun"]
+                elements.append(
+                    TextRun(run.get("content", ""), self.style(run.get("textStyle")))
+                )
+            elif kind == "footnoteReference":
+                ref = element["footnoteReference"]
+                elements.append(
+                    FootnoteReference(ref["footnoteNumber"], ref["footnoteId"])
+                )
+            elif kind == "inlineObjectElement":
+                elements.append(
+                    InlineObject(element["inlineObjectElement"]["inlineObjectId"])
+                )
+            else:
+                elements.append(Unsupported(kind))
+        style = paragraph.get("paragraphStyle") or {}
+        bullet = paragraph.get("bullet")
+        if bullet is not None:
+            bullet = Bullet(bullet["listId"], bullet.get("nestingLevel", 0))
+        return Paragraph(style.get("namedStyleType", "NORMAL_TEXT"), elements, bullet)
+
+    def table(self, table: dict) -> Table:
+        return Table(
+            [
+                [self.content(cell.get("content", [])) for cell in row["tableCells"]]
+                for row in table.get("tableRows", [])
+            ]
+        )
+
+    def style(self, style: Optional[dict]) -> TextStyle:
+        if not style:
+            return PLAIN
+        font_size = style.get("fontSize")
+        font_family = style.get("weightedFontFamily")
+        link = style.get("link")
+        values = (
+            bool(style.get("bold")),
+            bool(style.get("italic")),
+            font_size.get("magnitude") if font_size else None,
+            font_family.get("fontFamily") if font_family else None,
+            link.get("url") if link else None,
+        )
+        try:
+            return self.styles[values]
+        except KeyError:
+            text_style = self.styles[values] = TextStyle(*values)
+            return text_style
+
+
+def from_dict(data: dict) -> Document:
+    """
+    Build the model of a document from its decoded JSON.
+    """
+    return Builder().document(data)
+
+
+def image_uris(data: dict) -> Dict[str, str]:
+    """
+    The URI of each image in a document's decoded JSON, by inline object
+    ID, without building the rest of the model.
+    """
+    builder = Builder()
+    uris = {}
+    for object_id, item in (data.get("inlineObjects") or {}).items():
+        uri = builder.image(item).uri
+        if uri:
+            uris[object_id] = uri
+    return uris
+
+
+def from_json(text: Union[str, bytes]) -> Document:
+    """
+    Build the model of a document from its JSON text, decoded
+    with the fastest JSON library available.
+    """
+    return from_dict(loads(text))
+
+
+def as_document(source: Union[Document, dict, str, bytes]) -> Document:
+    """
+    Accept a document as a model, decoded JSON or JSON text.
+    """
+    if isinstance(source, Document):
+        return source
+    if isinstance(source, dict):
+        return from_dict(source)
+    return from_json(source)
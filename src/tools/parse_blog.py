@@ -1,5 +1,7 @@
 import json
 import sys
+from typing import Iterator
+from typing import Tuple
 
 from docs import Doc
 from hu import ObjectDict
@@ -14,61 +16,249 @@ from styles import StyleStack
 
 DEBUG_FEATURE_FLAGS = {"parse", "upn"}
 
+# The kinds of frame on MyDoc.walk's stack.
+ENTER, ITEM, EXIT = range(3)
+
+# The items parsed from each structural element and paragraph element.
+STRUCTURAL_ITEMS = ("sectionBreak", "tableOfContents", "table", "paragraph")
+ELEMENT_ITEMS = (
+    "textRun",
+    "autoText",
+    "pageBreak",
+    "columnBreak",
+    "footnoteReference",
+    "horizontalRule",
+    "equation",
+    "inlineOPbnjectElement",
+)
+
+
+def debugging(debug_class):
+    """
+    Is output of the given class wanted? Callers check this before
+    building messages that are costly to format.
+    """
+    return debug_class in DEBUG_FEATURE_FLAGS or "all" in DEBUG_FEATURE_FLAGS
+
 
 def debug(debug_class, *arg, **kw):
-    if any(flag in DEBUG_FEATURE_FLAGS for flag in (debug_class, "all")):
+    if debugging(debug_class):
         print(*arg, **kw)
 
 
+def push_items(stack, element, item_names):
+    """
+    Push a frame for each of the items an element has, so that they
+    are popped in the order named.
+    """
+    for item_name in reversed(item_names):
+        if item_name in element:
+            stack.append((ITEM, element[item_name], item_name, None, None))
+
+
 class MyDoc:
     """
     This is a general framework to handle Google documents, allowing their
     processing into blog entries in a relatively automated way.
+
+    An iterative parser calls the same parse_* hooks in the same order,
+    but from a loop over an explicit stack rather than by recursion, so
+    the depth of the document is not limited by Python's recursion limit.
     """
 
-    def __init__(self):
+    def __init__(self, iterative=False):
         self.content = []
         self.p_styles = StyleStack("paragraph")
         self.t_styles = StyleStack("text")
+        # The names of the elements being parsed, outermost first.
+        self.ancestors = []
+        self.handlers = self.handler_map()
+        self.bound = self.bound_handlers()
+        self.iterative = iterative
+        # While walking, the parses requested by the current hook.
+        self.deferred = []
+
+    @classmethod
+    def handler_map(cls):
+        """
+        The parse_<item name> method for each item name, found once per
+        class (so subclasses can add or override handlers).
+        """
+        handlers = cls.__dict__.get("_handler_map")
+        if handlers is None:
+            handlers = cls._handler_map = {
+                name[len("parse_") :]: getattr(cls, name)
+                for name in dir(cls)
+                if name.startswith("parse_")
+            }
+        return handlers
+
+    @classmethod
+    def bound_handlers(cls):
+        """
+        The (item name, handler) pairs for each tuple of item names parsed,
+        bound once per class as each tuple is first used.
+        """
+        bound = cls.__dict__.get("_bound_handlers")
+        if bound is None:
+            bound = cls._bound_handlers = {}
+        return bound
+
+    def bind(self, item_names):
+        handlers = self.handlers
+        unrecognised = type(self).parse_unrecognised_part_name
+        pairs = self.bound[item_names] = tuple(
+            (item_name, handlers.get(item_name, unrecognised))
+            for item_name in item_names
+        )
+        return pairs
 
-    def parse(self, element, element_name, item_names, ancestors):
+    def path(self, *names):
+        return ".".join([*self.ancestors, *names])
+
+    def parse(self, element, element_name, item_names, exit=None):
         """
         Parses the given document element by recursively parsing
-        the content of each item.
-        """
-        debug("parse", f"Parsing {'.'.join(ancestors + [element_name])}")
-        for item_name in item_names:
-            if item_name in element:
-                method = getattr(
-                    self, f"parse_{item_name}", self.parse_unrecognised_part_name
-                )
-                item = element[item_name]
-                debug(
-                    "parse", "Handling", ".".join(ancestors + [element_name, item_name])
-                )
-                method(
-                    element=item,
-                    element_name=item_name,
-                    ancestors=ancestors + [element_name],
-                )
-        debug("parse", f"Parse of {'.'.join(ancestors + [element_name])} complete")
-
-    def parse_body(self, element, element_name, ancestors):
+        the content of each item, then calls exit, if given. The item
+        names are a tuple, so that their handlers can be bound once.
+        """
+        if self.iterative:
+            for _ in self.walk(element, element_name, item_names, exit):
+                pass
+            return
+        trace = debugging("parse")
+        if trace:
+            debug("parse", f"Parsing {self.path(element_name)}")
+        pairs = self.bound.get(item_names) or self.bind(item_names)
+        ancestors = self.ancestors
+        ancestors.append(element_name)
+        try:
+            for item_name, handler in pairs:
+                if item_name in element:
+                    if trace:
+                        debug("parse", "Handling", self.path(item_name))
+                    handler(self, element[item_name], item_name)
+        finally:
+            ancestors.pop()
+        if exit is not None or trace:
+            self.leave(element_name, exit, trace)
+
+    def parse_each(self, elements, element_name, item_names):
+        """
+        Parse each of a list of elements as parse would, but without a
+        call to parse for each one. Iterative parses, tracing and
+        subclasses that replace parse still parse the elements one by one.
+        """
+        parse = self.parse
+        if (
+            self.iterative
+            or getattr(parse, "__func__", None) is not MyDoc.parse
+            or debugging("parse")
+        ):
+            for element in elements:
+                parse(element, element_name, item_names)
+            return
+        pairs = self.bound.get(item_names) or self.bind(item_names)
+        ancestors = self.ancestors
+        ancestors.append(element_name)
+        try:
+            for element in elements:
+                for item_name, handler in pairs:
+                    if item_name in element:
+                        handler(self, element[item_name], item_name)
+        finally:
+            ancestors.pop()
+
+    def defer(self, element, element_name, item_names, exit=None):
+        """
+        Stands in for parse while walking, leaving the parse to walk's loop.
+        """
+        self.deferred.append((element, element_name, item_names, exit))
+
+    def leave(self, element_name, exit, trace):
+        """
+        Finish parsing an element, once its name is off the ancestry stack.
+        """
+        if exit is not None:
+            exit()
+        if trace:
+            debug("parse", f"Parse of {self.path(element_name)} complete")
+
+    def walk(
+        self, element, element_name, item_names, exit=None
+    ) -> Iterator[Tuple[str, object]]:
+        """
+        Parse an element as parse does, without recursion, generating the
+        (item name, item) pair passed to each hook just before it is called.
+
+        Frames on the stack enter an element, handle one of its items or
+        exit the element. The parses a hook requests are deferred until it
+        returns, then entered in turn: each item's subtree is parsed before
+        the next item is handled, just as by recursion.
+        """
+        trace = debugging("parse")
+        handlers = self.handlers
+        unrecognised = type(self).parse_unrecognised_part_name
+        ancestors = self.ancestors
+        depth = len(ancestors)
+        stack = [(ENTER, element, element_name, item_names, exit)]
+        deferred = self.deferred
+        self.parse = self.defer
+        try:
+            while stack:
+                action, node, name, item_names, exit = stack.pop()
+                if action == ITEM:
+                    if trace:
+                        debug("parse", "Handling", self.path(name))
+                    yield name, node
+                    handlers.get(name, unrecognised)(self, node, name)
+                    if deferred:
+                        for parse in reversed(deferred):
+                            stack.append((ENTER, *parse))
+                        deferred.clear()
+                elif action == ENTER:
+                    if trace:
+                        debug("parse", f"Parsing {self.path(name)}")
+                    ancestors.append(name)
+                    stack.append((EXIT, None, name, None, exit))
+                    push_items(stack, node, item_names)
+                else:
+                    ancestors.pop()
+                    self.leave(name, exit, trace)
+        finally:
+            del self.parse
+            deferred.clear()
+            del ancestors[depth:]
+
+    def events(self, document) -> Iterator[Tuple[Tuple[str, ...], object]]:
+        """
+        Parse a document iteratively as the events are consumed, generating
+        a (path, node) pair for each node passed to a parse_* hook, where
+        the path is the names of the node's ancestors and the node.
+        """
+        self.parse = self.defer
+        try:
+            self.parse_document(document)
+        finally:
+            del self.parse
+        (root,) = self.deferred
+        self.deferred.clear()
+        for name, node in self.walk(*root):
+            yield (*self.ancestors, name), node
+
+    def parse_body(self, element, element_name):
         item_names = ("content",)
-        return self.parse(
-            element, element_name="content", item_names=item_names, ancestors=ancestors
-        )
+        return self.parse(element, element_name="content", item_names=item_names)
 
-    def parse_content(self, element, element_name, ancestors):
+    def parse_content(self, element, element_name):
         """
         elements is a sequence of structuralElement objects, some of which should
         be parsed to access publishable content.
         """
         debug("content", "Content elements count:", len(element))
-        for item in element:
-            self.parse_structuralElement(item, "structuralElement", ancestors=ancestors)
+        self.parse_each(element, "structuralElement", STRUCTURAL_ITEMS)
 
-    def parse_document(self, element, ancestors=[]):
+    def parse_document(self, element):
         item_names = (
             "title",
             "body",
@@ -80,16 +270,13 @@ class MyDoc:
             "documentId",
         )
         return self.parse(
-            element=element,
-            element_name="document",
-            item_names=item_names,
-            ancestors=ancestors,
+            element=element, element_name="document", item_names=item_names
         )
 
-    def parse_documentId(self, element, element_name, ancestors):
+    def parse_documentId(self, element, element_name):
         self.documentId = element
 
-    def parse_documentStyle(self, element, element_name, ancestors):
+    def parse_documentStyle(self, element, element_name):
         item_names = (
             "background",
             "defaultHeaderId",
@@ -110,100 +297,100 @@ class MyDoc:
             "marginFooter",
             "useCustomHeaderFooterMargins",
         )
-        self.parse(element, element_name, item_names, ancestors)
+        self.parse(element, element_name, item_names)
 
-    def parse_elements(self, element, element_name, ancestors):
-        for item in element:
-            self.parse_element(item, "paragraphElement", ancestors)
+    def parse_elements(self, element, element_name):
+        if debugging("element"):
+            for item in element:
+                self.parse_element(item, "paragraphElement")
+        else:
+            self.parse_each(element, "paragraphElement", ELEMENT_ITEMS)
 
-    def parse_element(self, element, element_name, ancestors):
-        item_names = (
-            "textRun",
-            "autoText",
-            "pageBreak",
-            "columnBreak",
-            "footnoteReference",
-            "horizontalRule",
-            "equation",
-            "inlineOPbnjectElement",
-        )
-        debug("element", f"Range: {element['startIndex']}-{element['endIndex']}")
-        self.parse(element, element_name, item_names, ancestors)
+    def parse_element(self, element, element_name):
+        if debugging("element"):
+            debug("element", f"Range: {element['startIndex']}-{element['endIndex']}")
+        self.parse(element, element_name, ELEMENT_ITEMS)
 
-    def parse_paragraph(self, element, element_name, ancestors):
+    def parse_paragraph(self, element, element_name):
+        """
+        The paragraph's style (if it has one: otherwise an empty layer)
+        is pushed for the lifetime of the paragraph, and popped once its
+        elements have been parsed.
+        """
         item_names = ("paragraphStyle", "bullet", "elements")
-        return self.parse(element, element_name, item_names, ancestors)
+        self.p_styles.push(element.get("paragraphStyle"))
+        return self.parse(element, element_name, item_names, exit=self.p_styles.pop)
 
-    def parse_paragraphStyle(self, element, element_name, ancestors):
+    def parse_paragraphStyle(self, element, element_name):
         """
-        Attempts to establish a paragraph style.
-
-        Unfortunately the style's lifetime should be the
-        lifetime of its containing paragraph, so a simple
-        push and pop are inappropriate.
-
-        Since the style is always processed before the content,
-        it's appropriate to set the style here, but it cannot
-        be popped until the end of the paragraph.
-
-        Of course if the paragraphStyle element is optional,
-        there will also need to be some mechanism that guards
-        the style pop option so it only occurs when the push
-        has been performed. Through a glass darkly I can see
-        the shape of an abstract syntax tree.
+        The style has already been pushed by parse_paragraph.
         """
-        self.p_styles.push(element)
-        debug("ps", f"Pushed {element_name} {element!r}")
-        debug("ps", "pStyle now:")
-        for key, value in sorted(self.p_styles.to_dict().items()):
-            if value:
-                debug("ps", f":::{key!r}: {value!r}")
-        assert self.p_styles.pop() == element
-
-    def parse_sectionBreak(self, element, element_name, ancestors):
+        if debugging("ps"):
+            debug("ps", f"Pushed {element_name} {element!r}")
+            debug("ps", "pStyle now:")
+            for key, value in sorted(self.p_styles.to_dict().items()):
+                if value:
+                    debug("ps", f":::{key!r}: {value!r}")
+
+    def parse_sectionBreak(self, element, element_name):
         debug("sb", "sectionBreak:", element)
 
-    def parse_structuralElement(self, element, element_name, ancestors):
-        part_names = ("sectionBreak", "tableOfContents", "table", "paragraph")
+    def parse_structuralElement(self, element, element_name):
         return self.parse(
-            element,
-            element_name="structuralElement",
-            item_names=part_names,
-            ancestors=ancestors,
+            element, element_name="structuralElement", item_names=STRUCTURAL_ITEMS
         )
 
-    def parse_textRun(self, element, element_name, ancestors):
+    def parse_table(self, element, element_name):
+        return self.parse(element, element_name, ("tableRows",))
+
+    def parse_tableCells(self, element, element_name):
+        """
+        Each cell holds structural elements, which may include tables.
+        """
+        self.parse_each(element, "tableCell", ("content",))
+
+    def parse_tableRows(self, element, element_name):
+        self.parse_each(element, "tableRow", ("tableCells",))
+
+    def parse_textRun(self, element, element_name):
+        """
+        A run has no parsed items, so its text style is pushed and
+        popped here, around its content.
+        """
         style = element.get("textStyle", "")
+        t_styles = self.t_styles
+        t_styles.push(style or None)
         self.content.append((style, element["content"]))
-        debug("tr", "tStyle:", style if style else "UNSTYLED CONTENT")
-        debug("tr", "<|", element["content"], end="|>")
-
-    def parse_textStyle(self, element, element_name, ancestors):
-        self.t_styles.push(element)
-        debug("ts", f"Pushed {element_name} {element!r}")
-        debug("ts", "tStyle now:")
-        for key, value in sorted(self.p_styles.to_dict().items()):
-            if value:
-                debug("ts", f"...{key!r}: {value!r}")
-        assert self.t_styles.pop() == element
-
-    def parse_title(self, element, element_name, ancestors):
+        # Runs are the commonest element, so are only checked for each
+        # kind of output when there is any debug output at all.
+        if DEBUG_FEATURE_FLAGS:
+            if debugging("tr"):
+                debug("tr", "tStyle:", style if style else "UNSTYLED CONTENT")
+                debug("tr", "<|", element["content"], end="|>")
+            if debugging("ts"):
+                debug("ts", "tStyle now:")
+                for key, value in sorted(t_styles.to_dict().items()):
+                    if value:
+                        debug("ts", f"...{key!r}: {value!r}")
+        t_styles.pop()
+
+    def parse_title(self, element, element_name):
         self.title = element
-        debug("t", ".".join(ancestors + [element_name]), "is", element)
+        if debugging("t"):
+            debug("t", self.path(element_name), "is", element)
 
-    def parse_unrecognised_part_name(self, element, element_name, ancestors):
-        debug("upn", "Didn't handle", ".".join(ancestors + [element_name]))
+    def parse_unrecognised_part_name(self, element, element_name):
+        if debugging("upn"):
+            debug("upn", "Didn't handle", self.path(element_name))
 
 
 def main(document_id: str):
-    """
-
-    """
+    """ """
     df = Doc(document_id).open()
     document = json.loads(df.read())
     document = ObjectDict(document)
     parser = MyDoc()
-    parser.parse_document(element=document, ancestors=[])
+    parser.parse_document(element=document)
 
     debug("main", f'The title of the document is: {document.get("title")!r}')
     debug("main", f"  The parser says: {parser.title}")
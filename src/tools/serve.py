@@ -1,33 +1,69 @@
+import atexit
+import hashlib
 import json
+import os
 import sys
+import time
 from datetime import datetime
+from datetime import timezone
+from typing import NamedTuple
 
 from docs import Documents
+from docs import init_db
+from docs import on_change
+from docs import PoolTimeout
+from docs import shutdown_db
 from docs import SQLDoc
+from docs import stored_assets
+from flask import abort
 from flask import Flask
+from flask import make_response
 from flask import redirect
+from flask import request
 from flask import Response
 from flask import send_from_directory
 from flask_wtf import FlaskForm
 from hu import ObjectDict as OD
-from jinja2 import ChoiceLoader
-from jinja2 import Environment
-from jinja2 import FileSystemLoader
+from lru import LRUCache
+from templates import env
+from walk_blog import load_document
+from walk_blog import Renderer
+from walk_blog import stored_highlighter
 from wtforms import StringField
 from wtforms.validators import DataRequired
 
-env = Environment(
-    loader=ChoiceLoader(
-        [FileSystemLoader("/Users/sholden/Projects/Python/blogAlexSteve/web")]
-    )
-)
-
-
 app = Flask(__name__)
 
 # Set the secret key to some random bytes. Keep this really secret!
 app.config["SECRET_KEY"] = b'_5#y2L"F4Q8z\n\xec]/'
 
+# One connection pool serves every request handled by this process.
+init_db()
+atexit.register(shutdown_db)
+
+
+class Page(NamedTuple):
+    document_id: str
+    version: int
+    etag: str
+    last_modified: datetime
+    body: str
+    checked: float
+
+
+# Fully-rendered blog pages, keyed by the slug or documentId that requested
+# them. Changes made by this process evict pages immediately; changes made
+# elsewhere (e.g. by the load command) are noticed by a cheap version check
+# once a page has been cached for longer than PAGE_CACHE_TTL seconds.
+page_cache = LRUCache(int(os.environ.get("PAGE_CACHE_SIZE", 256)))
+PAGE_CACHE_TTL = float(os.environ.get("PAGE_CACHE_TTL", 2.0))
+
+
+@on_change
+def invalidate_page(document_id):
+    page_cache.discard_if(lambda page: page.document_id == document_id)
+
+
 item_vars = OD(
     {
         "heading": "This is the heading - independent of the item title?",
@@ -78,25 +114,118 @@ def delete_page(id):
     return redirect("/articles/list")
 
 
-@app.route("/blog/<id>")
-def blog_page_view(id):
+@app.route("/blog/<id>/publish")
+def publish_page(id):
+    doc = SQLDoc(id)
+    doc.publish()
+    return redirect("/articles/list")
+
+
+@app.route("/blog/<key>")
+def blog_page_view(key):
+    """
+    A post is addressed either by its slug or by its Google Docs
+    documentId. The two share a URL pattern, so slugs are tried first.
+
+    Posts whose HTML has not been stored yet are rendered from their
+    JSON and streamed to the client as they are rendered.
+    """
+    page = cached_page(key)
+    if page is None:
+        return Response(stream_page(key), mimetype="text/html")
+    response = make_response(page.body)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    return response.make_conditional(request)
+
+
+def cached_page(key):
+    page = page_cache.get(key)
+    now = time.monotonic()
+    if page is not None and now - page.checked > PAGE_CACHE_TTL:
+        if SQLDoc(page.document_id).version() == page.version:
+            page = page._replace(checked=now)
+            page_cache.put(key, page)
+        else:
+            page = None
+    if page is None:
+        page = render_page(key)
+        if page is not None:
+            page_cache.put(key, page)
+    return page
+
+
+# Rendering a page needs neither the raw document JSON nor its decoding.
+PAGE_FIELDS = ("documentId", "html", "title", "version", "when_updated")
+
+
+def find_document(key):
+    return SQLDoc.by_slug(key) or SQLDoc(key)
+
+
+def render_page(key):
+    """
+    Render the page for a post, or return None if it has no stored HTML.
+    """
+    try:
+        record = find_document(key).load(fields=PAGE_FIELDS)
+    except KeyError:
+        abort(404)
+    if record.html is None:
+        return None
     template = env.get_template("blog-post.html")
-    envars = OD({"post": load_content(id), "item": item_vars})
-    result = template.render(**envars)
-    return result
+    envars = OD({"post": load_content(record), "item": item_vars})
+    body = template.render(**envars)
+    return Page(
+        document_id=record.documentId,
+        version=record.version,
+        etag=hashlib.sha1(body.encode("utf-8")).hexdigest(),
+        last_modified=last_modified(record.when_updated),
+        body=body,
+        checked=time.monotonic(),
+    )
 
 
-def load_content(id):
-    doc = SQLDoc(id)
-    record = doc.load()
-    return OD(
-        {
-            "content": record.html,
-            "document": OD(json.loads(record.json)),
-            "title": record.title,
-        }
+# Marks where the post content goes in a streamed page.
+CONTENT_PLACEHOLDER = "\x00content\x00"
+
+
+def stream_page(key):
+    """
+    Generate a page whose content is rendered from the document's JSON
+    as the page is sent.
+    """
+    try:
+        record, document, tags = load_document(find_document(key), ("title",))
+    except KeyError:
+        abort(404)
+    template = env.get_template("blog-post.html")
+    post = OD({"content": CONTENT_PLACEHOLDER, "title": record.title})
+    head, tail = template.render(post=post, item=item_vars).split(
+        CONTENT_PLACEHOLDER, 1
     )
 
+    def generate():
+        yield head
+        yield from Renderer(stored_highlighter, stored_assets).stream(document, tags)
+        yield tail
+
+    return generate()
+
+
+def last_modified(when_updated):
+    """
+    SQLite's CURRENT_TIMESTAMP is UTC text; rows that predate
+    change tracking fall back to the time of rendering.
+    """
+    if not when_updated:
+        return datetime.now(timezone.utc).replace(microsecond=0)
+    return datetime.fromisoformat(when_updated).replace(tzinfo=timezone.utc)
+
+
+def load_content(record):
+    return OD({"content": record.html, "title": record.title})
+
 
 @app.route("/assets/<path:path>")
 def serve_asset(path):
@@ -106,18 +235,65 @@ def serve_asset(path):
     )
 
 
+ARTICLES_LIMIT = 100
+ARTICLES_MAX_LIMIT = 1000
+
+
 @app.route("/api/v1/articles")
 def articles():
-    d = Documents()
-    return Response(
-        json.dumps(list(d.list(fields="id, documentId, title, slug"))),
-        mimetype="application/json",
+    """
+    A page of articles, in order of id (or of when_published if
+    ?order=when_published), as a JSON object whose "articles" are
+    [id, documentId, title, slug] rows. Request ?after=<next> for
+    the next page; "next" is null once the listing is exhausted.
+
+    The page is read in full, so its database connection is
+    returned to the pool before the response is sent: a slow client
+    mustn't keep one from other requests. The JSON is still encoded
+    a row at a time as it is sent.
+    """
+    try:
+        limit = int(request.args.get("limit", ARTICLES_LIMIT))
+    except ValueError:
+        abort(400)
+    if not 0 < limit <= ARTICLES_MAX_LIMIT:
+        abort(400)
+    pages = Documents().page(
+        fields="id, documentId, title, slug",
+        order_by=request.args.get("order", "id"),
+        after=request.args.get("after"),
+        limit=limit,
     )
+    try:
+        rows = list(pages)
+    except ValueError:
+        abort(400)
+    return Response(stream_articles(rows, limit), mimetype="application/json")
+
+
+def stream_articles(rows, limit):
+    yield '{"articles": ['
+    for n, (_, row) in enumerate(rows):
+        yield ("," if n else "") + json.dumps(row)
+    cursor = rows[-1][0] if len(rows) == limit else None
+    yield f'], "next": {json.dumps(cursor)}}}'
+
+
+@app.errorhandler(PoolTimeout)
+def database_busy(exc):
+    """
+    Every database connection has been in use for too long.
+    """
+    return Response("Database busy", status=503, headers={"Retry-After": "1"})
 
 
 @app.route("/articles/list")
 def list_articles():
-    data = Documents().list(fields="id, documentID, title, slug")
+    data = Documents().list(
+        fields="id, documentId, title, slug",
+        order_by="when_published DESC",
+        status="published",
+    )
     tbl_template = env.get_template("list_articles.html")
     content = tbl_template.render(data=data)
     template = env.get_template("blog-post.html")
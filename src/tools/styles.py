@@ -5,6 +5,7 @@ whenever a new style is encountered another layer is added to
 the appropriate style stack. Attribute lookup recurses down the
 stack, effectively emulating
 """
+from types import MappingProxyType
 
 style_types = {
     'paragraph': {
@@ -46,37 +47,53 @@ style_types = {
 
 
 class StyleStack:
+    """
+    Layers of styles, each overriding those beneath it. Alongside each
+    layer is kept the merged view of it and all the layers beneath, so
+    lookups don't search the stack. A view is never changed once made:
+    a push merges the new layer into a new view (in time proportional
+    to the few keys a style can have) and a pop returns to the one
+    beneath. Styles should only be changed, once pushed, through the
+    stack.
+    """
+
     def __init__(self, style_type='paragraph', level=-1):
         self.style_types = style_types[style_type].copy()
         self.stack = [self.style_types]
+        self.views = [dict(self.style_types)]
+        self.merged = self.views[-1]
 
     def push(self, style=None):
         if style is None:
             style = {}
+        if style:
+            self.merged = {**self.merged, **style}
         self.stack.append(style)
+        self.views.append(self.merged)
 
     def pop(self):
+        if len(self.stack) == 1:
+            raise IndexError("pop from a style stack with nothing pushed")
+        self.views.pop()
+        self.merged = self.views[-1]
         return self.stack.pop()
 
     def __getitem__(self, key):
-        for s in self.stack[::-1]:
-            if key in s:
-                return s[key]
-        else:
-            raise KeyError(f"Key {key!r} not found")
+        try:
+            return self.merged[key]
+        except KeyError:
+            raise KeyError(f"Key {key!r} not found") from None
 
     def __setitem__(self, key, value):
         if key not in self.style_types:
             raise ValueError(f"Impermissible key {key!r}")
         self.stack[-1][key] = value
+        self.merged = self.views[-1] = {**self.merged, key: value}
 
     def to_dict(self):
         """
-        Flatten the stack, returning an equivalent dict.
+        Flatten the stack, returning an equivalent mapping. This is a
+        read-only proxy for the stack's current view, which may be
+        shared by several layers, so costs nothing to make.
         """
-        result = {}
-        for stack in self.stack[::-1]:
-            for k, v in stack.items():
-                if k not in result:
-                    result[k] = v
-        return result
+        return MappingProxyType(self.merged)
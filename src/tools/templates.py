@@ -0,0 +1,65 @@
+"""
+templates.py: The Jinja2 environment shared by the web app and the renderer.
+"""
+import functools
+import os
+import re
+from typing import Callable
+
+from jinja2 import ChoiceLoader
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from jinja2 import FileSystemLoader
+from markupsafe import escape
+from markupsafe import Markup
+
+WEB_DIRECTORY = "/Users/sholden/Projects/Python/blogAlexSteve/web"
+TEMPLATE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "jinja_templates"
+)
+
+# Templates whose output is escaped automatically. The page templates
+# insert HTML rendered elsewhere, so are left as they were.
+AUTOESCAPED = {"fragments.html"}
+
+env = Environment(
+    loader=ChoiceLoader(
+        [FileSystemLoader(WEB_DIRECTORY), FileSystemLoader(TEMPLATE_DIRECTORY)]
+    ),
+    autoescape=lambda name: name in AUTOESCAPED,
+    # Compiled templates are kept on disk (by default in a temporary
+    # directory) so new processes, such as render-all's workers, load
+    # them without compiling them again.
+    bytecode_cache=FileSystemBytecodeCache(os.environ.get("TEMPLATE_CACHE_DIR")),
+)
+
+ARGUMENT = re.compile("\x00(\\d+)\x00")
+
+
+@functools.lru_cache(maxsize=None)
+def macro(template: str, name: str) -> Callable:
+    """
+    A macro from a template, compiled once per process.
+    """
+    return getattr(env.get_template(template).module, name)
+
+
+@functools.lru_cache(maxsize=None)
+def fragment(template: str, name: str) -> Callable[..., str]:
+    """
+    A macro flattened into the text around its arguments, so that
+    producing a fragment costs little more than str.format. Only macros
+    whose output depends on nothing but where their arguments go can
+    be flattened. As when the macro is called, arguments are escaped
+    unless they are Markup.
+    """
+    source = macro(template, name)
+    arguments = [Markup(f"\x00{n}\x00") for n in range(len(source.arguments))]
+    text = str(source(*arguments)).replace("{", "{{").replace("}", "}}")
+    format = ARGUMENT.sub(r"{\1}", text).format
+
+    def render(*args) -> str:
+        # Passing Markup by is cheaper than escape(), which copies it.
+        return format(*[a if isinstance(a, Markup) else escape(a) for a in args])
+
+    return render
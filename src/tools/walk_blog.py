@@ -1,29 +1,85 @@
 """
 Process a document into publishable blog format.
 """
-import json
+import argparse
+import multiprocessing
 import os
+import re
 import sys
+import time
 import webbrowser
-from functools import partial
-from io import StringIO
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from functools import lru_cache
+from html import escape
+from typing import Iterator
 from typing import List
-
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from typing import Union
+
+import highlight
+from doc_utils import BLANK
+from doc_utils import classify_document
+from doc_utils import CODE
+from doc_utils import decode_tags
 from doc_utils import element_type
-from doc_utils import para_type
-from doc_utils import paragraphs_from
+from doc_utils import elements_from
+from doc_utils import encode_tags
+from doc_utils import HEADING
+from doc_utils import LIST_ITEM
+from doc_utils import NORMAL
+from doc_utils import STYLED
+from doc_utils import TABLE
+from doc_utils import tag_sections
+from docs import batched
+from docs import connection
+from docs import content_hash
+from docs import Documents
+from docs import HighlightCache
+from docs import init_db
+from docs import notify
+from docs import shutdown_db
 from docs import SQLDoc
+from docs import stored_assets
+from highlight import Highlighter
 from hu import ObjectDict as OD
+from lru import LRUCache
+from markupsafe import Markup
+from model import as_document
+from model import Document
+from model import InlineObject
+from model import Paragraph
+from model import Table
+from model import TextStyle
 from snippets import snippet_ranges
+from templates import fragment
+from templates import macro
+
+
+# Change this whenever a change to the rendering code alters its
+# output, so that stored HTML is re-rendered by load and render-all
+# (see renderer_version).
+RENDERER_VERSION = "10"
+# Highlights code, sharing the results through the database.
+stored_highlighter = Highlighter(HighlightCache())
+
+# Rendered footnote bodies by footnoteId, for each (documentId, revisionId).
+footnote_cache = LRUCache(int(os.environ.get("FOOTNOTE_CACHE_SIZE", 256)))
 
+RENDER_STATE_FIELDS = ("title", "content_hash", "rendered_hash", "renderer_version")
 
+FRAGMENTS = "fragments.html"
+# Font families are written into the stylesheet unquoted, so only names
+# that can do no harm there are used.
+FONT_FAMILY = re.compile(r"[A-Za-z0-9 _-]+")
+HEADING_TAGS = {f"HEADING_{level}": f"h{level}" for level in range(1, 7)}
 MARKER = "# snippet "
 EXTRACT_PATH = "/Users/sholden/Projects/Python/blogAlexSteve/src/extracted"
 SNIPPET_PATH = "/Users/sholden/Projects/Python/blogAlexSteve/src/snippets"
-footnote_map = {}
-font_map = set()
-snippets = []
-snippet_names = []
 
 
 def handle_paragraph(p: OD) -> None:
@@ -95,262 +151,743 @@ handle_content = SequenceOf(handle_structuralElement)
 # allowing code to appear in top-down rather than bottom-up ordering. (???)
 
 
-def render_code_chunk(chunk: List[str]) -> None:
+@dataclass
+class RenderError:
+    """
+    A problem found while rendering. Rendering carries on
+    regardless, so one document can report many errors. The
+    same class describes warnings, which don't fail a document.
     """
-    A chunk is simply a list of code lines to be
-    set as a single paragraph in monospaced font.
-    Confusingly we also call them snippets.
 
-    Note it might be wise to consider adopting
-    jinja2 early to remove presentation features
-    from this code. For now, there's HTML here.
+    kind: str
+    message: str
 
-    TODO: save the snippets to assemble an output file.
-    """
-    sep = "\n"
-    chunk = "".join(chunk).strip().splitlines()
-    result = f"""\
-<pre>
-  <code>
-{sep.join(chunk)}
-  </code>
-</pre>
-"""
-    #
-    # Verify snippet begins with a snippet id, extract code & name
-    #
-    line_gen = iter(chunk)
-    line = next(line_gen)
-    if not line.startswith(MARKER):
-        sys.exit(
-            f"No chunk identifier found in snippet:\n{line+sep+sep.join(line_gen)}"
-        )
-    name = line[len(MARKER) :].strip()
-    article, seq = name.rsplit("-", 1)
-    seq = int(seq)
-    snippets.append(chunk)
-    snippet_names.append(article)
-    pos = len(snippets)
-    if seq != pos:
-        sys.exit(
-            f"Snippet {seq} appears in position {pos}"
-        )  # print(f"{article}, {seq}", file=sys.stderr)
-    print(result)
-
-
-def render_structuralElements(p: OD) -> str:
-    """
-    Render the textRuns and footnoteReferences from a paragraph.
-    """
-    c_list = []
-    for element in p.elements:
-        e_type = element_type(element)
-        if e_type == "textRun":
-            style = element.textRun.textStyle
-            content = element.textRun.content
-            if "link" in style:
-                content = f"""<a href="{style.link.url}">{content}</a>"""
-            style_set = {}
-            handle_bold(style, style_set)
-            handle_italic(style, style_set)
-            handle_font_size(style, style_set)
-            handle_font_family(style, style_set)
-            if style_set:
-                span_style = "; ".join(f"{k}:{v}" for (k, v) in style_set.items())
-                content = f"""<span style="{span_style}">{content}</span>"""
-            c_list.append(content)
-        elif e_type == "footnoteReference":
-            fnr = element.footnoteReference
-            c_list.append(
-                f"""<a href="#footnote-{fnr.footnoteNumber}">[{fnr.footnoteNumber}]</a>"""
-            )
-            footnote_map[fnr.footnoteNumber] = fnr.footnoteId
-    return "".join(c_list)
+    def __str__(self):
+        return f"{self.kind}: {self.message}"
 
 
-def handle_font_family(style, style_set):
+@lru_cache(maxsize=1024)
+def style_declarations(key: Tuple) -> str:
     """
+    The CSS for a style key, shared between documents.
+
     TODO: This was originally intended to condition the use of fontAwesome
     fonts, but it would be better to use the native Google fonts from the
     get-go even if this means a radical change to the styles.
     """
+    bold, italic, font_size, font_family = key
+    declarations = []
+    if bold:
+        declarations.append("font-weight:bold")
+    if italic:
+        declarations.append("font-style:italic")
+    if font_size is not None:
+        declarations.append(f"font-size:{font_size}pt")
+    if font_family and FONT_FAMILY.fullmatch(font_family):
+        declarations.append(f"font-family:{font_family}")
+    return "; ".join(declarations)
+
+
+class StyleCompiler:
+    """
+    Gives each distinct text style used in a document a CSS class,
+    so spans refer to a class rather than repeating an inline style.
+    """
 
-    if "weightedFontFamily" in style and style.weightedFontFamily:
-        wff = style.weightedFontFamily
-        if "weight" in wff and wff.weight:
-            style_set["font_weight"] = wff.weight
-        if "fontFamily" in wff and wff.fontFamily:
-            style_set["font-family"] = wff.fontFamily
-            font_map.add(wff.fontFamily)
+    def __init__(self):
+        self.spans = {}
+        # The keys of self.spans in the order their classes were allocated.
+        self.keys = []
+        self.by_style = {}
+        self.classes = {}
+        self.fonts = set()
 
+    def span(self, style: TextStyle) -> Tuple[str, str]:
+        """
+        Return the tags to open and close a span in the given style
+        (both empty for unstyled text).
+        """
+        # Styles are interned by the model, so are looked up by identity
+        # before falling back to the (slower to hash) style key.
+        try:
+            return self.by_style[style]
+        except KeyError:
+            tags = self.by_style[style] = self.tags(style.key)
+            return tags
+
+    def tags(self, key: Tuple) -> Tuple[str, str]:
+        try:
+            return self.spans[key]
+        except KeyError:
+            pass
+        declarations = style_declarations(key)
+        if declarations:
+            class_name = f"ts-{len(self.classes) + 1}"
+            self.classes[class_name] = declarations
+            html = fragment(FRAGMENTS, "span")(class_name, "\x00")
+            tags = tuple(html.split("\x00"))
+        else:
+            tags = "", ""
+        if key[3]:
+            self.fonts.add(key[3])
+        self.spans[key] = tags
+        self.keys.append(key)
+        return tags
 
-def handle_font_size(style, style_set):
-    if "fontSize" in style:
-        style_set["font-size"] = f"{style.fontSize.magnitude}pt"
+    def stylesheet(self) -> str:
+        if not self.classes:
+            return ""
+        return str(macro(FRAGMENTS, "stylesheet")(self.classes))
 
 
-def handle_italic(style, style_set):
-    if "italic" in style and style.italic:
-        style_set["font-style"] = "italic"
+class Renderer:
+    """
+    Renders one document to HTML. All state accumulated while rendering
+    (footnotes referenced, fonts used, snippets found, errors and warnings)
+    belongs to the instance, so renderers are cheap to create and many
+    can be used in the same process, even concurrently. Code chunks are
+    highlighted by the given highlighter, by default without caching.
+    Images are served from the given assets (an AssetStore, or any
+    mapping of (documentId, inlineObjectId) to Assets); those not stored
+    are left out with a warning, since the URIs in the document expire.
+    """
 
+    def __init__(self, highlighter: Optional[Highlighter] = None, assets=None):
+        # The footnoteIds referenced, by their numbers.
+        self.footnote_map = {}
+        self.highlight = highlighter or Highlighter()
+        self.assets = assets if assets is not None else {}
+        self.styles = StyleCompiler()
+        self.font_map = self.styles.fonts
+        self.snippets = []
+        self.snippet_names = []
+        self.errors: List[RenderError] = []
+        self.warnings: List[RenderError] = []
+        # The ID, lists and images of the document being rendered.
+        self.document_id = None
+        self.list_levels = {}
+        self.images = {}
+        self.element_renderers, self.style_renderers = self.dispatch_tables()
+        self.normal_text_html = fragment(FRAGMENTS, "normal_text")
+        self.heading_html = fragment(FRAGMENTS, "heading")
+        self.title_html = fragment(FRAGMENTS, "title")
+        self.subtitle_html = fragment(FRAGMENTS, "subtitle")
+        self.code_chunk_html = fragment(FRAGMENTS, "code_chunk")
+        self.link_html = fragment(FRAGMENTS, "link")
+        self.footnote_reference_html = fragment(FRAGMENTS, "footnote_reference")
+        self.footnote_list_open_html = fragment(FRAGMENTS, "footnote_list_open")
+        self.footnote_html = fragment(FRAGMENTS, "footnote")
+        self.footnote_list_close_html = fragment(FRAGMENTS, "footnote_list_close")
+        self.image_html = fragment(FRAGMENTS, "image")
+        self.image_set_html = fragment(FRAGMENTS, "image_set")
+        self.list_open_html = fragment(FRAGMENTS, "list_open")
+        self.list_item_html = fragment(FRAGMENTS, "list_item")
+        self.list_item_end_html = fragment(FRAGMENTS, "list_item_end")
+        self.list_close_html = fragment(FRAGMENTS, "list_close")
+        self.table_html = fragment(FRAGMENTS, "table")
+        self.table_row_html = fragment(FRAGMENTS, "table_row")
+        self.table_cell_html = fragment(FRAGMENTS, "table_cell")
+
+    @classmethod
+    def dispatch_tables(cls) -> Tuple[dict, dict]:
+        """
+        ELEMENT_RENDERERS and STYLE_RENDERERS, with the names resolved
+        to this class's methods (so subclasses can override them). They
+        are built on first use and kept with the class.
+        """
+        tables = cls.__dict__.get("_dispatch_tables")
+        if tables is None:
+            tables = cls._dispatch_tables = (
+                {tag: getattr(cls, name) for tag, name in ELEMENT_RENDERERS.items()},
+                {style: getattr(cls, name) for style, name in STYLE_RENDERERS.items()},
+            )
+        return tables
 
-def handle_bold(style, style_set):
-    if "bold" in style and style.bold:
-        style_set["font-weight"] = "bold"
+    def error(self, kind: str, message: str) -> None:
+        self.errors.append(RenderError(kind, message))
 
+    def warn(self, kind: str, message: str) -> None:
+        self.warnings.append(RenderError(kind, message))
 
-def render_normal_text(p: OD) -> str:
-    result = f"""\
-<p class="normal_text">
-{render_structuralElements(p)}
-</p>
-"""
-    return result
+    def render(
+        self, document: Union[Document, dict, str, bytes], tags: array = None
+    ) -> str:
+        return "".join(self.stream(document, tags))
 
+    def stream(
+        self, document: Union[Document, dict, str, bytes], tags: array = None
+    ) -> Iterator[str]:
+        """
+        Generate the HTML of the body of the document, then of its
+        footnotes, a chunk at a time. Errors are complete only once
+        the generator is exhausted.
 
-def render_heading(h_type, p) -> str:
-    # TODO: should insert correct class, or possibly none at all
-    result = f"""\
-<{h_type} class="normal_text">{render_structuralElements(p)}</{h_type}>"""
-    return result
+        The document may be given as JSON text or decoded JSON, but
+        is rendered from its model. Its paragraphs are classified
+        unless their tags (from classify_document) are given.
+        """
+        document = as_document(document)
+        self.document_id = document.document_id
+        self.list_levels = document.lists
+        self.images = document.images
+        if tags is None:
+            tags = classify_document(document)
+        body_tags, footnote_tags = tag_sections(document, tags)
+        yield from self.render_paragraphs(elements_from(document.body, body_tags))
+        self.check_snippets()
+        #
+        # Finally, render the footnotes in such a way that the links
+        # from the body text correctly reference the anchors.
+        #
+        if self.footnote_map:
+            yield self.render_footnotes(document, footnote_tags)
+        # Only now are all the styles in use known.
+        yield self.styles.stylesheet()
 
+    def render_footnotes(self, document: Document, footnote_tags: dict) -> str:
+        """
+        Render the bodies of all the referenced footnotes in one pass,
+        then the whole list of them with their anchors.
+
+        Bodies are cached, as the chunks of HTML they were rendered
+        as, by document revision and footnoteId. The CSS
+        classes in a cached body were allocated by an earlier renderer
+        of the same revision, which had reached the same state as this
+        one, so replaying the styles that body introduced keeps the two
+        in step and the stylesheet complete.
+        """
+        revision = (document.document_id, document.revision_id)
+        cached = footnote_cache.get(revision) if document.revision_id else None
+        if cached is None:
+            cached = {}
+        rendered = {}
+        effects = self.side_effects()
+        style_keys = self.styles.keys
+        render_footnote = self.render_footnote
+        footnote_html = self.footnote_html
+        html = [self.footnote_list_open_html()]
+        append, extend = html.append, html.extend
+        for number, id in list(self.footnote_map.items()):
+            entry = cached.get(id)
+            if entry is None:
+                known_styles = len(style_keys)
+                chunks = render_footnote(document.footnotes[id], footnote_tags[id])
+                new_styles = ()
+                if len(style_keys) > known_styles:
+                    new_styles = tuple(style_keys[known_styles:])
+                rendered[id] = chunks, new_styles
+            else:
+                chunks, new_styles = entry
+                for style_key in new_styles:
+                    self.styles.tags(style_key)
+            append(footnote_html(number))
+            extend(chunks)
+        # Footnotes that do more than introduce styles aren't cached.
+        if rendered and document.revision_id and self.side_effects() == effects:
+            cached.update(rendered)
+            footnote_cache.put(revision, cached)
+        html.append(self.footnote_list_close_html())
+        return "".join(html)
+
+    def render_footnote(self, content: list, tags: array) -> Tuple[str, ...]:
+        """
+        The chunks of HTML of a footnote's body. Most footnotes are a
+        single paragraph, which is rendered directly.
+        """
+        if len(content) == 1:
+            renderer = self.element_renderers.get(tags[0])
+            if renderer is not None:
+                return (renderer(self, content[0]),)
+        return tuple(self.render_paragraphs(elements_from(content, tags)))
+
+    def side_effects(self) -> Tuple[int, int, int, int]:
+        return (
+            len(self.footnote_map),
+            len(self.errors),
+            len(self.warnings),
+            len(self.snippets),
+        )
 
-render_heading_1 = partial(render_heading, "h1")
-render_heading_2 = partial(render_heading, "h2")
-render_heading_3 = partial(render_heading, "h3")
+    def render_code_chunk(self, chunk: List[str]) -> str:
+        """
+        A chunk is simply a list of code lines to be
+        set as a single paragraph in monospaced font.
+        Confusingly we also call them snippets.
+        """
+        sep = "\n"
+        chunk = "".join(chunk).strip().splitlines()
+        result = self.code_chunk_html(Markup(self.highlight(sep.join(chunk))))
+        #
+        # Verify snippet begins with a snippet id, extract code & name
+        #
+        line = chunk[0] if chunk else ""
+        if not line.startswith(MARKER):
+            self.error(
+                "snippet", f"No chunk identifier found in snippet:\n{sep.join(chunk)}"
+            )
+            return result
+        name = line[len(MARKER) :].strip()
+        try:
+            article, seq = name.rsplit("-", 1)
+            seq = int(seq)
+        except ValueError:
+            self.error("snippet", f"Malformed snippet identifier {name!r}")
+            return result
+        self.snippets.append(chunk)
+        self.snippet_names.append(article)
+        pos = len(self.snippets)
+        if seq != pos:
+            self.error("snippet", f"Snippet {seq} appears in position {pos}")
+        return result
+
+    def check_snippets(self) -> None:
+        """
+        Verify that all snippets are tagged for the same article.
+        """
+        all_names = set(self.snippet_names)
+        if len(all_names) > 1:
+            self.error("snippet", f"Multiple snippet series: {', '.join(all_names)}")
 
-renderer = {
-    "NORMAL_TEXT": render_normal_text,
-    "HEADING_1": render_heading_1,
-    "HEADING_2": render_heading_2,
-    "HEADING_3": render_heading_3,
-}
+    def render_structuralElements(self, p: Paragraph) -> str:
+        """
+        Render the textRuns and footnoteReferences from a paragraph.
+        """
+        c_list = []
+        append = c_list.append
+        # The spans of styles already seen are looked up without a call.
+        spans = self.styles.by_style
+        span = self.styles.span
+        for element in p.elements:
+            e_type = element.kind
+            if e_type == "textRun":
+                style = element.style
+                content = element.content
+                # Testing first is cheaper than escaping every run.
+                if "&" in content or "<" in content or ">" in content:
+                    content = escape(content, quote=False)
+                if style.link_url:
+                    content = self.link_html(style.link_url, Markup(content))
+                try:
+                    start, end = spans[style]
+                except KeyError:
+                    start, end = span(style)
+                # Cheaper than formatting the three into one string first.
+                append(start)
+                append(content)
+                append(end)
+            elif e_type == "footnoteReference":
+                number = element.number
+                append(self.footnote_reference_html(number))
+                self.footnote_map[number] = element.footnote_id
+            elif e_type == "inlineObjectElement":
+                append(self.render_image(element))
+        return Markup("".join(c_list))
+
+    def render_image(self, element: InlineObject) -> str:
+        image = self.images.get(element.object_id)
+        if image is None:
+            self.error("image", f"No image for inline object {element.object_id!r}")
+            return ""
+        asset = self.assets.get((self.document_id, element.object_id))
+        if asset is None:
+            self.warn("image", f"Image {element.object_id!r} has not been stored")
+            return ""
+        alt = image.description or ""
+        if not asset.variants:
+            return self.image_html(asset.url(), alt)
+        return self.image_set_html(asset.url(), asset.srcset(), asset.sizes(), alt)
+
+    def render_styled(self, p: Paragraph) -> str:
+        """
+        Render a paragraph as its named style dictates. Paragraphs in
+        styles without a renderer are rendered as normal text.
+        """
+        handler = self.style_renderers.get(p.style_type)
+        if handler is None:
+            self.warn("style", f"Unsupported paragraph style {p.style_type!r}")
+            handler = self.style_renderers["NORMAL_TEXT"]
+        return handler(self, p)
+
+    def render_normal_text(self, p: Paragraph) -> str:
+        return self.normal_text_html(self.render_structuralElements(p))
+
+    def render_heading(self, p: Paragraph) -> str:
+        # TODO: should insert correct class, or possibly none at all
+        return self.heading_html(
+            HEADING_TAGS[p.style_type], self.render_structuralElements(p)
+        )
 
+    def render_title(self, p: Paragraph) -> str:
+        return self.title_html(self.render_structuralElements(p))
 
-def render_paragraphs(paragraph_stream):
-    chunk = []
-    fragments = []
-    for para in paragraph_stream:
-        p_type, elements = para_type(para, len(chunk) != 0)
-        #
-        # Special case: code paragraphs are accumulated
-        # into a chunk, which becomes a single paragraph
-        # rendered as <pre><code>.
-        #
-        if p_type == "code":
-            chunk.append(elements[0].textRun.content)
-        #
-        # Other paragraph types are rendered as an appropriate
-        # HTML element as set in a lookup table. Rendering can
-        # then be performed on the paragraphs' textRun elements.
-        #
-        else:
+    def render_subtitle(self, p: Paragraph) -> str:
+        return self.subtitle_html(self.render_structuralElements(p))
+
+    def render_list_item(self, p: Paragraph, lists: List[Tuple[str, str]]) -> str:
+        """
+        Render a bulleted paragraph as an item of a list nested as deep
+        as its bullet, opening and closing lists as necessary. The lists
+        open (as (listId, tag) pairs, outermost first) are kept by the
+        caller; the item itself is left open for any nested list. A list
+        opened to reach a deeper item is given an empty item to hold it.
+        """
+        bullet = p.bullet
+        html = []
+        if lists and lists[0][0] != bullet.list_id:
+            html.append(self.close_lists(lists, 0))
+        if len(lists) > bullet.level + 1:
+            html.append(self.close_lists(lists, bullet.level + 1))
+        if len(lists) == bullet.level + 1:
+            html.append(self.list_item_end_html())
+        numbered = self.list_levels.get(bullet.list_id, ())
+        while len(lists) <= bullet.level:
+            depth = len(lists)
+            tag = "ol" if depth < len(numbered) and numbered[depth] else "ul"
+            lists.append((bullet.list_id, tag))
+            html.append(self.list_open_html(tag))
+            if depth < bullet.level:
+                html.append(self.list_item_html(""))
+        html.append(self.list_item_html(self.render_structuralElements(p)))
+        return "".join(html)
+
+    def close_lists(self, lists: List[Tuple[str, str]], depth: int) -> str:
+        """
+        Close the open lists, and their open items, nested deeper than depth.
+        """
+        html = []
+        while len(lists) > depth:
+            _, tag = lists.pop()
+            html.append(self.list_close_html(tag))
+        return "".join(html)
+
+    def render_table(self, table: Table) -> str:
+        """
+        Render a table, whose cells hold structural elements of their
+        own. Cell content is classified as it is rendered.
+        """
+        rows = []
+        for row in table.rows:
+            cells = [
+                self.table_cell_html(
+                    Markup("".join(self.render_paragraphs(elements_from(c))))
+                )
+                for c in row
+            ]
+            rows.append(self.table_row_html(Markup("".join(cells))))
+        return self.table_html(Markup("".join(rows)))
+
+    def render_paragraphs(self, paragraph_stream) -> Iterator[str]:
+        """
+        Render (tag, element) pairs from doc_utils.elements_from.
+        """
+        chunk = []
+        lists = []
+        for tag, element in paragraph_stream:
+            #
+            # Special case: code paragraphs are accumulated
+            # into a chunk, which becomes a single paragraph
+            # rendered as <pre><code>.
+            #
+            if tag == CODE or (chunk and tag == BLANK):
+                # Code that isn't itself a list item ends any lists.
+                if not chunk and lists and element.bullet is None:
+                    yield self.close_lists(lists, 0)
+                chunk.append(element.elements[0].content)
+                continue
             if chunk:  # Emit any accumulated chunk
-                fragments.append(render_code_chunk(chunk))
+                yield self.render_code_chunk(chunk)
                 chunk = []
+            # Consecutive list items make up (possibly nested) lists.
+            if tag == LIST_ITEM:
+                yield self.render_list_item(element, lists)
+                continue
+            if lists:
+                yield self.close_lists(lists, 0)
             # Outside a code chunk ignore blank paras
-            if len(elements) == 1 and elements[0].textRun.content == "\n":
+            if tag == BLANK:
                 continue
-            fragments.append(renderer[p_type](para))  # call handler selected by type
-        # Handle edge case where post ends with a code sequence.
-    else:
+            #
+            # Other elements are rendered by the handler for
+            # their class, as set in a lookup table.
+            #
+            yield self.element_renderers[tag](self, element)
+        # Handle edge cases where the content ends with code or a list.
         if chunk:
-            fragments.append(render_code_chunk(chunk))
-            chunk = []
-    return "".join(fragments)
+            yield self.render_code_chunk(chunk)
+        if lists:
+            yield self.close_lists(lists, 0)
+
+
+# How each class of element (see doc_utils) is rendered, by method name.
+# Code, blank paragraphs and list items depend on their neighbours, so
+# are dealt with by render_paragraphs itself.
+ELEMENT_RENDERERS = {
+    NORMAL: "render_normal_text",
+    HEADING: "render_styled",
+    STYLED: "render_styled",
+    TABLE: "render_table",
+}
+# How paragraphs of each named style are rendered, by method name.
+STYLE_RENDERERS = {
+    "NORMAL_TEXT": "render_normal_text",
+    "TITLE": "render_title",
+    "SUBTITLE": "render_subtitle",
+    **{heading: "render_heading" for heading in HEADING_TAGS},
+}
 
 
-def main(args=sys.argv) -> str:
+def update_snippet_file(snippet_names: List[str], snippets: List[List[str]]) -> None:
+    """
+    We have a snippet "series name" for this series of snippets, and
+    in the extracted directory a bunch of files named snippet_series-1.py,
+    snippet_series-2.py and so on. We use the content of each file to
+    replace the corresponding snippet in the src/snippets/snippet_series.py
+    file, producing a src/snippets/snippet_series.py_new file containing the
+    extracted snippets. If this differs from the source file then editing
+    has taken place.
     """
-    Process a Google docs document into a blog entry.
+    series_name = snippet_names[0]
+    snippet_file_path = os.path.join(
+        SNIPPET_PATH, f"{series_name.replace('-', '_')}.py"
+    )
+    with open(snippet_file_path) as in_file, open(
+        snippet_file_path + "_new", "w"
+    ) as out_file:
+        in_lines = in_file.readlines()
+        ranges = snippet_ranges(in_lines)
+        pos = 0
+        for (start, end), chunk in zip(ranges, snippets):
+            # Copy the source lines preceding the snippet
+            for i in range(pos, start):
+                out_file.write(in_lines[i])
+            pos = end
+            # Copy out the snippet
+            for line in chunk:
+                out_file.write(f"{line}\n")
+        for line in in_lines[pos:-1]:
+            out_file.write(line)
+
+
+def load_document(df: SQLDoc, fields=()) -> Tuple[OD, Document, array]:
+    """
+    Load a stored document's record (with the given fields), model and
+    paragraph classification. The classification is cached with the
+    document's JSON, so is only computed once per revision.
+    """
+    record = df.load(fields=("revisionId", "json", "tags", *fields))
+    if "content_hash" in fields and record.content_hash is None:
+        # The row predates content hashes: hash the JSON being rendered.
+        record.content_hash = content_hash(record.json)
+    document = as_document(record.json)
+    tags = decode_tags(record.tags, document)
+    if tags is None:
+        tags = classify_document(document)
+        df.set_tags(record.revisionId, encode_tags(tags))
+    return record, document, tags
+
+
+def main(args=sys.argv, out: Optional[TextIO] = None) -> Optional[str]:
+    """
+    Process a Google docs document into a blog entry, which is
+    returned or, if a file is given, written to it as it is rendered.
     """
     document_id: str = args[1]
-    df = SQLDoc(document_id)
-    record = df.load()
-    document = OD(json.loads(record.json))
-    document = OD(document)
-    #
-    # Render the document body.
-    #
-    paragraph_stream = paragraphs_from(document.body.content)
-    fragments = [render_paragraphs(paragraph_stream)]
-    #
-    # Verify that all snippets are tagged for the same article.
-    # TODO: skip this whole section if there are no snippets!
-    #
-    if snippet_names:
-        all_names = set(snippet_names)
-        if len(all_names) != 1:
-            sys.exit(f"Multiple snippet series: {', '.join(all_names)}")
-        #
-        # Otherwise we have a snippet "series name" for this series of
-        # snippets, and in the extracted directory a bunch of files named
-        # snippet_series-1.py, snippet_series-2.py and so on.
-        # We use the content of each file to replace the corresponding
-        # snippet in the src/snippets/snippet_series.py file, producing
-        # a src/snippets/snippet_series.py_new file containing the
-        # extracted snippets. If this differs from the source file then
-        # editing has taken place.
-        #
-        series_name = snippet_names[0]
-        snippet_file_path = os.path.join(
-            SNIPPET_PATH, f"{series_name.replace('-', '_')}.py"
-        )
-        with open(snippet_file_path) as in_file, open(
-            snippet_file_path + "_new", "w"
-        ) as out_file:
-            in_lines = in_file.readlines()
-            ranges = snippet_ranges(in_lines)
-            pos = 0
-            for rng, ((start, end), chunk) in enumerate(zip(ranges, snippets), start=1):
-                # Copy the source lines preceding the snippet
-                for i in range(pos, start):
-                    out_file.write(in_lines[i])
-                pos = end
-                # Copy out the snippet
-                for line in chunk:
-                    fragments.append(line)
-            for line in in_lines[pos:-1]:
-                out_file.write(line)
-    #
-    # Finally, render the footnotes in such a way that the links
-    # from the body text correctly reference the anchors.
-    #
-    # TODO: Move the HTML into a template and generate
-    #       whole section with jinja2
-    #
-    if footnote_map:
-        fragments.append(
-            """<h3>Footnotes</h3>
-        <ol id="footnotes">
-"""
-        )
-        for number, id in footnote_map.items():
+    _, document, tags = load_document(SQLDoc(document_id))
+    renderer = Renderer(stored_highlighter, stored_assets)
+    chunks = renderer.stream(document, tags)
+    if out is None:
+        result = "".join(chunks)
+    else:
+        result = None
+        for chunk in chunks:
+            out.write(chunk)
+    for warning in renderer.warnings:
+        print(f"Warning: {warning}", file=sys.stderr)
+    if renderer.errors:
+        sys.exit("\n".join(str(error) for error in renderer.errors))
+    if renderer.snippet_names:
+        update_snippet_file(renderer.snippet_names, renderer.snippets)
+    return result
 
-            fragments.append(f"""        <li id="footnote-{number}">""")
-            fragments.append(
-                render_paragraphs(paragraphs_from(document.footnotes[id].content))
-            )
-        fragments.append(
-            """
-            </ol>
-"""
-        )
-    #
-    # Let's just try and print it for now!
-    #
-    return "".join(fragments)
+
+def view(args: List[str] = sys.argv) -> None:
+    """
+    Send the HTML for a stored document to standard output as it is rendered.
+    """
+    init_db()
+    try:
+        main(args, sys.stdout)
+    finally:
+        shutdown_db()
+
+
+def renderer_version() -> str:
+    """
+    The version stored with rendered HTML. Highlighted code depends on
+    whether Pygments is installed, and on its version, as well as on
+    the renderer.
+    """
+    return f"{RENDERER_VERSION}/pygments-{highlight.version()}"
+
+
+def up_to_date(record: OD) -> bool:
+    """
+    Is the record's HTML rendered, by this version of the
+    renderer, from the document's current JSON?
+    """
+    return (
+        record.content_hash is not None
+        and record.rendered_hash == record.content_hash
+        and record.renderer_version == renderer_version()
+    )
 
 
 def load(args: List[str] = sys.argv) -> None:
     """
-    Divert stdout to a StringIO for generation, then store in SQLite.
+    Render a stored document and store the resulting HTML in SQLite,
+    unless it is already up to date (--force renders it regardless).
     """
-    result = main(args)
-    document_id: str = args[1]
-    df = SQLDoc(document_id)
-    doc = OD(df.load())
-    df.set_html(result, doc.title)
+    parser = argparse.ArgumentParser(prog="load", description=load.__doc__)
+    parser.add_argument("document_id")
+    parser.add_argument("--force", action="store_true")
+    options = parser.parse_args(args[1:])
+    init_db()
+    try:
+        df = SQLDoc(options.document_id)
+        doc = df.load(fields=RENDER_STATE_FIELDS)
+        if up_to_date(doc) and not options.force:
+            print(f"{doc.title!r} is up to date")
+            return
+        source_hash = doc.content_hash
+        if source_hash is None:  # Stored before hashes were recorded.
+            source_hash = content_hash(df.load(fields=("json",)).json)
+        result = main([args[0], options.document_id])
+        df.set_html(result, doc.title, source_hash, renderer_version())
+    finally:
+        shutdown_db()
+
+
+@dataclass
+class RenderResult:
+    document_id: str
+    title: Optional[str]
+    html: Optional[str]
+    errors: List[str]
+    seconds: float
+    source_hash: Optional[str] = None
+    warnings: List[str] = field(default_factory=list)
+
+
+def render_document(document_id: str) -> RenderResult:
+    """
+    Render a stored document, reporting rather than raising any errors.
+    This runs in render_all's worker processes.
+    """
+    start = time.perf_counter()
+    title = html = source_hash = None
+    warnings = []
+    try:
+        record, document, tags = load_document(
+            SQLDoc(document_id), ("title", "content_hash")
+        )
+        title, source_hash = record.title, record.content_hash
+        renderer = Renderer(stored_highlighter, stored_assets)
+        html = renderer.render(document, tags)
+        errors = [str(error) for error in renderer.errors]
+        warnings = [str(warning) for warning in renderer.warnings]
+    except Exception as exc:
+        errors = [f"{type(exc).__name__}: {exc}"]
+    elapsed = time.perf_counter() - start
+    return RenderResult(
+        document_id, title, html, errors, elapsed, source_hash, warnings
+    )
+
+
+def render_all(args: List[str] = sys.argv) -> None:
+    """
+    Render stored documents in parallel and store their HTML. Documents
+    already rendered from their current JSON by this version of the
+    renderer are skipped unless --force is given.
+    """
+    parser = argparse.ArgumentParser(prog="render-all", description=render_all.__doc__)
+    parser.add_argument("document_ids", nargs="*", help="default: every document")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-b", "--batch-size", type=int, default=20)
+    parser.add_argument("--force", action="store_true")
+    options = parser.parse_args(args[1:])
+
+    init_db()
+    try:
+        if options.force:
+            document_ids = options.document_ids or [
+                row[0] for row in Documents().list(fields="documentId", order_by="id")
+            ]
+        else:
+            document_ids = list(Documents().stale(renderer_version()))
+            if options.document_ids:
+                stale = set(document_ids)
+                document_ids = [d for d in options.document_ids if d in stale]
+        start = time.perf_counter()
+        # Worker processes are spawned rather than forked so that none
+        # of them inherits this process's SQLite connections.
+        with ProcessPoolExecutor(
+            options.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_db,
+        ) as executor:
+            results = executor.map(render_document, document_ids)
+            failures = store_rendered(report(results), options.batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutdown_db()
+    print(
+        f"Rendered {len(document_ids) - len(failures)} of {len(document_ids)}"
+        f" document(s) in {elapsed:.2f}s on {options.workers} worker(s)"
+    )
+    if failures:
+        sys.exit(f"Failed: {', '.join(failures)}")
+
+
+def report(results):
+    for result in results:
+        if result.errors:
+            print(f"FAILED {result.document_id}", file=sys.stderr)
+            for error in result.errors:
+                print(f"    {error}", file=sys.stderr)
+        else:
+            print(
+                f"{result.seconds * 1000:9.1f} ms  {result.document_id}  {result.title}"
+            )
+        for warning in result.warnings:
+            print(f"    warning: {warning}", file=sys.stderr)
+        yield result
+
+
+def store_rendered(results, batch_size: int) -> List[str]:
+    """
+    Store the HTML of successful results in transactions of `batch_size`
+    documents, returning the ids of the documents that failed.
+    """
+    failures = []
+    for batch in batched(results, batch_size):
+        stored = []
+        with connection() as conn:
+            for result in batch:
+                if result.errors:
+                    failures.append(result.document_id)
+                else:
+                    SQLDoc(result.document_id).store_html(
+                        conn,
+                        result.html,
+                        result.title,
+                        result.source_hash,
+                        renderer_version(),
+                    )
+                    stored.append(result.document_id)
+            conn.commit()
+        for document_id in stored:
+            notify(document_id)
+    return failures
 
 
 def browse(args: List[str] = sys.argv) -> None:
@@ -358,6 +895,13 @@ def browse(args: List[str] = sys.argv) -> None:
     Serve up an already-loaded page in a new browser window.
     """
     document_id: str = args[1]
+    init_db()
+    try:
+        record = SQLDoc(document_id).load(fields=("html", "title"))
+    finally:
+        shutdown_db()
+    if not record.html:
+        sys.exit(f"{record.title!r} has not been loaded: nothing to browse")
     webbrowser.open(f"http://localhost:5000/blog/{document_id}")
 
 
@@ -367,7 +911,7 @@ def showjson(args: List[str] = sys.argv) -> None:
     """
     document_id: str = args[1]
     df = SQLDoc(document_id)
-    record = df.load()
+    record = df.load(fields=("json",))
     print(record.json)
 
 
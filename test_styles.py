@@ -55,3 +55,49 @@ def test_flattening():
         'borderRight': "Four Bananas"
     })
     assert d == ss.to_dict()
+
+def test_pop_restores_hidden_values():
+    """
+    Verify that popping a layer restores what it hid, including
+    keys the base layer doesn't have and keys set after the push.
+    """
+    ss = StyleStack('text')
+    ss.push({'bold': True, 'fontSize': 12})
+    ss.push({'bold': False})
+    ss['italic'] = True
+    assert (ss['bold'], ss['italic'], ss['fontSize']) == (False, True, 12)
+    assert ss.pop() == {'bold': False, 'italic': True}
+    assert (ss['bold'], ss['italic'], ss['fontSize']) == (True, None, 12)
+    ss.pop()
+    assert ss.to_dict() == style_types['text']
+    with pytest.raises(KeyError):
+        _ = ss['fontSize']
+    with pytest.raises(IndexError):
+        ss.pop()
+
+def test_flattening_is_cached():
+    """
+    Verify the flattened dict is only rebuilt when the stack changes.
+    """
+    ss = StyleStack()
+    ss.push({'borderTop': "One Banana"})
+    flat = ss.merged
+    assert ss.to_dict() == flat and ss.merged is flat
+    ss.push({})
+    assert ss.merged is flat
+    ss.push({'borderBottom': "Two Bananas"})
+    assert ss.merged is not flat and ss.to_dict()['borderTop'] == "One Banana"
+
+
+def test_flattened_styles_are_read_only():
+    """
+    Verify the flattened styles, which may be shared by several layers,
+    can't be changed through to_dict.
+    """
+    ss = StyleStack('text')
+    ss.push({'bold': True})
+    ss.push()
+    with pytest.raises(TypeError):
+        ss.to_dict()['bold'] = False
+    ss.pop()
+    assert ss.to_dict()['bold'] is True
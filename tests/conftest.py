@@ -0,0 +1,102 @@
+import copy
+from datetime import datetime
+from datetime import timedelta
+
+import docs
+import pytest
+
+
+@pytest.fixture
+def docs_db(tmp_path, monkeypatch):
+    """
+    Point the document store at a fresh database for the duration of a test.
+    """
+    path = str(tmp_path / "docs.db")
+    monkeypatch.setenv("DOCS_DB_PATH", path)
+    yield docs.init_db(path, pool_size=2)
+    docs.shutdown_db()
+
+
+class FakeRequest:
+    def __init__(self, service, document_id, fields):
+        self.service = service
+        self.document_id = document_id
+        self.fields = fields
+
+    def execute(self, **kw):
+        self.service.requests.append((self.document_id, self.fields))
+        failures = self.service.failures.get(self.document_id)
+        if failures:
+            raise failures.pop(0)
+        document = copy.deepcopy(self.service.documents_by_id[self.document_id])
+        if self.fields:
+            names = self.fields.split(",")
+            document = {k: v for (k, v) in document.items() if k in names}
+        return document
+
+
+class FakeDocsService:
+    """
+    Stands in for the object googleapiclient builds for the Docs API,
+    serving documents from a dict and recording each request made.
+    Requests for a document first raise any exceptions in its `failures`.
+    """
+
+    def __init__(self, documents=()):
+        self.documents_by_id = {d["documentId"]: d for d in documents}
+        self.requests = []
+        self.failures = {}
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None):
+        return FakeRequest(self, documentId, fields)
+
+
+@pytest.fixture
+def fake_service():
+    return FakeDocsService
+
+
+class FakeCredentials:
+    """
+    Mimics google.oauth2.credentials.Credentials closely enough for docs.
+    """
+
+    def __init__(self, lifetime=timedelta(hours=1)):
+        self.lifetime = lifetime
+        self.refreshes = 0
+        self.expiry = datetime.utcnow() + lifetime
+
+    @property
+    def valid(self):
+        return datetime.utcnow() < self.expiry
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.expiry = datetime.utcnow() + self.lifetime
+
+
+@pytest.fixture
+def fake_auth(monkeypatch, fake_service):
+    """
+    Replace authentication and service discovery with fakes, counting calls.
+    """
+    calls = {"authenticate": 0, "build": 0}
+    creds = FakeCredentials()
+
+    def authenticate(cached=None):
+        calls["authenticate"] += 1
+        return creds
+
+    def build(*args, **kw):
+        calls["build"] += 1
+        return fake_service()
+
+    monkeypatch.setattr(docs, "authenticate", authenticate)
+    monkeypatch.setattr(docs, "build", build)
+    monkeypatch.setattr(docs, "save_credentials", lambda creds: None)
+    docs.forget_credentials()
+    yield creds, calls
+    docs.forget_credentials()
@@ -0,0 +1,171 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import assets
+import pytest
+import docs
+from assets import Asset
+from assets import AssetStore
+from docs import ImageCache
+from docs import SQLDoc
+from docs import store_many
+from test_walk_blog import document
+from test_walk_blog import inline_image
+from test_walk_blog import paragraph
+from test_walk_blog import text_run
+from walk_blog import Renderer
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 16
+JPEG = b"\xff\xd8\xff" + b"\0" * 16
+
+
+class FakeFetcher:
+    """
+    Serves image data from a dict, recording each URI fetched.
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self.fetched = []
+
+    def __call__(self, uri):
+        self.fetched.append(uri)
+        return self.images[uri]
+
+
+def test_images_are_stored_by_content(tmp_path):
+    fetch = FakeFetcher({"a": PNG, "b": PNG, "c": JPEG})
+    store = AssetStore(directory=str(tmp_path), fetch=fetch)
+    assert store.fetch({1: "a", 2: "b", 3: "c"}) == {}
+    a, b, c = (store.get(key) for key in (1, 2, 3))
+    assert a == b and a.filename().endswith(".png") and c.extension == "jpg"
+    assert sorted(os.listdir(tmp_path)) == sorted([a.filename(), c.filename()])
+    assert (tmp_path / a.filename()).read_bytes() == PNG
+    assert a.url() == f"/assets/images/docs/{a.hash}.png"
+
+
+def test_images_are_fetched_once(docs_db, tmp_path):
+    fetch = FakeFetcher({"a": PNG, "b": JPEG, "c": PNG})
+    AssetStore(ImageCache(), str(tmp_path), fetch).fetch({("doc", "1"): "a"})
+    # A new store, as in another process, finds the image through the cache,
+    # even though the URI it would be fetched from has since changed.
+    store = AssetStore(ImageCache(), str(tmp_path), fetch)
+    store.fetch({("doc", "1"): "c", ("doc", "2"): "b"})
+    store.fetch({("doc", "1"): "c", ("doc", "2"): "b"})
+    assert sorted(fetch.fetched) == ["a", "b"]
+
+
+def test_concurrent_requests_share_a_download(tmp_path):
+    release = threading.Event()
+    fetched = []
+
+    def slow_fetch(uri):
+        fetched.append(uri)
+        release.wait(5)
+        return PNG
+
+    store = AssetStore(directory=str(tmp_path), fetch=slow_fetch)
+    with ThreadPoolExecutor(4) as executor:
+        results = [executor.submit(store.fetch, {"a": "uri"}) for _ in range(4)]
+        release.set()
+    assert [result.result() for result in results] == [{}] * 4
+    assert fetched == ["uri"]
+
+
+def test_failures_are_returned(tmp_path):
+    store = AssetStore(directory=str(tmp_path), fetch=FakeFetcher({}))
+    failures = store.fetch({"a": "missing"})
+    assert list(failures) == ["a"] and isinstance(failures["a"], KeyError)
+    assert store.get("a") is None
+
+
+def test_variants(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    path = tmp_path / "wide.png"
+    Image.new("RGB", (800, 400)).save(path)
+    store = AssetStore(
+        directory=str(tmp_path / "assets"), fetch=lambda uri: path.read_bytes()
+    )
+    store.fetch({"wide": "uri"})
+    asset = store.get("wide")
+    assert (asset.width, asset.variants) == (800, (320, 640))
+    with Image.open(tmp_path / "assets" / asset.filename(320)) as variant:
+        assert variant.size == (320, 160)
+
+
+def test_variants_need_pillow(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "PILImage", None)
+    store = AssetStore(directory=str(tmp_path), fetch=FakeFetcher({"a": PNG}))
+    store.fetch({"a": "a"})
+    assert store.get("a").variants == ()
+
+
+def inline_objects(count, revision=""):
+    return {
+        f"img-{n}": {
+            "inlineObjectProperties": {
+                "embeddedObject": {
+                    "description": "Picture",
+                    "imageProperties": {"contentUri": f"https://img/{n}{revision}"},
+                }
+            }
+        }
+        for n in range(1, count + 1)
+    }
+
+
+def inline_uris(count):
+    return [f"https://img/{n}" for n in range(1, count + 1)]
+
+
+def image_document(document_id, revision=""):
+    doc = document(paragraph(inline_image("img-1")), images=inline_objects(3, revision))
+    doc.documentId = document_id
+    return doc
+
+
+def test_images_are_stored_with_documents(docs_db, tmp_path, monkeypatch, capsys):
+    fetch = FakeFetcher({"https://img/1": PNG, "https://img/2": JPEG})
+    fetch.images.update({"https://img/1?b": PNG, "https://img/2?b": JPEG})
+    store = AssetStore(ImageCache(), str(tmp_path / "assets"), fetch)
+    monkeypatch.setattr(docs, "stored_assets", store)
+    SQLDoc("doc-1").save(image_document("doc-1"))
+    store_many([("doc-2", image_document("doc-2"))])
+    # Each document's copy of an image is fetched, but stored once.
+    assert sorted(fetch.fetched) == sorted(inline_uris(3) * 2)
+    assert len(os.listdir(tmp_path / "assets")) == 2
+    assert "Image img-3 of doc-2 not stored" in capsys.readouterr().err
+    # The Docs API gives new URIs each time a document is fetched.
+    fetch.fetched.clear()
+    SQLDoc("doc-1").save(image_document("doc-1", "?b"))
+    assert fetch.fetched == ["https://img/3?b"]
+    html = Renderer(assets=store).render(SQLDoc("doc-1").load(fields=("json",)).json)
+    assert f'<img src="{store.get(("doc-1", "img-1")).url()}"' in html
+    assert "https://img" not in html
+
+
+def test_stored_images_are_rendered_with_srcset():
+    images = inline_objects(3)
+    stored = {
+        ("doc-1", "img-1"): Asset("abc", "png", 800, (320, 640)),
+        ("doc-1", "img-2"): Asset("def", "gif"),
+    }
+    renderer = Renderer(assets=stored)
+    html = renderer.render(
+        document(
+            paragraph(text_run("See "), *(inline_image(id) for id in sorted(images))),
+            images=images,
+        )
+    )
+    assert (
+        '<img src="/assets/images/docs/abc.png" srcset="'
+        "/assets/images/docs/abc-320w.png 320w, /assets/images/docs/abc-640w.png 640w,"
+        ' /assets/images/docs/abc.png 800w" sizes="(max-width: 800px) 100vw, 800px"'
+        ' alt="Picture">'
+    ) in html
+    assert '<img src="/assets/images/docs/def.gif" alt="Picture">' in html
+    assert "https://img" not in html
+    assert [str(warning) for warning in renderer.warnings] == [
+        "image: Image 'img-3' has not been stored"
+    ]
@@ -0,0 +1,407 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from datetime import timedelta
+
+import docs
+import httplib2
+import pytest
+from conftest import FakeCredentials
+from docs import SQLDoc
+from googleapiclient.errors import HttpError
+from hu import ObjectDict as OD
+
+
+def make_document(document_id, title="A Title"):
+    return OD({"documentId": document_id, "title": title, "body": {"content": []}})
+
+
+def test_save_and_load(docs_db):
+    doc = SQLDoc("doc-1")
+    assert not doc.cached()
+    doc.save(make_document("doc-1"))
+    assert doc.cached()
+    record = doc.load()
+    assert record.title == "A Title"
+    assert record.slug == "a-title"
+    doc.set_html("<p>Hello</p>", "A Title")
+    assert doc.load().html == "<p>Hello</p>"
+    doc.delete()
+    assert not doc.cached()
+
+
+def test_connections_are_reused(docs_db):
+    doc = SQLDoc("doc-1")
+    doc.save(make_document("doc-1"))
+    for _ in range(10):
+        doc.load()
+    assert len(docs_db.connections) == 1
+    with docs.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_pool_is_bounded(docs_db):
+    SQLDoc("doc-1").save(make_document("doc-1"))
+
+    def worker():
+        for _ in range(20):
+            SQLDoc("doc-1").load()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(docs_db.connections) <= docs_db.size
+
+
+def test_pool_acquire_times_out(tmp_path):
+    pool = docs.ConnectionPool(str(tmp_path / "docs.db"), size=1, timeout=0.01)
+    try:
+        with pool.connection():
+            with pytest.raises(docs.PoolTimeout):
+                pool.acquire()
+        with pool.connection() as conn:
+            assert conn.execute("SELECT 1").fetchone() == (1,)
+    finally:
+        pool.close()
+
+
+def test_schema_checked_once(docs_db, monkeypatch):
+    SQLDoc("doc-1").cached()
+    calls = []
+    monkeypatch.setattr(docs, "create_schema", calls.append)
+    docs.init_db(docs_db.path, pool_size=2)
+    SQLDoc("doc-1").cached()
+    assert calls == []
+
+
+def test_lookup_by_slug(docs_db):
+    SQLDoc("doc-1").save(make_document("doc-1", "Same Title"))
+    SQLDoc("doc-2").save(make_document("doc-2", "Same Title"))
+    assert SQLDoc("doc-2").load().slug == "same-title-2"
+    assert SQLDoc.by_slug("same-title").document_id == "doc-1"
+    assert SQLDoc.by_slug("same-title-2").document_id == "doc-2"
+    assert SQLDoc.by_slug("no-such-slug") is None
+
+
+def test_indexes_migrate_duplicates(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(docs.SCHEMA)
+    conn.executemany(
+        "INSERT INTO documents (documentId, title, slug) VALUES (?, ?, ?)",
+        [("a", "Old", "old"), ("a", "New", "new"), ("b", "New", "new")],
+    )
+    conn.commit()
+    conn.close()
+    docs.init_db(path)
+    try:
+        assert SQLDoc("a").load().title == "New"
+        assert SQLDoc.by_slug("new").document_id == "a"
+        assert SQLDoc.by_slug("new-3").document_id == "b"
+        with docs.connection() as conn:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM documents WHERE slug=?", ("new",)
+            ).fetchall()
+        assert "documents_slug" in str(plan)
+    finally:
+        docs.shutdown_db()
+
+
+def test_projected_load_is_lazy(docs_db, monkeypatch):
+    doc = SQLDoc("doc-1")
+    doc.save(make_document("doc-1"))
+    record = doc.load(fields=("html", "title"))
+    assert set(record) == {"html", "title"}
+    with pytest.raises(AttributeError):
+        record.document
+    with pytest.raises(ValueError):
+        doc.load(fields=("title", "no_such_field"))
+    decoded = []
+    monkeypatch.setattr(docs.json, "loads", lambda s: decoded.append(s) or {})
+    record = doc.load()
+    assert decoded == []
+    assert record.document == {}
+    assert record.document == {}
+    assert len(decoded) == 1
+
+
+def test_json_is_stored_compressed_by_revision(docs_db):
+    doc = SQLDoc("doc-1")
+    first = make_document("doc-1", "First")
+    first.revisionId = "rev-1"
+    doc.save(first)
+    second = make_document("doc-1", "Second")
+    second.revisionId = "rev-2"
+    doc.save(second)
+    with docs.connection() as conn:
+        assert conn.execute("SELECT json FROM documents").fetchall() == [(None,)]
+    assert doc.load().document.title == "Second"
+    assert [rev for (rev, when) in doc.revisions()] == ["rev-1", "rev-2"]
+    assert doc.load_revision("rev-1").title == "First"
+    doc.delete()
+    assert doc.revisions() == []
+
+
+def test_migrate_storage(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(docs.SCHEMA.split(";")[0])
+    document = make_document("doc-1")
+    document.revisionId = "rev-1"
+    conn.execute(
+        "INSERT INTO documents (documentId, title, slug, json) VALUES (?, ?, ?, ?)",
+        ("doc-1", "A Title", "a-title", json.dumps(document)),
+    )
+    conn.commit()
+    conn.close()
+    docs.migrate(["migrate", path])
+    docs.init_db(path)
+    try:
+        record = SQLDoc("doc-1").load()
+        assert record.revisionId == "rev-1"
+        assert record.document == document
+        assert record.content_hash == docs.content_hash(json.dumps(document))
+    finally:
+        docs.shutdown_db()
+
+
+def test_missing_hashes_are_backfilled(docs_db, monkeypatch):
+    document = make_document("doc-1")
+    SQLDoc("doc-1").save(document)
+    with docs.connection() as conn:
+        conn.execute("UPDATE documents SET content_hash=NULL")
+        conn.commit()
+    # As when a process first opens a database stored by older code.
+    monkeypatch.setattr(docs, "schema_checked", set())
+    docs.init_db(docs_db.path, pool_size=2)
+    record = SQLDoc("doc-1").load(fields=("content_hash",))
+    assert record.content_hash == docs.content_hash(json.dumps(document))
+
+
+def test_keyset_pages(docs_db):
+    for n in range(7):
+        SQLDoc(f"doc-{n}").save(make_document(f"doc-{n}", f"Title {n}"))
+    seen, after = [], None
+    while True:
+        page = list(docs.Documents().page("documentId", after=after, limit=3))
+        seen.extend(row[0] for (cursor, row) in page)
+        if len(page) < 3:
+            break
+        after = page[-1][0]
+    assert seen == [f"doc-{n}" for n in range(7)]
+    with pytest.raises(ValueError):
+        list(docs.Documents().page(order_by="title; DROP TABLE documents"))
+    with pytest.raises(ValueError):
+        list(docs.Documents().page(after="not a cursor"))
+    with pytest.raises(ValueError):
+        list(docs.Documents().page(after=docs.encode_cursor([{}])))
+
+
+def test_keyset_pages_by_publication(docs_db):
+    for n in range(5):
+        SQLDoc(f"doc-{n}").save(make_document(f"doc-{n}", f"Title {n}"))
+    with docs.connection() as conn:
+        for n, when in ((1, "2024-02-01"), (3, "2024-01-01")):
+            conn.execute(
+                """UPDATE documents SET when_published=? WHERE documentId=?""",
+                (when, f"doc-{n}"),
+            )
+        conn.commit()
+        plan = conn.execute(
+            """EXPLAIN QUERY PLAN SELECT id FROM documents
+               ORDER BY ifnull(when_published, ''), id"""
+        ).fetchall()
+    assert "documents_published" in str(plan)
+    seen, after = [], None
+    while True:
+        page = list(
+            docs.Documents().page(
+                "documentId", order_by="when_published", after=after, limit=2
+            )
+        )
+        seen.extend(row[0] for (cursor, row) in page)
+        if len(page) < 2:
+            break
+        after = page[-1][0]
+    assert seen == ["doc-0", "doc-2", "doc-4", "doc-3", "doc-1"]
+
+
+def test_list_filters_and_sorts_in_sql(docs_db):
+    for n in range(4):
+        SQLDoc(f"doc-{n}").save(make_document(f"doc-{n}", f"Title {n}"))
+    with docs.connection() as conn:
+        conn.execute(
+            """UPDATE documents SET status='published', when_published=?
+               WHERE documentId=?""",
+            ("2020-01-02 00:00:00", "doc-1"),
+        )
+        conn.execute(
+            """UPDATE documents SET status='published', when_published=?
+               WHERE documentId=?""",
+            ("2020-03-04 00:00:00", "doc-3"),
+        )
+        conn.commit()
+    listing = docs.Documents().list(
+        fields="documentID, title", order_by="-when_published", status="published"
+    )
+    assert list(listing) == [("doc-3", "Title 3"), ("doc-1", "Title 1")]
+    listing = docs.Documents().list(
+        fields=("documentId",),
+        published_after=datetime(2020, 1, 1),
+        published_before=datetime(2020, 2, 1),
+    )
+    assert list(listing) == [("doc-1",)]
+    assert len(list(docs.Documents().list(fields="id", limit=2))) == 2
+
+
+def test_list_rejects_unsafe_sql(docs_db):
+    with pytest.raises(ValueError):
+        list(docs.Documents().list(fields="id; DROP TABLE documents"))
+    with pytest.raises(ValueError):
+        list(docs.Documents().list(order_by="(SELECT 1)"))
+    with pytest.raises(ValueError):
+        list(docs.Documents().list(fields="json"))
+
+
+def test_listing_statements_are_reused(docs_db):
+    first = docs.DocumentQuery.build("id, title", "title", status="draft")
+    second = docs.DocumentQuery.build(["id", "title"], ["title"], status="published")
+    assert first.statement()[0] is second.statement()[0]
+
+
+def test_publish(docs_db):
+    doc = SQLDoc("doc-1")
+    doc.save(make_document("doc-1"))
+    doc.publish()
+    assert doc.load(fields=("status",)).status == "published"
+    assert list(docs.Documents().list("id", "documentId", status="published")) == [
+        ("doc-1",)
+    ]
+
+
+def test_sync_skips_unchanged_revisions(docs_db, fake_service):
+    document = make_document("doc-1")
+    document.revisionId = "rev-1"
+    service = fake_service([document])
+    doc = SQLDoc("doc-1")
+    assert doc.sync(service)
+    assert service.requests == [("doc-1", None)]
+    version = doc.version()
+    assert not doc.sync(service)
+    assert service.requests[-1] == ("doc-1", "revisionId")
+    assert len(service.requests) == 2
+    assert doc.version() == version
+    record = doc.load(fields=("fetched_at", "content_hash"))
+    assert record.fetched_at and len(record.content_hash) == 64
+    service.documents_by_id["doc-1"]["revisionId"] = "rev-2"
+    service.documents_by_id["doc-1"]["title"] = "New Title"
+    assert doc.sync(service)
+    assert doc.load(fields=("title",)).title == "New Title"
+    assert doc.version() == version + 1
+
+
+def test_unchanged_save_is_not_rewritten(docs_db):
+    doc = SQLDoc("doc-1")
+    doc.save(make_document("doc-1"))
+    version = doc.version()
+    doc.save(make_document("doc-1"))
+    assert doc.version() == version
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+def test_pull_many(docs_db, fake_service, monkeypatch, tmp_path):
+    service = fake_service([make_document(f"doc-{n}", f"Title {n}") for n in range(5)])
+    service.failures["doc-1"] = [http_error(503), ConnectionError()]
+    monkeypatch.setattr(docs, "docs_service", lambda: service)
+    monkeypatch.setattr(docs.time, "sleep", lambda seconds: None)
+    id_file = tmp_path / "ids.txt"
+    id_file.write_text("doc-3\ndoc-4\n")
+    docs.pull_many(
+        ["pull-many", "doc-0", "doc-1", "doc-2", "-f", str(id_file), "-b", "2"]
+    )
+    assert sorted(docs.Documents().list("id", "documentId")) == [
+        (f"doc-{n}",) for n in range(5)
+    ]
+    assert [r for r in service.requests if r[0] == "doc-1"] == [("doc-1", None)] * 3
+
+
+def test_pull_many_reports_failures(docs_db, fake_service, monkeypatch):
+    service = fake_service([make_document("doc-0"), make_document("doc-1", "Other")])
+    service.failures["doc-1"] = [http_error(404)]
+    monkeypatch.setattr(docs, "docs_service", lambda: service)
+    with pytest.raises(SystemExit):
+        docs.pull_many(["pull-many", "doc-0", "doc-1"])
+    assert SQLDoc("doc-0").cached()
+    assert not SQLDoc("doc-1").cached()
+    assert len(service.requests) == 2
+
+
+def test_sync_all_retries_and_reports_failures(docs_db, fake_service, monkeypatch):
+    documents = [make_document(f"doc-{n}", f"Title {n}") for n in range(3)]
+    for document in documents:
+        document.revisionId = "rev-1"
+        SQLDoc(document.documentId).save(document)
+    service = fake_service(documents)
+    service.documents_by_id["doc-2"]["revisionId"] = "rev-2"
+    service.failures["doc-0"] = [http_error(404)]
+    service.failures["doc-1"] = [http_error(503)]
+    monkeypatch.setattr(docs, "docs_service", lambda: service)
+    monkeypatch.setattr(docs.time, "sleep", lambda seconds: None)
+    with pytest.raises(SystemExit, match="1 of 3 document"):
+        docs.sync_all(["sync-all"])
+    requested = [document_id for document_id, _ in service.requests]
+    assert requested == ["doc-0", "doc-1", "doc-1", "doc-2", "doc-2"]
+    assert SQLDoc("doc-2").stored_revision() == "rev-2"
+
+
+def test_credentials_and_service_are_cached(fake_auth):
+    creds, calls = fake_auth
+    assert docs.docs_service() is docs.docs_service()
+    assert docs.credentials() is creds
+    assert calls == {"authenticate": 1, "build": 1}
+
+
+def test_requests_use_replacement_credentials(fake_auth, monkeypatch):
+    creds, calls = fake_auth
+    builders = []
+    monkeypatch.setattr(docs, "build", lambda *a, **kw: builders.append(kw))
+    docs.docs_service()
+    (request_builder,) = (kw["requestBuilder"] for kw in builders)
+    assert request_builder(None, None, "https://x").http.credentials is creds
+    # The refresh failed, so the OAuth flow ran again and gave new credentials.
+    replacement = FakeCredentials()
+    monkeypatch.setattr(docs, "authenticate", lambda cached: replacement)
+    creds.expiry = datetime.utcnow()
+    assert request_builder(None, None, "https://x").http.credentials is replacement
+
+
+def test_credentials_refreshed_before_expiry(fake_auth, monkeypatch):
+    creds, calls = fake_auth
+    monkeypatch.setattr(docs, "Request", lambda: None)
+    creds.lifetime = timedelta(seconds=docs.REFRESH_MARGIN + 0.05)
+    creds.refresh(None)
+    timer = docs.schedule_refresh(creds)
+    assert 0 < timer.interval <= 0.05
+    docs.cached_credentials = creds
+    timer.join(1)
+    assert creds.refreshes == 2
+    assert docs.refresh_timer is not timer
+
+
+def test_pull_timings(docs_db, fake_auth, monkeypatch):
+    creds, calls = fake_auth
+    service = docs.docs_service()
+    service.documents_by_id["doc-1"] = make_document("doc-1")
+    reports = []
+    monkeypatch.setattr(docs, "timing_hook", reports.append)
+    SQLDoc("doc-1").pull()
+    SQLDoc("doc-1").pull()
+    assert [t.document_id for t in reports] == ["doc-1", "doc-1"]
+    assert all(t.auth >= 0 and t.discovery >= 0 and t.fetch > 0 for t in reports)
+    assert calls == {"authenticate": 1, "build": 1}
@@ -0,0 +1,39 @@
+import highlight
+import pytest
+from docs import HighlightCache
+from highlight import Highlighter
+
+
+def test_highlight():
+    pytest.importorskip("pygments")
+    html = highlight.highlight("if a < b:\n    pass")
+    assert '<span class="k">if</span>' in html and "&lt;" in html
+    assert not html.endswith("\n")
+
+
+def test_highlight_without_pygments(monkeypatch):
+    monkeypatch.setattr(highlight, "pygments", None)
+    assert highlight.highlight("a < b") == "a &lt; b"
+
+
+def test_cache_key():
+    key = highlight.cache_key("x = 1", "python")
+    assert key == highlight.cache_key("x = 1", "python")
+    assert key != highlight.cache_key("x = 2", "python")
+    assert key != highlight.cache_key("x = 1", "python3")
+
+
+def test_highlights_are_shared_through_the_database(docs_db, monkeypatch):
+    pytest.importorskip("pygments")
+    calls = []
+    original = highlight.highlight
+
+    def counting(code, lexer=highlight.DEFAULT_LEXER):
+        calls.append(code)
+        return original(code, lexer)
+
+    monkeypatch.setattr(highlight, "highlight", counting)
+    first = Highlighter(HighlightCache())("x = 1")
+    assert Highlighter(HighlightCache())("x = 1") == first
+    assert Highlighter(HighlightCache())("x = 2") != first
+    assert calls == ["x = 1", "x = 2"]
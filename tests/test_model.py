@@ -0,0 +1,102 @@
+import json
+
+import model
+from test_walk_blog import code
+from test_walk_blog import footnote_ref
+from test_walk_blog import inline_image
+from test_walk_blog import paragraph
+from test_walk_blog import SAMPLE
+from test_walk_blog import table
+from test_walk_blog import text_run
+
+
+def test_from_json():
+    document = model.from_json(json.dumps(SAMPLE))
+    assert (document.document_id, document.title) == ("doc-1", "Test Document")
+    heading, styled, snippet, _, noted = document.body
+    assert heading.style_type == "HEADING_1"
+    assert [run.content for run in styled.elements] == ["Some ", "bold", " text\n"]
+    assert styled.elements[1].style.key == (True, False, None, None)
+    assert snippet.elements[0].style.font_family == "Consolas"
+    assert noted.elements[1].kind == "footnoteReference"
+    assert (noted.elements[1].number, noted.elements[1].footnote_id) == ("1", "fn-1")
+    assert document.footnotes["fn-1"][0].elements[0].content == "The footnote\n"
+
+
+def test_styles_are_shared():
+    document = model.from_dict(
+        {
+            "body": {
+                "content": [
+                    paragraph(text_run("a", bold=True), code("b")),
+                    paragraph(text_run("c", bold=True), code("d"), text_run("e")),
+                ]
+            }
+        }
+    )
+    first, second = (p.elements for p in document.body)
+    assert first[0].style is second[0].style
+    assert first[1].style is second[1].style
+    assert second[2].style is model.PLAIN
+
+
+def test_unsupported_elements_are_kept_by_kind():
+    document = model.from_dict(
+        {
+            "body": {
+                "content": [
+                    {"startIndex": 1, "sectionBreak": {}},
+                    paragraph(text_run("x"), {"pageBreak": {}}, footnote_ref("1", "f")),
+                ]
+            }
+        }
+    )
+    section, para = document.body
+    assert section.kind == "sectionBreak"
+    assert [e.kind for e in para.elements] == [
+        "textRun",
+        "pageBreak",
+        "footnoteReference",
+    ]
+
+
+def test_lists_tables_and_images():
+    document = model.from_dict(
+        {
+            "body": {
+                "content": [
+                    paragraph(text_run("item\n"), bullet=("list-1", 1)),
+                    table([[paragraph(text_run("cell\n"))], []]),
+                    paragraph(inline_image("img-1")),
+                ]
+            },
+            "lists": {
+                "list-1": {
+                    "listProperties": {
+                        "nestingLevels": [
+                            {"glyphType": "DECIMAL"},
+                            {"glyphType": "NONE"},
+                        ]
+                    }
+                }
+            },
+            "inlineObjects": {
+                "img-1": {
+                    "inlineObjectProperties": {
+                        "embeddedObject": {
+                            "title": "Title",
+                            "imageProperties": {"contentUri": "https://img/1"},
+                        }
+                    }
+                }
+            },
+        }
+    )
+    item, grid, picture = document.body
+    assert (item.bullet.list_id, item.bullet.level) == ("list-1", 1)
+    assert document.lists == {"list-1": [True, False]}
+    assert grid.kind == "table" and len(grid.rows) == 1
+    assert grid.rows[0][0][0].elements[0].content == "cell\n" and grid.rows[0][1] == []
+    assert picture.elements[0].object_id == "img-1"
+    image = document.images["img-1"]
+    assert (image.uri, image.description) == ("https://img/1", "Title")
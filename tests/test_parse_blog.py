@@ -0,0 +1,163 @@
+import parse_blog
+import pytest
+from parse_blog import MyDoc
+from styles import StyleStack
+from test_walk_blog import document
+from test_walk_blog import paragraph
+from test_walk_blog import text_run
+
+
+def test_parse_collects_text_runs(monkeypatch):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", set())
+    parser = MyDoc()
+    parser.parse_document(document(paragraph(text_run("One\n"), text_run("Two\n"))))
+    assert [content for _, content in parser.content] == ["One\n", "Two\n"]
+    assert (parser.title, parser.documentId) == ("Test Document", "doc-1")
+    assert parser.ancestors == []
+
+
+def test_handlers_are_found_once_per_class():
+    class Recorder(MyDoc):
+        def parse_textRun(self, element, element_name):
+            self.content.append(element_name)
+
+    assert MyDoc().handlers is MyDoc().handlers
+    assert Recorder().handlers["textRun"] is Recorder.parse_textRun
+    assert MyDoc().handlers["textRun"] is MyDoc.parse_textRun
+
+
+def test_debug_paths(monkeypatch, capsys):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", {"parse", "upn"})
+    MyDoc().parse_document(
+        {"title": "T", "body": {"content": [{"startIndex": 1, "sectionBreak": {}}]}}
+    )
+    out = capsys.readouterr().out.splitlines()
+    assert out[:3] == [
+        "Parsing document",
+        "Handling document.title",
+        "Handling document.body",
+    ]
+    assert "Handling document.content.structuralElement.sectionBreak" in out
+    assert "Didn't handle document.revisionId" not in out
+    assert out[-1] == "Parse of document complete"
+
+
+def nested_tables(depth):
+    """
+    A document of a table nested `depth` deep, with text at the bottom,
+    as plain dicts (converting it to ObjectDicts would recurse).
+    """
+    content = [paragraph(text_run("Deep\n"))]
+    for _ in range(depth):
+        cell = {"content": content}
+        content = [{"table": {"tableRows": [{"tableCells": [cell]}]}}]
+    return {"title": "Nested", "body": {"content": content}}
+
+
+def test_iterative_parse_is_equivalent(monkeypatch, capsys):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", {"parse", "upn"})
+    doc = nested_tables(2)
+    doc["body"]["content"].insert(0, paragraph(text_run("First\n")))
+    results = []
+    for iterative in (False, True):
+        parser = MyDoc(iterative=iterative)
+        parser.parse_document(doc)
+        results.append((capsys.readouterr().out, parser.content, parser.ancestors))
+    assert results[0] == results[1]
+    assert [content for _, content in results[0][1]] == ["First\n", "Deep\n"]
+    assert "Handling document.content.structuralElement.table.tableRow.tableCells" in (
+        results[0][0]
+    )
+
+
+def test_lists_are_parsed_without_tracing(monkeypatch):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", set())
+    doc = nested_tables(2)
+    doc["body"]["content"].insert(0, paragraph(text_run("First\n")))
+    seen = []
+
+    class Recorder(MyDoc):
+        def parse_textRun(self, element, element_name):
+            seen.append(self.path(element_name))
+            super().parse_textRun(element, element_name)
+
+    for iterative in (False, True):
+        parser = Recorder(iterative=iterative)
+        parser.parse_document(doc)
+        assert [content for _, content in parser.content] == ["First\n", "Deep\n"]
+        assert parser.ancestors == []
+    assert seen[:2] == seen[2:]
+    assert seen[1] == (
+        "document.content.structuralElement.table.tableRow.tableCell"
+        ".structuralElement.table.tableRow.tableCell.structuralElement"
+        ".paragraph.paragraphElement.textRun"
+    )
+
+
+def test_iterative_parse_is_not_limited_by_recursion(monkeypatch):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", set())
+    doc = nested_tables(2000)
+    with pytest.raises(RecursionError):
+        MyDoc().parse_document(doc)
+    parser = MyDoc(iterative=True)
+    parser.parse_document(doc)
+    assert [content for _, content in parser.content] == ["Deep\n"]
+
+
+def test_events_are_generated_lazily(monkeypatch):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", set())
+    parser = MyDoc()
+    events = parser.events(
+        document(paragraph(text_run("A\n")), paragraph(text_run("B\n")))
+    )
+    path, node = next(events)
+    assert (path, node) == (("document", "title"), "Test Document")
+    paths = []
+    for path, node in events:
+        paths.append(path)
+        if path[-1] == "textRun":
+            break
+    assert paths[:2] == [("document", "body"), ("document", "content", "content")]
+    assert paths[-1] == (
+        "document",
+        "content",
+        "structuralElement",
+        "paragraph",
+        "paragraphElement",
+        "textRun",
+    )
+    # Each hook is called after its event is consumed.
+    assert parser.content == []
+    next(events)
+    assert [content for _, content in parser.content] == ["A\n"]
+    events.close()
+    assert parser.ancestors == [] and parser.deferred == []
+    assert "parse" not in vars(parser)
+
+
+@pytest.mark.parametrize("iterative", [False, True])
+def test_styles_last_as_long_as_paragraphs_and_runs(monkeypatch, iterative):
+    monkeypatch.setattr(parse_blog, "DEBUG_FEATURE_FLAGS", set())
+
+    class RecordingStack(StyleStack):
+        def pop(self):
+            popped.append(self["bold"])
+            return super().pop()
+
+    class StyleRecorder(MyDoc):
+        def parse_textRun(self, element, element_name):
+            named_styles.append(self.p_styles["namedStyleType"])
+            super().parse_textRun(element, element_name)
+
+    named_styles, popped = [], []
+    parser = StyleRecorder(iterative)
+    parser.t_styles = RecordingStack("text")
+    parser.parse_document(
+        document(
+            paragraph(text_run("a", bold=True), text_run("b"), style="HEADING_1"),
+            {"paragraph": {"elements": [text_run("c")]}},
+        )
+    )
+    assert named_styles == ["HEADING_1", "HEADING_1", None]
+    assert popped == [True, None, None]
+    assert len(parser.p_styles.stack) == len(parser.t_styles.stack) == 1
@@ -0,0 +1,127 @@
+import pytest
+import docs
+import serve
+from docs import SQLDoc
+from hu import ObjectDict as OD
+from jinja2 import DictLoader
+from jinja2 import Environment
+
+
+@pytest.fixture
+def client(docs_db, monkeypatch):
+    templates = {"blog-post.html": "<h1>{{ post.title }}</h1>{{ post.content }}"}
+    env = Environment(loader=DictLoader(templates))
+    monkeypatch.setattr(serve, "env", env)
+    serve.page_cache.clear()
+    doc = SQLDoc("doc-1")
+    doc.save(OD({"documentId": "doc-1", "title": "Cached Post", "body": {}}))
+    doc.set_html("<p>first</p>", "Cached Post")
+    return serve.app.test_client()
+
+
+def test_page_by_slug_and_id(client):
+    for url in ("/blog/cached-post", "/blog/doc-1"):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert b"<p>first</p>" in response.data
+    assert client.get("/blog/no-such-post").status_code == 404
+
+
+def test_conditional_get(client):
+    response = client.get("/blog/doc-1")
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+    again = client.get(
+        "/blog/doc-1", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert again.status_code == 304
+
+
+def test_pages_are_cached_and_invalidated(client, monkeypatch):
+    client.get("/blog/cached-post")
+    calls = []
+    original = serve.render_page
+    monkeypatch.setattr(
+        serve, "render_page", lambda key: calls.append(key) or original(key)
+    )
+    assert b"first" in client.get("/blog/cached-post").data
+    assert calls == []
+    SQLDoc("doc-1").set_html("<p>second</p>", "Cached Post")
+    assert b"second" in client.get("/blog/cached-post").data
+    assert calls == ["cached-post"]
+
+
+def test_changes_from_other_processes_are_noticed(client, monkeypatch):
+    client.get("/blog/doc-1")
+    with docs.connection() as conn:
+        conn.execute(
+            "UPDATE documents SET html='<p>elsewhere</p>', version=version+1"
+        )
+        conn.commit()
+    assert b"first" in client.get("/blog/doc-1").data
+    monkeypatch.setattr(serve, "PAGE_CACHE_TTL", -1)
+    assert b"elsewhere" in client.get("/blog/doc-1").data
+
+
+def test_articles_are_paginated(client):
+    for n in range(2, 6):
+        SQLDoc(f"doc-{n}").save(
+            OD({"documentId": f"doc-{n}", "title": f"Post {n}", "body": {}})
+        )
+    ids, url = [], "/api/v1/articles?limit=2"
+    while url:
+        data = client.get(url).get_json()
+        ids.extend(row[1] for row in data["articles"])
+        url = data["next"] and f"/api/v1/articles?limit=2&after={data['next']}"
+    assert ids == ["doc-1", "doc-2", "doc-3", "doc-4", "doc-5"]
+    assert client.get("/api/v1/articles?limit=0").status_code == 400
+    assert client.get("/api/v1/articles?after=garbage").status_code == 400
+    bad_cursor = docs.encode_cursor([{}])
+    assert client.get(f"/api/v1/articles?after={bad_cursor}").status_code == 400
+
+
+def test_articles_release_their_connection_before_streaming(client, docs_db):
+    response = client.get("/api/v1/articles", buffered=False)
+    # Both of the pool's connections are free while the body is unread.
+    with docs.connection(), docs.connection():
+        body = b"".join(response.response)
+    assert b"doc-1" in body
+
+
+def test_busy_database_is_503(client, monkeypatch):
+    def busy(*args, **kw):
+        raise docs.PoolTimeout("No database connection free")
+
+    monkeypatch.setattr(docs.SQLDoc, "by_slug", busy)
+    response = client.get("/blog/doc-1")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_unrendered_posts_are_streamed(client):
+    SQLDoc("doc-2").save(
+        OD(
+            {
+                "documentId": "doc-2",
+                "title": "Fresh Post",
+                "body": {
+                    "content": [
+                        {
+                            "paragraph": {
+                                "elements": [
+                                    {"textRun": {"content": "Live\n", "textStyle": {}}}
+                                ],
+                                "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+                            }
+                        }
+                    ]
+                },
+            }
+        )
+    )
+    response = client.get("/blog/fresh-post", buffered=False)
+    assert response.is_streamed
+    body = b"".join(response.response).decode()
+    assert body.startswith("<h1>Fresh Post</h1>")
+    assert "Live" in body
+    assert "fresh-post" not in serve.page_cache
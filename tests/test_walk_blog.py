@@ -0,0 +1,440 @@
+import html as htmllib
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import doc_utils
+import docs
+import highlight
+import model
+import pytest
+import walk_blog
+from assets import Asset
+from docs import SQLDoc
+from hu import ObjectDict as OD
+from walk_blog import Renderer
+
+
+def text_of(html, unescape=True):
+    """
+    The HTML without the spans added by syntax highlighting.
+    """
+    text = re.sub(r"</?span[^>]*>", "", html)
+    return htmllib.unescape(text) if unescape else text
+
+
+def text_run(content, **style):
+    return {"textRun": {"content": content, "textStyle": style}}
+
+
+def code(content):
+    return text_run(content, weightedFontFamily={"fontFamily": "Consolas"})
+
+
+def footnote_ref(number, footnote_id):
+    return {
+        "footnoteReference": {"footnoteNumber": number, "footnoteId": footnote_id}
+    }
+
+
+def paragraph(*elements, style="NORMAL_TEXT", bullet=None):
+    result = {
+        "startIndex": 1,
+        "endIndex": 2,
+        "paragraph": {
+            "elements": list(elements),
+            "paragraphStyle": {"namedStyleType": style},
+        },
+    }
+    if bullet is not None:
+        list_id, level = bullet
+        result["paragraph"]["bullet"] = {"listId": list_id, "nestingLevel": level}
+    return result
+
+
+def table(*rows):
+    return {
+        "table": {
+            "tableRows": [
+                {"tableCells": [{"content": cell} for cell in row]} for row in rows
+            ]
+        }
+    }
+
+
+def inline_image(object_id):
+    return {"inlineObjectElement": {"inlineObjectId": object_id}}
+
+
+def document(*content, footnotes=None, lists=None, images=None):
+    return OD(
+        {
+            "documentId": "doc-1",
+            "revisionId": "rev-1",
+            "title": "Test Document",
+            "body": {"content": list(content)},
+            "footnotes": footnotes or {},
+            "lists": lists or {},
+            "inlineObjects": images or {},
+        }
+    )
+
+
+SAMPLE = document(
+    paragraph(text_run("A Heading\n"), style="HEADING_1"),
+    paragraph(text_run("Some "), text_run("bold", bold=True), text_run(" text\n")),
+    paragraph(code("# snippet sample-1\n")),
+    paragraph(code("x = 1\n")),
+    paragraph(text_run("Noted"), footnote_ref("1", "fn-1"), text_run("\n")),
+    footnotes={"fn-1": {"content": [paragraph(text_run("The footnote\n"))]}},
+)
+
+
+def test_render():
+    renderer = Renderer()
+    html = renderer.render(SAMPLE)
+    assert '<h1 class="normal_text">A Heading\n</h1>' in html
+    assert '<span class="ts-1">bold</span>' in html
+    assert html.endswith("<style>\n.ts-1 {font-weight:bold}\n</style>\n")
+    assert "<code>\n# snippet sample-1\nx = 1\n  </code>" in text_of(html)
+    assert '<a href="#footnote-1">[1]</a>' in html
+    assert '<li id="footnote-1">' in html and "The footnote" in html
+    assert renderer.snippet_names == ["sample"]
+    assert renderer.errors == []
+
+
+def test_errors_are_collected():
+    renderer = Renderer()
+    html = renderer.render(
+        document(
+            paragraph(code("print('untagged')\n")),
+            paragraph(text_run("Odd\n"), style="NO_SUCH_STYLE"),
+        )
+    )
+    assert "print('untagged')" in text_of(html) and "Odd" in html
+    assert [error.kind for error in renderer.errors] == ["snippet"]
+    assert [warning.kind for warning in renderer.warnings] == ["style"]
+
+
+def test_renderers_share_no_state():
+    expected = Renderer().render(SAMPLE)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: Renderer().render(SAMPLE), range(20)))
+    assert results == [expected] * 20
+
+
+def test_render_all(docs_db, capsys):
+    for n in range(4):
+        doc = document(paragraph(text_run(f"Post {n}\n")))
+        doc.documentId = f"doc-{n}"
+        doc.title = f"Post {n}"
+        SQLDoc(doc.documentId).save(doc)
+    broken = document(paragraph(code("untagged = True\n")))
+    broken.documentId = "broken"
+    SQLDoc("broken").save(broken)
+    with pytest.raises(SystemExit) as exc_info:
+        walk_blog.render_all(["render-all", "-w", "2", "-b", "2"])
+    assert "broken" in str(exc_info.value)
+    assert "Rendered 4 of 5 document(s)" in capsys.readouterr().out
+    for n in range(4):
+        assert f"Post {n}" in SQLDoc(f"doc-{n}").load(fields=("html",)).html
+    assert SQLDoc("broken").load(fields=("html",)).html is None
+
+
+def test_unchanged_documents_are_not_rerendered(docs_db, capsys, monkeypatch):
+    doc = document(paragraph(text_run("Version one\n")))
+    SQLDoc("doc-1").save(doc)
+    walk_blog.render_all(["render-all", "-w", "1"])
+    assert "Rendered 1 of 1" in capsys.readouterr().out
+    walk_blog.render_all(["render-all", "-w", "1"])
+    assert "Rendered 0 of 0" in capsys.readouterr().out
+    walk_blog.load(["load", "doc-1"])
+    assert "up to date" in capsys.readouterr().out
+    walk_blog.render_all(["render-all", "-w", "1", "--force"])
+    assert "Rendered 1 of 1" in capsys.readouterr().out
+
+    doc = document(paragraph(text_run("Version two\n")))
+    SQLDoc("doc-1").save(doc)
+    walk_blog.load(["load", "doc-1"])
+    assert "Version two" in SQLDoc("doc-1").load(fields=("html",)).html
+
+    monkeypatch.setattr(walk_blog, "RENDERER_VERSION", "next")
+    assert list(docs.Documents().stale(walk_blog.renderer_version())) == ["doc-1"]
+    walk_blog.load(["load", "doc-1"])
+    assert "up to date" not in capsys.readouterr().out
+    assert list(docs.Documents().stale(walk_blog.renderer_version())) == []
+
+    # Installing or upgrading Pygments changes highlighted code.
+    monkeypatch.setattr(highlight, "version", lambda: "99.0")
+    assert walk_blog.renderer_version() == "next/pygments-99.0"
+    walk_blog.load(["load", "doc-1"])
+    assert "up to date" not in capsys.readouterr().out
+
+
+def test_rows_without_hashes_are_rendered_once(docs_db, capsys):
+    for document_id in ("doc-1", "doc-2"):
+        SQLDoc(document_id).save(document(paragraph(text_run("Old\n"))))
+    with docs.connection() as conn:
+        conn.execute("UPDATE documents SET content_hash=NULL")
+        conn.commit()
+    walk_blog.load(["load", "doc-1"])
+    walk_blog.render_all(["render-all", "-w", "1", "doc-2"])
+    assert list(docs.Documents().stale(walk_blog.renderer_version())) == []
+    capsys.readouterr()
+    walk_blog.load(["load", "doc-1"])
+    assert "up to date" in capsys.readouterr().out
+
+
+def test_rendering_is_streamed():
+    chunks = Renderer().stream(SAMPLE)
+    assert next(chunks).startswith("<h1")
+    assert "</ol>" in "".join(chunks)
+
+
+def test_view_writes_as_it_renders(docs_db, capsys):
+    SQLDoc("doc-1").save(document(paragraph(text_run("Viewed\n"))))
+    walk_blog.view(["view", "doc-1"])
+    assert "Viewed" in capsys.readouterr().out
+
+
+def test_styles_compile_to_shared_classes():
+    runs = [
+        text_run("a", bold=True, fontSize={"magnitude": 11, "unit": "PT"}),
+        text_run("b", italic=True),
+        text_run("c", fontSize={"magnitude": 11, "unit": "PT"}, bold=True),
+        text_run("d\n"),
+    ]
+    renderer = Renderer()
+    html = renderer.render(document(paragraph(*runs), paragraph(*runs)))
+    assert html.count('<span class="ts-1">') == 4
+    assert html.count('<span class="ts-2">') == 2
+    assert "ts-3" not in html
+    assert ".ts-1 {font-weight:bold; font-size:11pt}" in html
+    assert "style=" not in html
+
+
+def test_classification():
+    tags = doc_utils.classify_document(model.from_dict(SAMPLE))
+    assert list(tags) == [
+        doc_utils.HEADING,
+        doc_utils.NORMAL,
+        doc_utils.CODE,
+        doc_utils.CODE,
+        doc_utils.NORMAL,
+        doc_utils.NORMAL,  # the footnote's paragraph
+    ]
+
+
+def test_classification_is_cached_with_json(docs_db, monkeypatch):
+    SQLDoc("doc-1").save(SAMPLE)
+    expected = Renderer().render(SAMPLE)
+    _, _, tags = walk_blog.load_document(SQLDoc("doc-1"))
+    assert SQLDoc("doc-1").load(fields=("tags",)).tags == doc_utils.encode_tags(tags)
+
+    def classify_document(document):
+        raise AssertionError("classified again")
+
+    monkeypatch.setattr(walk_blog, "classify_document", classify_document)
+    _, document, cached = walk_blog.load_document(SQLDoc("doc-1"))
+    assert cached == tags
+    assert Renderer().render(document, cached) == expected
+
+
+def test_footnotes_are_cached_by_revision():
+    walk_blog.footnote_cache.clear()
+
+    def doc(note, revision="rev-1"):
+        result = document(
+            paragraph(text_run("A"), footnote_ref("1", "fn-1")),
+            paragraph(text_run("B"), footnote_ref("2", "fn-2")),
+            footnotes={
+                "fn-1": {"content": [paragraph(text_run(note, italic=True))]},
+                "fn-2": {"content": [paragraph(text_run("Two\n"))]},
+            },
+        )
+        result.revisionId = revision
+        return result
+
+    expected = Renderer().render(doc("One"))
+    assert len(walk_blog.footnote_cache) == 1
+    assert '<li id="footnote-1"><p class="normal_text">\n<span class="ts-1">' in expected
+    assert expected.endswith(".ts-1 {font-style:italic}\n</style>\n")
+    # The same revision's footnotes come from the cache, styles included.
+    assert Renderer().render(doc("Changed")) == expected
+    assert "Changed" in Renderer().render(doc("Changed", revision="rev-2"))
+
+
+def test_footnotes_with_side_effects_are_not_cached():
+    walk_blog.footnote_cache.clear()
+    doc = document(
+        paragraph(text_run("A"), footnote_ref("1", "fn-1")),
+        footnotes={
+            "fn-1": {
+                "content": [
+                    paragraph(code("untagged = True\n")),
+                    paragraph(text_run("Second\n")),
+                ]
+            }
+        },
+    )
+    doc.revisionId = "rev-1"
+    renderer = Renderer()
+    html = renderer.render(doc)
+    assert "untagged" in text_of(html) and "Second" in html
+    assert [error.kind for error in renderer.errors] == ["snippet"]
+    assert len(walk_blog.footnote_cache) == 0
+
+
+def test_text_is_escaped():
+    html = Renderer().render(
+        document(
+            paragraph(
+                text_run("if a < b & c:", link={"url": 'http://x/?a=1&b="2"'}),
+                text_run(" <script>\n"),
+            ),
+            paragraph(code("# snippet escape-1\n")),
+            paragraph(code("print(1 < 2)\n")),
+        )
+    )
+    link = '<a href="http://x/?a=1&amp;b=&#34;2&#34;">if a &lt; b &amp; c:</a>'
+    assert link in html
+    assert " &lt;script&gt;" in html
+    assert "print(1 &lt; 2)" in text_of(html, unescape=False)
+
+
+def test_hostile_styles_are_not_rendered():
+    hostile = "</style><script>alert(1)</script>"
+    html = Renderer().render(
+        document(
+            paragraph(
+                text_run("Safe", bold=True, weightedFontFamily={"fontFamily": hostile}),
+                text_run(" and sound", weightedFontFamily={"fontFamily": "Open Sans"}),
+            )
+        )
+    )
+    assert "<script>" not in html
+    assert ".ts-1 {font-weight:bold}" in html
+    assert ".ts-2 {font-family:Open Sans}" in html
+
+
+def test_all_heading_levels():
+    html = Renderer().render(
+        document(
+            *(
+                paragraph(text_run(f"Level {n}\n"), style=f"HEADING_{n}")
+                for n in range(1, 7)
+            )
+        )
+    )
+    for n in range(1, 7):
+        assert f'<h{n} class="normal_text">Level {n}\n</h{n}>' in html
+
+
+def test_titles_and_unknown_styles_are_stored(docs_db, capsys):
+    SQLDoc("doc-1").save(
+        document(
+            paragraph(text_run("The Title\n"), style="TITLE"),
+            paragraph(text_run("The Subtitle\n"), style="SUBTITLE"),
+            paragraph(text_run("Odd\n"), style="NO_SUCH_STYLE"),
+        )
+    )
+    walk_blog.load(["load", "doc-1"])
+    html = SQLDoc("doc-1").load(fields=("html",)).html
+    assert '<h1 class="title">The Title\n</h1>' in html
+    assert '<p class="subtitle">The Subtitle\n</p>' in html
+    assert '<p class="normal_text">\nOdd\n\n</p>' in html
+    assert "Unsupported paragraph style 'NO_SUCH_STYLE'" in capsys.readouterr().err
+    walk_blog.render_all(["render-all", "-w", "1", "--force"])
+    out, err = capsys.readouterr()
+    assert "Rendered 1 of 1" in out and "warning: style" in err
+
+
+def test_nested_lists():
+    numbered = {"glyphType": "DECIMAL"}
+    bulleted = {"glyphSymbol": "-"}
+    lists = {
+        "list-1": {"listProperties": {"nestingLevels": [numbered, bulleted]}},
+        "list-2": {"listProperties": {"nestingLevels": [bulleted]}},
+    }
+    renderer = Renderer()
+    html = renderer.render(
+        document(
+            paragraph(text_run("One\n"), bullet=("list-1", 0)),
+            paragraph(text_run("One.a\n"), bullet=("list-1", 1)),
+            paragraph(text_run("One.b\n"), bullet=("list-1", 1)),
+            paragraph(text_run("Two\n"), bullet=("list-1", 0)),
+            paragraph(text_run("Other\n"), bullet=("list-2", 0)),
+            paragraph(text_run("After\n")),
+            lists=lists,
+        )
+    )
+    assert html.startswith(
+        "<ol>\n<li>One\n<ul>\n<li>One.a\n</li>\n<li>One.b\n</li>\n</ul>\n"
+        "</li>\n<li>Two\n</li>\n</ol>\n<ul>\n<li>Other\n</li>\n</ul>\n<p"
+    )
+    assert renderer.errors == []
+
+
+def test_lists_start_deep():
+    html = Renderer().render(
+        document(
+            paragraph(text_run("deep\n"), bullet=("list-1", 2)),
+            paragraph(text_run("top\n"), bullet=("list-1", 0)),
+        )
+    )
+    assert html.startswith(
+        "<ul>\n<li><ul>\n<li><ul>\n<li>deep\n</li>\n</ul>\n</li>\n</ul>\n"
+        "</li>\n<li>top\n</li>\n</ul>\n"
+    )
+
+
+def test_code_after_a_list_closes_it():
+    renderer = Renderer()
+    html = renderer.render(
+        document(
+            paragraph(text_run("item\n"), bullet=("list-1", 0)),
+            paragraph(code("# snippet after-1\n")),
+            paragraph(text_run("After\n")),
+        )
+    )
+    assert html.startswith('<ul>\n<li>item\n</li>\n</ul>\n<pre class="highlight">')
+    assert "</pre>\n<p" in html
+
+
+def test_tables():
+    html = Renderer().render(
+        document(
+            table(
+                [[paragraph(text_run("a\n"))], [paragraph(text_run("b", bold=True))]],
+                [[paragraph(code("x < 1\n"))], []],
+            ),
+        )
+    )
+    assert html.startswith('<table class="doc_table">\n<tr><td><p class="normal_text">')
+    assert '<span class="ts-1">b</span>' in html
+    assert "x &lt; 1" in text_of(html, unescape=False)
+    assert html.count("<td>") == 4 and "<td></td></tr>\n</table>\n" in html
+
+
+def test_images():
+    images = {
+        "img-1": {
+            "inlineObjectProperties": {
+                "embeddedObject": {
+                    "description": 'A "picture"',
+                    "imageProperties": {"contentUri": "https://img/1?a&b"},
+                }
+            }
+        }
+    }
+    renderer = Renderer(assets={("doc-1", "img-1"): Asset("abc", "png")})
+    html = renderer.render(
+        document(
+            paragraph(text_run("See "), inline_image("img-1"), inline_image("img-2")),
+            images=images,
+        )
+    )
+    assert (
+        '<img src="/assets/images/docs/abc.png" alt="A &#34;picture&#34;">' in html
+    )
+    assert "https://img" not in html
+    assert [error.kind for error in renderer.errors] == ["image"]
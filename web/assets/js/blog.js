@@ -2,8 +2,11 @@ $(document).ready(function() {
 
 	/* ======= Highlight.js Plugin ======= */
     /* Ref: https://highlightjs.org/usage/ */
-    $('pre code').each(function(i, block) {
-	    hljs.highlightBlock(block);
-	 });
+    /* Code from the renderer is already highlighted on the server. */
+    if (window.hljs) {
+        $('pre:not(.highlight) code').each(function(i, block) {
+	        hljs.highlightBlock(block);
+	    });
+    }
 
 });